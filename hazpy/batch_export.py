@@ -17,18 +17,28 @@ How to use: Define your input folder containing hpr files and define
 
 """
 # Standard library imports
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import timedelta
+import multiprocessing
 import os
 from pathlib import Path
+import queue
 import sys
+import threading
 import time
 import uuid
 
-# Third party imports
-import pandas as pd
-
 # Local application imports
+from connectionpool import getConnectionPool
+from exportjournal import ExportJournal
+from hllmetadata import HLLMetadataCollector, HLLMetadataStore
+from restorecache import RestoreRegistry
 from studyregion import StudyRegion
+from studyregiondataframe import writeGeoPackage
+
+#Set in each worker process by initExportWorker when running with --jobs...
+_restoreSemaphore = None
 
 
 def getAnalysisLogDate(logfile):
@@ -64,7 +74,7 @@ def getAnalysisLogDate(logfile):
         print('\nUnexpected error getflAnalysisLogDate')
         print(e)
 
-def exportHPR(hprFile, outputDir, deleteDB=1, deleteTempDir=1, outCsv=1, outShapefile=1, outReport=0, outJson=1):
+def exportHPR(hprFile, outputDir, deleteDB=1, deleteTempDir=1, outCsv=1, outShapefile=1, outReport=0, outJson=1, outGeoPackage=0, dbSuffix='', registry=None, journal=None, metadataStore=None):
     """This tool will batch export hpr files from batch_input to batch_output.
 
         Keyword Arguments:
@@ -76,19 +86,45 @@ def exportHPR(hprFile, outputDir, deleteDB=1, deleteTempDir=1, outCsv=1, outShap
                 outShapefile: int -- if 1: export Zipped Shapefiles; if 0: don't
                 outReport: int -- if 1: export PDF files; if 0: don't
                 outJson: int -- if 1: export GeoJSON files; if 0: don't
+                outGeoPackage: int -- if 1: export a GeoPackage of the results, damaged facilities and hazard layers; if 0: don't
+                dbSuffix: str -- appended to the restored bk_ database and temp folder names to keep parallel exports apart
+                registry: RestoreRegistry -- if given, restored databases are kept and reused across runs (default: None)
+                journal: ExportJournal -- if given, exported artifacts are journaled and verified ones are skipped (default: None)
+                metadataStore: HLLMetadataStore -- if given, the HLL metadata is published to the batch store (default: None)
 
         Notes: The hazpy legacy code has only been tested against USGS FIM
             Flood HPR files. It does not process HPR files in subdirectories
             of the main directory.
             
     """
+    hpr = prepareHPR(hprFile, outputDir, dbSuffix=dbSuffix)
+    if hpr is not None and isHPRExported(hpr, journal, metadataStore, outCsv=outCsv, outShapefile=outShapefile, outReport=outReport, outJson=outJson, outGeoPackage=outGeoPackage):
+        hpr = None
+    if hpr is not None:
+        stageHPR(hpr, registry=registry)
+        if exportHPRResults(hpr, outCsv=outCsv, outShapefile=outShapefile, outReport=outReport, outJson=outJson, outGeoPackage=outGeoPackage, journal=journal, metadataStore=metadataStore):
+            cleanupHPR(hpr, deleteDB=deleteDB, deleteTempDir=deleteTempDir, registry=registry)
+    print("-----------------------------------------------------------------------------------------------------------------------------")
+
+
+def prepareHPR(hprFile, outputDir, dbSuffix=''):
+    """Reads an hpr file and checks that its Hazus version is supported
+
+        Keyword Arguments:
+            hprFile: str -- the path to the hpr file
+            outputDir: str -- a directory to write export files to
+            dbSuffix: str -- appended to the restored bk_ database and temp folder names
+
+        Returns:
+            hpr: StudyRegion -- the Hazus Package Region, or None if it can not be processed
+    """
     try:
-        hpr = StudyRegion(studyRegion=None, hprFilePath=hprFile, outputDir=outputDir)
+        hpr = StudyRegion(studyRegion=None, hprFilePath=hprFile, outputDir=outputDir, dbSuffix=dbSuffix)
     except Exception as e:
         print('Unexpected error exporting HPR.')
         print(e)
-        
-    
+        return None
+
     print("-----------------------------------------------------------------------------------------------------------------------------")
     print(f"User Defined hprFilePath: {hpr.hprFilePath}") #debug
     print(f"User Defined outputDir = {hpr.outputDir}") #debug
@@ -100,615 +136,1019 @@ def exportHPR(hprFile, outputDir, deleteDB=1, deleteTempDir=1, outCsv=1, outShap
 
     #DO NOT PROCESS HPR BELOW VERSION 3.1...
     if hpr.HazusVersion in ['Hazus 3.1','Hazus 4.0','Hazus 4.1','Hazus 4.2','Hazus 4.2.1','Hazus 4.2.2','Hazus 4.2.3','Hazus 5.0','Hazus 5.1']:
-        try:
-            hpr.restoreHPR()
-        except Exception as e:
-            print(e)
+        return hpr
+    print('\nHPR version not supported. HPR not processed')
+    return None
 
-        try:
-            print('\nGetting Return Periods...')
-            hpr.getHazardsScenariosReturnPeriods()
-            print(hpr.HazardsScenariosReturnPeriods) #debug
-
-            #CREATE A DIRECTORY FOR THE OUTPUT FOLDERS...
-            outputPath = hpr.outputDir
-            if not os.path.exists(outputPath):
-                os.mkdir(outputPath)
-                        
-            #CREATE HAZUS LOSS LIBRARY (HLL) METADATA TABLES...
-            hllMetadataEvent = pd.DataFrame(columns=['id',
-                                                    'name',
-                                                    'geom',
-                                                    'date',
-                                                    'image'])
-
-            hllMetadataScenario = pd.DataFrame(columns=['id',
-                                                        'name',
-                                                        'hazard',
-                                                        'analysisType',
-                                                        'date',
-                                                        'source',
-                                                        'modifiedInventory',
-                                                        'geographicCount',
-                                                        'geographicUnit',
-                                                        'losses',
-                                                        'lossesUnit',
-                                                        'meta',
-                                                        'event',
-                                                        'geom'])
-
-            hllMetadataDownload = pd.DataFrame(columns=['id',
-                                                        'category',
-                                                        'subcategory',
-                                                        'name',
-                                                        'icon',
-                                                        'link',
-                                                        'file',
-                                                        'meta',
-                                                        'analysis'])
-
-
-            #ITERATE OVER THE HAZARD, SCENARIO, RETURNPERIOD AVAILABLE COMBINATIONS...
-            for hazard in hpr.HazardsScenariosReturnPeriods:
-                print()
-                print(f"Hazard: {hazard['Hazard']}") #debug
+
+def isHPRExported(hpr, journal, metadataStore=None, **outputs):
+    """Checks the journal for an hpr that was already exported with the selected outputs
+
+        Keyword Arguments:
+            hpr: StudyRegion -- a Hazus Package Region from prepareHPR
+            journal: ExportJournal -- the export journal, or None
+            metadataStore: HLLMetadataStore -- if given, a skipped hpr missing from the batch store is added from its csv files (default: None)
+            outputs: keyword arguments of the selected outputs (outCsv, outShapefile, outReport, outJson, outGeoPackage)
+
+        Returns:
+            exported: bool -- True if the hpr can be skipped
+    """
+    if journal is None:
+        return False
+    try:
+        if journal.isHPRComplete(journal.getHPRKey(hpr), outputs):
+            print(f'Skipping {hpr.hprFilePath}, already exported')
+            if metadataStore is not None and not metadataStore.hasHPR(hpr.outputDir.name):
+                metadataStore.publishDirectory(hpr.outputDir.name, hpr.outputDir)
+            return True
+    except Exception as e:
+        print('Unable to read the export journal')
+        print(e)
+    return False
+
+
+def exportArtifact(journal, hprKey, artifactKey, path, writer, *args):
+    """Writes an export artifact unless the journal holds a verified copy of it
+
+        Keyword Arguments:
+            journal: ExportJournal -- the export journal, or None to always write
+            hprKey: str -- the hpr key (ExportJournal.getHPRKey)
+            artifactKey: tuple -- the hazard, scenario and return period of the artifact
+            path: str -- the file the writer produces
+            writer: function -- the export method, i.e. results.toCSV
+            args: the arguments passed to writer
+
+        Returns:
+            written: bool -- False if the journaled artifact was reused
+    """
+    if journal is None:
+        writer(*args)
+        return True
+    hazard, scenario, returnPeriod = artifactKey
+    return journal.exportArtifact(hprKey, hazard, scenario, returnPeriod, path, lambda: writer(*args))
+
+
+def stageHPR(hpr, unzip=True, registry=None):
+    """Unzips an hpr file and restores its bk file to SQL Server
+
+        Keyword Arguments:
+            hpr: StudyRegion -- a Hazus Package Region from prepareHPR
+            unzip: bool -- if False, the hpr is expected to be unzipped already (default: True)
+            registry: RestoreRegistry -- if given, a database restored from the same .bk is reused (default: None)
+    """
+    try:
+        #limit concurrent unzip and RESTORE work across worker processes...
+        if _restoreSemaphore is not None:
+            with _restoreSemaphore:
+                hpr.restoreHPR(unzip=unzip, registry=registry)
+        else:
+            hpr.restoreHPR(unzip=unzip, registry=registry)
+    except Exception as e:
+        print(e)
+
+
+def exportHPRResults(hpr, outCsv=1, outShapefile=1, outReport=0, outJson=1, outGeoPackage=0, journal=None, metadataStore=None):
+    """Exports the results and HLL metadata of a restored hpr file
+
+        Keyword Arguments:
+            hpr: StudyRegion -- a restored Hazus Package Region
+            outCSV: int -- if 1: export CSV files; if 0: don't
+            outShapefile: int -- if 1: export Zipped Shapefiles; if 0: don't
+            outReport: int -- if 1: export PDF files; if 0: don't
+            outJson: int -- if 1: export GeoJSON files; if 0: don't
+            outGeoPackage: int -- if 1: export a GeoPackage of the results, damaged facilities and hazard layers; if 0: don't
+            journal: ExportJournal -- if given, artifacts are journaled and a rerun resumes at the first missing one (default: None)
+            metadataStore: HLLMetadataStore -- if given, the HLL metadata is also published to the batch store (default: None)
+
+        Returns:
+            success: bool -- False if the export stopped on an unexpected error
+    """
+    try:
+        outputs = {'outCsv': outCsv, 'outShapefile': outShapefile, 'outReport': outReport, 'outJson': outJson, 'outGeoPackage': outGeoPackage}
+        hprKey = None
+        if journal is not None:
+            hprKey = journal.getHPRKey(hpr)
+            journal.startHPR(hprKey, hpr.hprFilePath)
+
+        print('\nGetting Return Periods...')
+        hpr.getHazardsScenariosReturnPeriods()
+        print(hpr.HazardsScenariosReturnPeriods) #debug
+
+        #CREATE A DIRECTORY FOR THE OUTPUT FOLDERS...
+        outputPath = hpr.outputDir
+        if not os.path.exists(outputPath):
+            os.mkdir(outputPath)
+                    
+        #CREATE HAZUS LOSS LIBRARY (HLL) METADATA TABLES...
+        hllMetadata = HLLMetadataCollector()
+
+
+        #ITERATE OVER THE HAZARD, SCENARIO, RETURNPERIOD AVAILABLE COMBINATIONS...
+        for hazard in hpr.HazardsScenariosReturnPeriods:
+            print()
+            print(f"Hazard: {hazard['Hazard']}") #debug
+            
+            #SET HPR HAZARD...
+            hpr.hazard = hazard['Hazard']
+
+            #EXPORT Hazus Package Region TO GeoJSON...
+            exportPath = Path.joinpath(Path(outputPath))
+            if outJson == 1:
+                try:
+                    print('\nWriting StudyRegionBoundary to geojson...')
+                    filePath = Path.joinpath(exportPath, 'StudyRegionBoundary.geojson')
+                    if journal is None or not journal.isArtifactComplete(hprKey, hazard['Hazard'], '', '', filePath.name):
+                        studyRegionBoundary = hpr.getStudyRegionBoundary()
+                        exportArtifact(journal, hprKey, (hazard['Hazard'], '', ''), filePath, studyRegionBoundary.toGeoJSON, filePath)
+                except Exception as e:
+                    print('\nStudyRegionBoundary not available to export to geojson')
+                    print(e)
+                filePath = Path.joinpath(exportPath, 'StudyRegionBoundary.geojson')
+                #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+            else:
+                filePathRel = ''
+
+            #Event metadata...
+            #ADD ROW TO hllMetadataEvent TABLE...
+            hazardUUID = uuid.uuid4()
+            hllMetadata.append('Event', {'id':hazardUUID,
+                                         'name':hpr.regionName,
+                                         'geom':filePathRel})
+
+            #SCENARIOS/ANALYSIS
+            for scenario in hazard['Scenarios']:
+                print(f"Scenario: {scenario['ScenarioName']}") #debug
+
+                #SET HPR SCENARIO...
+                hpr.scenario = scenario['ScenarioName']
+
+                #Analysis Metadata part one of two...
+                scenarioUUID = uuid.uuid4()
+                scenarioMETA = {"Hazus Version":f"{hpr.HazusVersion}"}
+                scenarioGEOM = '' #initialize variable to be changed later
+                analysisType = 'FIX ME: Deterministic, Historic, Probabilistic' #initialize variable to be changed later
+                analysisDate = 'FIX ME: (YYYY-MM-DD)' #initialize variable to be changed later
+                scenarioSource = 'FIX ME: USER INPUT NEEDED (100 chars max)' #default value, likely to change
+                downloadLink = '' #default value
+                scenarioGeographicCount = '' #initialize variable to be changed later
+                scenarioGeographicUnit = '' #initialize variable to be changed later
+                scenarioLosses = '' #initialize variable to be changed later
+                scenarioLossesUnit = '' #initialize variable to be changed later
                 
-                #SET HPR HAZARD...
-                hpr.hazard = hazard['Hazard']
+                if hazard['Hazard'] == 'earthquake':
+                    scenarioMETA["Magnitude"] = hpr.getEarthquakeMagnitude()
+                    analysisType = hpr.getAnalysisType()
+                    if analysisType in ['Probabilistic']:
+                        scenarioSource = 'USGS National Hazard Maps'
+                    if analysisType in ['Historic', 'Deterministic']:
+                        scenarioSource = 'USGS ShakeMap'
+                        downloadLink = hpr.getEarthquakeShakemapUrl()
+                    analysisDate = hpr.getHPRFileDateTime(hpr.hprFilePath, 'AnalysisLog.txt')
+                if hazard['Hazard'] == 'flood':
+                    analysisType = 'Deterministic' #USGS FIM
+                    """i.e. 'C:\workspace\batchexportOutput\nora\nora_08\\flAnalysisLog.txt'"""
+                    logfile = Path.joinpath(Path(hpr.tempDir), scenario['ScenarioName'],'flAnalysisLog.txt')
+                    analysisDate = getAnalysisLogDate(logfile)
+                if hazard['Hazard'] == 'hurricane':
+                    analysisType = hpr.getAnalysisType()
+                if hazard['Hazard'] == 'tsunami':
+                    analysisType = 'Deterministic' 
+                    logfile = Path.joinpath(Path(hpr.tempDir),'TsunamiLog.txt')
+                    analysisDate = getAnalysisLogDate(logfile)
+
+                #RETURNPERIODS/DOWNLOAD
+                if isinstance(scenario['ReturnPeriods'], list):
+                    returnPeriods = scenario['ReturnPeriods']
+                else:
+                    returnPeriods = scenario['ReturnPeriods'].split()
+                for returnPeriod in returnPeriods:
+                    skipHPR = 0
 
-                #EXPORT Hazus Package Region TO GeoJSON...
-                exportPath = Path.joinpath(Path(outputPath))
-                if outJson == 1:
+                    #SET HPR RETURNPERIOD...
+                    hpr.returnPeriod = returnPeriod
+                    #immutable selection for the queries below...
+                    context = hpr.getContext()
+                    print(f"hazard = {hpr.hazard}, scenario = {hpr.scenario}, returnPeriod = {returnPeriod}") #debug
+                    artifactKey = (hazard['Hazard'], scenario['ScenarioName'], returnPeriod)
+
+                    #RESUME A RETURN PERIOD THAT IS ALREADY EXPORTED...
+                    if journal is not None:
+                        journaled = journal.getReturnPeriod(hprKey, *artifactKey, outputs)
+                        if journaled is not None:
+                            print('\nReturn period already exported, skipping')
+                            scenarioGeographicCount = journaled['geographicCount']
+                            scenarioGeographicUnit = journaled['geographicUnit']
+                            scenarioLosses = journaled['losses']
+                            scenarioLossesUnit = journaled['lossesUnit']
+                            scenarioSource = journaled['source']
+                            scenarioGEOM = journaled['geom']
+                            for download in journaled['downloads']:
+                                download.update({'id':uuid.uuid4(), 'analysis':scenarioUUID})
+                                hllMetadata.append('Download', download)
+                            continue
+                    downloadStart = hllMetadata.getCount('Download')
+
+                    #GET BULK OF RESULTS...
                     try:
-                        print('\nWriting StudyRegionBoundary to geojson...')
-                        studyRegionBoundary = hpr.getStudyRegionBoundary()
-                        studyRegionBoundary.toGeoJSON(Path.joinpath(exportPath, 'StudyRegionBoundary.geojson'))
+                        print('\nGet bulk of results...')
+                        #independent datasets are fetched concurrently over pooled connections...
+                        requests = {'results':'getResults',
+                                    'essentialFacilities':'getEssentialFacilities'}
+                        if outCsv == 1:
+                            requests['buildingDamageByOccupancy'] = 'getBuildingDamageByOccupancy'
+                            requests['buildingDamageByType'] = 'getBuildingDamageByType'
+                        if outShapefile == 1 or outGeoPackage == 1:
+                            requests['hazardGDF'] = 'getHazardGeoDataFrame'
+                        datasets = hpr.fetchMany(requests, context=context)
+                        results = datasets['results']
+                        essentialFacilities = datasets['essentialFacilities']
+                        if results is None or len(results) < 1:
+                            print('\nNo results found. Please check your Hazus Package Region and try again.')
+                            skipHPR = 1 #do not try processing the hpr
                     except Exception as e:
-                        print('\nStudyRegionBoundary not available to export to geojson')
                         print(e)
-                    filePath = Path.joinpath(exportPath, 'StudyRegionBoundary.geojson')
-                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                else:
-                    filePathRel = ''
-
-                #Event metadata...
-                #ADD ROW TO hllMetadataEvent TABLE...
-                hazardUUID = uuid.uuid4()
-                hllMetadataEvent = hllMetadataEvent.append({'id':hazardUUID,
-                                                            'name':hpr.dbName,
-                                                            'geom':filePathRel}, ignore_index=True)
-
-                #SCENARIOS/ANALYSIS
-                for scenario in hazard['Scenarios']:
-                    print(f"Scenario: {scenario['ScenarioName']}") #debug
-
-                    #SET HPR SCENARIO...
-                    hpr.scenario = scenario['ScenarioName']
-
-                    #Analysis Metadata part one of two...
-                    scenarioUUID = uuid.uuid4()
-                    scenarioMETA = {"Hazus Version":f"{hpr.HazusVersion}"}
-                    scenarioGEOM = '' #initialize variable to be changed later
-                    analysisType = 'FIX ME: Deterministic, Historic, Probabilistic' #initialize variable to be changed later
-                    analysisDate = 'FIX ME: (YYYY-MM-DD)' #initialize variable to be changed later
-                    scenarioSource = 'FIX ME: USER INPUT NEEDED (100 chars max)' #default value, likely to change
-                    downloadLink = '' #default value
-                    scenarioGeographicCount = '' #initialize variable to be changed later
-                    scenarioGeographicUnit = '' #initialize variable to be changed later
-                    scenarioLosses = '' #initialize variable to be changed later
-                    scenarioLossesUnit = '' #initialize variable to be changed later
-                    
-                    if hazard['Hazard'] == 'earthquake':
-                        scenarioMETA["Magnitude"] = hpr.getEarthquakeMagnitude()
-                        analysisType = hpr.getAnalysisType()
-                        if analysisType in ['Probabilistic']:
-                            scenarioSource = 'USGS National Hazard Maps'
-                        if analysisType in ['Historic', 'Deterministic']:
-                            scenarioSource = 'USGS ShakeMap'
-                            downloadLink = hpr.getEarthquakeShakemapUrl()
-                        analysisDate = hpr.getHPRFileDateTime(hpr.hprFilePath, 'AnalysisLog.txt')
-                    if hazard['Hazard'] == 'flood':
-                        analysisType = 'Deterministic' #USGS FIM
-                        """i.e. 'C:\workspace\batchexportOutput\nora\nora_08\\flAnalysisLog.txt'"""
-                        logfile = Path.joinpath(Path(hpr.tempDir), scenario['ScenarioName'],'flAnalysisLog.txt')
-                        analysisDate = getAnalysisLogDate(logfile)
-                    if hazard['Hazard'] == 'hurricane':
-                        analysisType = hpr.getAnalysisType()
-                    if hazard['Hazard'] == 'tsunami':
-                        analysisType = 'Deterministic' 
-                        logfile = Path.joinpath(Path(hpr.tempDir),'TsunamiLog.txt')
-                        analysisDate = getAnalysisLogDate(logfile)
-
-                    #RETURNPERIODS/DOWNLOAD
-                    if isinstance(scenario['ReturnPeriods'], list):
-                        returnPeriods = scenario['ReturnPeriods']
-                    else:
-                        returnPeriods = scenario['ReturnPeriods'].split()
-                    for returnPeriod in returnPeriods:
-                        skipHPR = 0
-
-                        #SET HPR RETURNPERIOD...
-                        hpr.returnPeriod = returnPeriod
-                        print(f"hazard = {hpr.hazard}, scenario = {hpr.scenario}, returnPeriod = {returnPeriod}") #debug
-
-                        #GET BULK OF RESULTS...
-                        try:
-                            print('\nGet bulk of results...')
-                            results = hpr.getResults()
-                            essentialFacilities = hpr.getEssentialFacilities()
-                            if len(results) < 1:
-                                print('\nNo results found. Please check your Hazus Package Region and try again.')
-                                skipHPR = 1 #do not try processing the hpr
-                        except Exception as e:
-                            print(e)
-                            
-                        if skipHPR == 0:
-                            #HLL Analysis/Scenario Metadata (some scenario/analysis level info requires returnperiod/download input)...
-                            geographicCountUnit = hpr.getGeographicCountUnitofResults(results)
-                            scenarioGeographicCount = geographicCountUnit[0]
-                            scenarioGeographicUnit = geographicCountUnit[1]
-                            scenarioLosses = int(hpr.getTotalEconomicLoss())
-                            scenarioLossesUnit = 'USD'
-                            if scenarioLosses >= 1000 and scenarioLosses < 1000000:
-                                scenarioLosses = str(round(scenarioLosses/1000,1))
-                                scenarioLossesUnit = 'thousand'
-                            elif scenarioLosses >= 1000000 and scenarioLosses < 1000000000:
-                                scenarioLosses = str(round(scenarioLosses/1000000,1))
-                                scenarioLossesUnit = 'million'
-                            elif scenarioLosses >= 1000000000 and scenarioLosses < 1000000000000:
-                                scenarioLosses = str(round(scenarioLosses/1000000000,1))
-                                scenarioLossesUnit = 'billion'
-                            elif scenarioLosses >= 1000000000000:
-                                scenarioLosses = str(round(scenarioLosses/1000000000000,1))
-                                scenarioLossesUnit = 'trillion'
-                            else:
-                                pass
-
-                            #HLL ReturnPeriod/Downloads Metadata
-                            downloadCategory = returnPeriod
-
-                                                
-                            #CREATE A DIRECTORY FOR THE OUTPUT FOLDERS (and set some HLL metadata values)...
-                            if hazard['Hazard'] == 'earthquake' and analysisType in ['Deterministic', 'Historic']:
-                                #Deterministic;Shakemap;Scenario
-                                exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip())
-                                downloadCategory = 'Results'
-                            elif hazard['Hazard'] == 'earthquake' and analysisType in ['Probabilistic']:
-                                #Probabilistic
-                                exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), str(returnPeriod).strip()) 
-                            elif hazard['Hazard'] == 'flood':
-                                #USGS FIM Deterministic
-                                exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), 'STAGE_' + str(returnPeriod).strip())
-                            elif hazard['Hazard'] == 'hurricane' and analysisType in ['Deterministic', 'Historic']:
-                                #Deterministic
-                                exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip())
-                                downloadCategory = 'Results'
-                                if analysisType == 'Deterministic':
-                                    scenarioSource = 'Hurrevac/Other'
-                                if analysisType == 'Historic':
-                                    scenarioSource = 'Historic'
-                            elif hazard['Hazard'] == 'hurricane' and analysisType in ['Probabilistic']:
-                                #Probabilistic
-                                if str(downloadCategory) == '0':
-                                    downloadCategory = 'Annualized'
-                                exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), str(returnPeriod).strip())
-                            elif hazard['Hazard'] == 'tsunami':
-                                downloadCategory = 'Results'
-                                exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip())
-                            else:
-                                exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), str(returnPeriod).strip()) 
-                            Path(exportPath).mkdir(parents=True, exist_ok=True) #this may make the earlier HPR dir creation redundant
-
-                            #EXPORT Hazus Package Region TO CSV...
-                            if outCsv == 1:
-                                try:
-                                    try:
-                                        print('\nWriting results to csv...')
-                                        results.toCSV(Path.joinpath(exportPath, 'results.csv'))
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'results.csv')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Results',
-                                                                                        'name':'Results.csv',
-                                                                                        'icon':'spreadsheet',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        print('\nBase results not available to export to csv...')
-                                        print(e)
-                                    
-                                    try:
-                                        print('\nWriting building damage by occupancy to CSV')
-                                        buildingDamageByOccupancy = hpr.getBuildingDamageByOccupancy()
-                                        buildingDamageByOccupancy.toCSV(Path.joinpath(exportPath, 'building_damage_by_occupancy.csv'))
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'building_damage_by_occupancy.csv')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Building Damage',
-                                                                                        'name':'Building Damage by Occupancy.csv',
-                                                                                        'icon':'spreadsheet',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        print('\nBuilding damage by occupancy not available to export to csv...')
-                                        print(e)
-                                    
-                                    try:
-                                        print('\nWriting building damage by type to CSV')
-                                        buildingDamageByType = hpr.getBuildingDamageByType()
-                                        buildingDamageByType.toCSV(Path.joinpath(exportPath,'building_damage_by_type.csv'))
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'building_damage_by_type.csv')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Building Damage',
-                                                                                        'name':'Building Damage by Type.csv',
-                                                                                        'icon':'spreadsheet',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        print('\nBuilding damage by type not available to export to csv...')
-                                        print(e)
-                                    
-                                    try:
-                                        print('\nWriting damaged facilities to CSV')
-                                        essentialFacilities.toCSV(Path.joinpath(exportPath, 'damaged_facilities.csv'))
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'damaged_facilities.csv')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Damaged Facilities',
-                                                                                        'name':'Damaged Facilities.csv',
-                                                                                        'icon':'spreadsheet',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        print('\nDamaged facilities not available to export to csv.')
-                                        print(e)
-                                    
-                                    if hpr.hazard == 'earthquake' and analysisType in ['Historic', 'Deterministic']:
-                                        try:
-                                            print('\nWriting eqShakeMapScenario to CSV')
-                                            EQShakeMapScenario = hpr.getEQShakeMapScenario()
-                                            EQShakeMapScenario.toCSV(Path.joinpath(exportPath, 'ShakeMap_Scenario.csv'))
-                                            #ADD ROW TO hllMetadataDownload TABLE...
-                                            downloadUUID = uuid.uuid4()
-                                            filePath = Path.joinpath(exportPath, 'ShakeMap_Scenario.csv')
-                                            #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                            filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                            hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                            'category':downloadCategory,
-                                                                                            'subcategory':'Metadata',
-                                                                                            'name':'ShakeMap Scenario.csv',
-                                                                                            'icon':'spreadsheet',
-                                                                                            'file':filePathRel,
-                                                                                            'analysis':scenarioUUID}, ignore_index=True)
-                                        except Exception as e:
-                                            print('\neqShakeMapScenario not available to export to csv.')
-                                            print(e)
+                        
+                    if skipHPR == 0:
+                        #HLL Analysis/Scenario Metadata (some scenario/analysis level info requires returnperiod/download input)...
+                        geographicCountUnit = hpr.getGeographicCountUnitofResults(results)
+                        scenarioGeographicCount = geographicCountUnit[0]
+                        scenarioGeographicUnit = geographicCountUnit[1]
+                        scenarioLosses = int(hpr.getTotalEconomicLoss(context=context))
+                        scenarioLossesUnit = 'USD'
+                        if scenarioLosses >= 1000 and scenarioLosses < 1000000:
+                            scenarioLosses = str(round(scenarioLosses/1000,1))
+                            scenarioLossesUnit = 'thousand'
+                        elif scenarioLosses >= 1000000 and scenarioLosses < 1000000000:
+                            scenarioLosses = str(round(scenarioLosses/1000000,1))
+                            scenarioLossesUnit = 'million'
+                        elif scenarioLosses >= 1000000000 and scenarioLosses < 1000000000000:
+                            scenarioLosses = str(round(scenarioLosses/1000000000,1))
+                            scenarioLossesUnit = 'billion'
+                        elif scenarioLosses >= 1000000000000:
+                            scenarioLosses = str(round(scenarioLosses/1000000000000,1))
+                            scenarioLossesUnit = 'trillion'
+                        else:
+                            pass
+
+                        #HLL ReturnPeriod/Downloads Metadata
+                        downloadCategory = returnPeriod
+
+                                            
+                        #CREATE A DIRECTORY FOR THE OUTPUT FOLDERS (and set some HLL metadata values)...
+                        if hazard['Hazard'] == 'earthquake' and analysisType in ['Deterministic', 'Historic']:
+                            #Deterministic;Shakemap;Scenario
+                            exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip())
+                            downloadCategory = 'Results'
+                        elif hazard['Hazard'] == 'earthquake' and analysisType in ['Probabilistic']:
+                            #Probabilistic
+                            exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), str(returnPeriod).strip()) 
+                        elif hazard['Hazard'] == 'flood':
+                            #USGS FIM Deterministic
+                            exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), 'STAGE_' + str(returnPeriod).strip())
+                        elif hazard['Hazard'] == 'hurricane' and analysisType in ['Deterministic', 'Historic']:
+                            #Deterministic
+                            exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip())
+                            downloadCategory = 'Results'
+                            if analysisType == 'Deterministic':
+                                scenarioSource = 'Hurrevac/Other'
+                            if analysisType == 'Historic':
+                                scenarioSource = 'Historic'
+                        elif hazard['Hazard'] == 'hurricane' and analysisType in ['Probabilistic']:
+                            #Probabilistic
+                            if str(downloadCategory) == '0':
+                                downloadCategory = 'Annualized'
+                            exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), str(returnPeriod).strip())
+                        elif hazard['Hazard'] == 'tsunami':
+                            downloadCategory = 'Results'
+                            exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip())
+                        else:
+                            exportPath = Path.joinpath(Path(outputPath), str(hazard['Hazard']).strip(), str(scenario['ScenarioName']).strip(), str(returnPeriod).strip()) 
+                        Path(exportPath).mkdir(parents=True, exist_ok=True) #this may make the earlier HPR dir creation redundant
 
+                        #EXPORT Hazus Package Region TO CSV...
+                        if outCsv == 1:
+                            try:
+                                try:
+                                    print('\nWriting results to csv...')
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'results.csv'), results.toCSV, Path.joinpath(exportPath, 'results.csv'))
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'results.csv')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Results',
+                                                                    'name':'Results.csv',
+                                                                    'icon':'spreadsheet',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
+                                except Exception as e:
+                                    print('\nBase results not available to export to csv...')
+                                    print(e)
                                 
+                                try:
+                                    print('\nWriting building damage by occupancy to CSV')
+                                    buildingDamageByOccupancy = datasets['buildingDamageByOccupancy']
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'building_damage_by_occupancy.csv'), buildingDamageByOccupancy.toCSV, Path.joinpath(exportPath, 'building_damage_by_occupancy.csv'))
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'building_damage_by_occupancy.csv')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Building Damage',
+                                                                    'name':'Building Damage by Occupancy.csv',
+                                                                    'icon':'spreadsheet',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
                                 except Exception as e:
-                                    print('\nUnexpected error exporting CSVs')
+                                    print('\nBuilding damage by occupancy not available to export to csv...')
                                     print(e)
-                            else:
-                                print('\nSkipping CSV exports')
-                                    
-                            #EXPORT Hazus Package Region TO Shapefile...
-                            if outShapefile == 1:
+                                
                                 try:
+                                    print('\nWriting building damage by type to CSV')
+                                    buildingDamageByType = datasets['buildingDamageByType']
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'building_damage_by_type.csv'), buildingDamageByType.toCSV, Path.joinpath(exportPath, 'building_damage_by_type.csv'))
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'building_damage_by_type.csv')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Building Damage',
+                                                                    'name':'Building Damage by Type.csv',
+                                                                    'icon':'spreadsheet',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
+                                except Exception as e:
+                                    print('\nBuilding damage by type not available to export to csv...')
+                                    print(e)
+                                
+                                try:
+                                    print('\nWriting damaged facilities to CSV')
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'damaged_facilities.csv'), essentialFacilities.toCSV, Path.joinpath(exportPath, 'damaged_facilities.csv'))
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'damaged_facilities.csv')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Damaged Facilities',
+                                                                    'name':'Damaged Facilities.csv',
+                                                                    'icon':'spreadsheet',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
+                                except Exception as e:
+                                    print('\nDamaged facilities not available to export to csv.')
+                                    print(e)
+                                
+                                if hpr.hazard == 'earthquake' and analysisType in ['Historic', 'Deterministic']:
                                     try:
-                                        print('\nWriting results to shapefile to zipfile...')
-                                        results.toShapefiletoZipFile(Path.joinpath(exportPath, 'results.shp'), 'epsg:4326', 'epsg:4326')
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'results.zip')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Results',
-                                                                                        'name':'Results.shp',
-                                                                                        'icon':'spatial',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        #print('\nBase results not available to export to shapefile...')
-                                        print('\nBase results not available to export to shapefile to zipfile...')
-                                        print(e)
-                                    
-                                    try:
-                                        print('\nWriting Damaged facilities to shapefile to zipfile.')
-                                        essentialFacilities.toShapefiletoZipFile(Path.joinpath(exportPath, 'damaged_facilities.shp'), 'epsg:4326', 'epsg:4326')
+                                        print('\nWriting eqShakeMapScenario to CSV')
+                                        EQShakeMapScenario = hpr.getEQShakeMapScenario(context=context)
+                                        exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'ShakeMap_Scenario.csv'), EQShakeMapScenario.toCSV, Path.joinpath(exportPath, 'ShakeMap_Scenario.csv'))
                                         #ADD ROW TO hllMetadataDownload TABLE...
                                         downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'damaged_facilities.zip')
+                                        filePath = Path.joinpath(exportPath, 'ShakeMap_Scenario.csv')
                                         #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
                                         filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Damaged Facilities',
-                                                                                        'name':'Damaged Facilities.shp',
-                                                                                        'icon':'spatial',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
+                                        hllMetadata.append('Download', {'id':downloadUUID,
+                                                                        'category':downloadCategory,
+                                                                        'subcategory':'Metadata',
+                                                                        'name':'ShakeMap Scenario.csv',
+                                                                        'icon':'spreadsheet',
+                                                                        'file':filePathRel,
+                                                                        'analysis':scenarioUUID})
                                     except Exception as e:
-                                        #print('\nDamaged facilities not available to export to shapefile...')
-                                        print('\nDamaged facilities not available to export to shapefile to zipfile...')
+                                        print('\neqShakeMapScenario not available to export to csv.')
                                         print(e)
 
-                                    try:
-                                        print('\nWriting Hazard Boundary Polygon to shapefile to zipfile...')
-                                        #The following two commented out lines encounter ODBC issues on some machines,
-                                        #possibly due to 32 and 64bit access driver conflicts
-                ##                            hpr.getFloodBoundaryPolyName('R')
-                ##                            hpr.exportFloodHazardPolyToShapefileToZipFile(Path.joinpath(exportPath, 'hazardBoundaryPoly.shp'))
-
-                                        hazardGDF = hpr.getHazardGeoDataFrame()
-                                        hazardGDF.toShapefiletoZipFile(Path.joinpath(exportPath, 'hazardBoundaryPoly.shp'), 'epsg:4326', 'epsg:4326')
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'hazardBoundaryPoly.zip')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Hazard',
-                                                                                        'name':'Hazard Boundary.shp',
-                                                                                        'icon':'spatial',
-                                                                                        'link':downloadLink,
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        print('\nHazard Boundary not available to export to shapefile to zipfile...')
-                                        print(e)
-                                    
+                            
+                            except Exception as e:
+                                print('\nUnexpected error exporting CSVs')
+                                print(e)
+                        else:
+                            print('\nSkipping CSV exports')
+                                
+                        #EXPORT Hazus Package Region TO Shapefile...
+                        if outShapefile == 1:
+                            try:
+                                try:
+                                    print('\nWriting results to shapefile to zipfile...')
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'results.zip'), results.toShapefiletoZipFile, Path.joinpath(exportPath, 'results.shp'), 'epsg:4326', 'epsg:4326')
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'results.zip')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Results',
+                                                                    'name':'Results.shp',
+                                                                    'icon':'spatial',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
                                 except Exception as e:
-                                    print(u"Unexpected error exporting Shapefiles: ")
+                                    #print('\nBase results not available to export to shapefile...')
+                                    print('\nBase results not available to export to shapefile to zipfile...')
                                     print(e)
-                            else:
-                                print('\nSkipping Shapefile exports')
                                 
-                            #EXPORT Hazus Package Region TO GeoJSON...
-                            if outJson == 1:
                                 try:
-                                    try:
-                                        print('\nWriting Results to geojson...')
-                                        results.toGeoJSON(Path.joinpath(exportPath, 'results.geojson'))
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'results.geojson')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Results',
-                                                                                        'name':'Results.geojson',
-                                                                                        'icon':'spatial',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        print('\nBase results not available to export to geojson')
-                                        print(e)
-                                    
-                                    try:
-                                        print('\nWriting Damaged Facilities to geojson...')
-                                        essentialFacilities.toGeoJSON(Path.joinpath(exportPath, 'damaged_facilities.geojson'))
-                                        #ADD ROW TO hllMetadataDownload TABLE...
-                                        downloadUUID = uuid.uuid4()
-                                        filePath = Path.joinpath(exportPath, 'damaged_facilities.geojson')
-                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                        'category':downloadCategory,
-                                                                                        'subcategory':'Damaged Facilities',
-                                                                                        'name':'Damaged Facilities.geojson',
-                                                                                        'icon':'spatial',
-                                                                                        'file':filePathRel,
-                                                                                        'analysis':scenarioUUID}, ignore_index=True)
-                                    except Exception as e:
-                                        print('\nDamaged facilities not available to export to geojson.')
-                                        print(e)                        
+                                    print('\nWriting Damaged facilities to shapefile to zipfile.')
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'damaged_facilities.zip'), essentialFacilities.toShapefiletoZipFile, Path.joinpath(exportPath, 'damaged_facilities.shp'), 'epsg:4326', 'epsg:4326')
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'damaged_facilities.zip')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Damaged Facilities',
+                                                                    'name':'Damaged Facilities.shp',
+                                                                    'icon':'spatial',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
+                                except Exception as e:
+                                    #print('\nDamaged facilities not available to export to shapefile...')
+                                    print('\nDamaged facilities not available to export to shapefile to zipfile...')
+                                    print(e)
 
-                                    try:
-                                        print('\nWriting ImpactArea to geojson...')
-                                        econloss = hpr.getEconomicLoss()
-                                        if len(econloss.loc[econloss['EconLoss'] > 0]) > 0:
-                                            econloss.toHLLGeoJSON(Path.joinpath(exportPath, 'impactarea.geojson'))
-                                            #ADD ROW TO hllMetadataDownload TABLE...
-                                            downloadUUID = uuid.uuid4()
-                                            filePath = Path.joinpath(exportPath, 'impactarea.geojson')
-                                            #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                            filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                            hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                            'category':downloadCategory,
-                                                                                            'subcategory':'Hazard',
-                                                                                            'name':'Impact Area.geojson',
-                                                                                            'icon':'spatial',
-                                                                                            'file':filePathRel,
-                                                                                            'analysis':scenarioUUID}, ignore_index=True)
-                                        else:
-                                            print('\nno econ loss for HLL geojson')
-                                        
-                                    except Exception as e:
-                                        print('\nImpactArea not available to export to geojson.')
-                                        print(e)
+                                try:
+                                    print('\nWriting Hazard Boundary Polygon to shapefile to zipfile...')
+                                    #The following two commented out lines encounter ODBC issues on some machines,
+                                    #possibly due to 32 and 64bit access driver conflicts
+            ##                            hpr.getFloodBoundaryPolyName('R')
+            ##                            hpr.exportFloodHazardPolyToShapefileToZipFile(Path.joinpath(exportPath, 'hazardBoundaryPoly.shp'))
 
-                                    try:
-                                        """This section is to write the same impact area geojson but at the scenario level."""
-                                        print('\nWriting ImpactArea Scenario to geojson...')
-                                        econloss = hpr.getEconomicLoss()
-                                        if len(econloss.loc[econloss['EconLoss'] > 0]) > 0:
-                                            econloss.toHLLGeoJSON(Path.joinpath(exportPath.parent, 'impactarea.geojson'))
-                                            #ADD ROW TO hllMetadataDownload TABLE...
-                                            filePath = Path.joinpath(exportPath.parent, 'impactarea.geojson')
-                                            #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
-                                            scenarioGEOM = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                        else:
-                                            print('\nno econ loss for HLL Scenario geojson')
-                                    except Exception as e:
-                                        print('\nImpactArea Scenario not available to export to geojson.')
-                                        print(e)
-                                    
+                                    hazardGDF = datasets['hazardGDF']
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'hazardBoundaryPoly.zip'), hazardGDF.toShapefiletoZipFile, Path.joinpath(exportPath, 'hazardBoundaryPoly.shp'), 'epsg:4326', 'epsg:4326')
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'hazardBoundaryPoly.zip')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Hazard',
+                                                                    'name':'Hazard Boundary.shp',
+                                                                    'icon':'spatial',
+                                                                    'link':downloadLink,
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
                                 except Exception as e:
-                                    print('\nUnexpected error exporting to GeoJSON:')
+                                    print('\nHazard Boundary not available to export to shapefile to zipfile...')
                                     print(e)
-                            else:
-                                print('\nSkipping GeoJSON exports')
+                                
+                            except Exception as e:
+                                print(u"Unexpected error exporting Shapefiles: ")
+                                print(e)
+                        else:
+                            print('\nSkipping Shapefile exports')
 
-                            #EXPORT Hazus Package Region TO PDF Reports...
-                            if outReport == 1:
+                        #EXPORT Hazus Package Region TO GeoPackage...
+                        if outGeoPackage == 1:
+                            try:
+                                print('\nWriting results, damaged facilities and hazard to geopackage...')
+                                layers = {'results': results, 'damaged_facilities': essentialFacilities, 'hazard': datasets.get('hazardGDF')}
+                                exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'results.gpkg'), writeGeoPackage, Path.joinpath(exportPath, 'results.gpkg'), layers)
+                                #ADD ROW TO hllMetadataDownload TABLE...
+                                downloadUUID = uuid.uuid4()
+                                filePath = Path.joinpath(exportPath, 'results.gpkg')
+                                filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                hllMetadata.append('Download', {'id':downloadUUID,
+                                                                'category':downloadCategory,
+                                                                'subcategory':'Results',
+                                                                'name':'Results.gpkg',
+                                                                'icon':'spatial',
+                                                                'file':filePathRel,
+                                                                'analysis':scenarioUUID})
+                            except Exception as e:
+                                print('\nResults not available to export to geopackage...')
+                                print(e)
+                            
+                        #EXPORT Hazus Package Region TO GeoJSON...
+                        if outJson == 1:
+                            try:
+                                try:
+                                    print('\nWriting Results to geojson...')
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'results.geojson'), results.toGeoJSON, Path.joinpath(exportPath, 'results.geojson'))
+                                    #ADD ROW TO hllMetadataDownload TABLE...
+                                    downloadUUID = uuid.uuid4()
+                                    filePath = Path.joinpath(exportPath, 'results.geojson')
+                                    #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                    filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Results',
+                                                                    'name':'Results.geojson',
+                                                                    'icon':'spatial',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
+                                except Exception as e:
+                                    print('\nBase results not available to export to geojson')
+                                    print(e)
+                                
                                 try:
-                                    #TODO test this; CL
-                                    print('\nWriting results to PDF...')
-                                    hpr.setReport()
-                                    hpr.report.title = scenario['ScenarioName'].title().replace('Fema', 'FEMA')
-                                    hpr.report.subtitle = 'SubTitle'
-                                    hpr.report.save(exportPath, openFile=False, premade='')
+                                    print('\nWriting Damaged Facilities to geojson...')
+                                    exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'damaged_facilities.geojson'), essentialFacilities.toGeoJSON, Path.joinpath(exportPath, 'damaged_facilities.geojson'))
                                     #ADD ROW TO hllMetadataDownload TABLE...
                                     downloadUUID = uuid.uuid4()
-                                    filePath = Path.joinpath(exportPath, 'report_summary.pdf')
+                                    filePath = Path.joinpath(exportPath, 'damaged_facilities.geojson')
                                     #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
                                     filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
-                                    hllMetadataDownload = hllMetadataDownload.append({'id':downloadUUID,
-                                                                                    'category': 'Results',
-                                                                                    'subcategory':'Report',
-                                                                                    'name':'report_summary.pdf',
-                                                                                    'icon':'pdf',
-                                                                                    'file':filePathRel,
-                                                                                    'analysis':scenarioUUID}, ignore_index=True)
+                                    hllMetadata.append('Download', {'id':downloadUUID,
+                                                                    'category':downloadCategory,
+                                                                    'subcategory':'Damaged Facilities',
+                                                                    'name':'Damaged Facilities.geojson',
+                                                                    'icon':'spatial',
+                                                                    'file':filePathRel,
+                                                                    'analysis':scenarioUUID})
+                                except Exception as e:
+                                    print('\nDamaged facilities not available to export to geojson.')
+                                    print(e)                        
+
+                                try:
+                                    print('\nWriting ImpactArea to geojson...')
+                                    econloss = hpr.getEconomicLoss(context=context)
+                                    if len(econloss.loc[econloss['EconLoss'] > 0]) > 0:
+                                        exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'impactarea.geojson'), econloss.toHLLGeoJSON, Path.joinpath(exportPath, 'impactarea.geojson'))
+                                        #ADD ROW TO hllMetadataDownload TABLE...
+                                        downloadUUID = uuid.uuid4()
+                                        filePath = Path.joinpath(exportPath, 'impactarea.geojson')
+                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                        filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                        hllMetadata.append('Download', {'id':downloadUUID,
+                                                                        'category':downloadCategory,
+                                                                        'subcategory':'Hazard',
+                                                                        'name':'Impact Area.geojson',
+                                                                        'icon':'spatial',
+                                                                        'file':filePathRel,
+                                                                        'analysis':scenarioUUID})
+                                    else:
+                                        print('\nno econ loss for HLL geojson')
+                                    
                                 except Exception as e:
-                                    print('\n')
+                                    print('\nImpactArea not available to export to geojson.')
                                     print(e)
-                                    exc_type, exc_obj, exc_tb = sys.exc_info()
-                                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                                    print(fname)
-                                    print(exc_type, exc_tb.tb_lineno)
-                                    print('\n')
 
-                                    print('\nUnexpected error exporting to Report PDF:')
+                                try:
+                                    """This section is to write the same impact area geojson but at the scenario level."""
+                                    print('\nWriting ImpactArea Scenario to geojson...')
+                                    econloss = hpr.getEconomicLoss(context=context)
+                                    if len(econloss.loc[econloss['EconLoss'] > 0]) > 0:
+                                        econloss.toHLLGeoJSON(Path.joinpath(exportPath.parent, 'impactarea.geojson'))
+                                        #ADD ROW TO hllMetadataDownload TABLE...
+                                        filePath = Path.joinpath(exportPath.parent, 'impactarea.geojson')
+                                        #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                        scenarioGEOM = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                    else:
+                                        print('\nno econ loss for HLL Scenario geojson')
+                                except Exception as e:
+                                    print('\nImpactArea Scenario not available to export to geojson.')
                                     print(e)
-                            else:
-                                print('\nSkiping Report exports')
-
-
-                    #Analysis Metadata part two of two...
-                    #ADD ROW TO hllMetadataScenario TABLE...
-                    hllMetadataScenario = hllMetadataScenario.append({'id':scenarioUUID,
-                                                                    'name':scenario['ScenarioName'],
-                                                                    'hazard':hazard['Hazard'], #flood, hurricane, earthquake, tsunami, tornado
-                                                                    'analysisType':analysisType, #historic, deterministic, probabilistic
-                                                                    'date':analysisDate, #YYYY-MM-DD
-                                                                    'source':scenarioSource, #Max100 chars
-                                                                    'modifiedInventory':'false', #true/false
-                                                                    'geographicCount':scenarioGeographicCount,
-                                                                    'geographicUnit':scenarioGeographicUnit,
-                                                                    'losses':scenarioLosses,
-                                                                    'lossesUnit':scenarioLossesUnit,
-                                                                    'meta':str(scenarioMETA).replace("'",'"'), #needs to be double quotes; one level Python dict/json
-                                                                    'event':hazardUUID,
-                                                                    'geom':scenarioGEOM}, #filepath to geojson
-                                                                    ignore_index=True)
-            
-            #EXPORT HLL METADATA (NOTE: openpyxl (*et_xmlfile, &jdcal)) not installed, can't export to excel)...
-            ##hllMetadataPath = str(Path.joinpath(Path(outputPath), "exportHLLMetadata.xlsx"))
-            ##hllMetadata.to_excel(hllMetadataPath)
-            
-            hllMetadataEventPath = str(Path.joinpath(Path(outputPath), "Event.csv"))
-            hllMetadataEvent.to_csv(hllMetadataEventPath, index=False)
+                                
+                            except Exception as e:
+                                print('\nUnexpected error exporting to GeoJSON:')
+                                print(e)
+                        else:
+                            print('\nSkipping GeoJSON exports')
+
+                        #EXPORT Hazus Package Region TO PDF Reports...
+                        if outReport == 1:
+                            try:
+                                #TODO test this; CL
+                                print('\nWriting results to PDF...')
+                                exportArtifact(journal, hprKey, artifactKey, Path.joinpath(exportPath, 'report_summary.pdf'), saveReport, hpr, context, scenario['ScenarioName'], exportPath)
+                                #ADD ROW TO hllMetadataDownload TABLE...
+                                downloadUUID = uuid.uuid4()
+                                filePath = Path.joinpath(exportPath, 'report_summary.pdf')
+                                #filePathRel = str(filePath.relative_to(Path(hpr.outputDir))) #excludes sr name; for non-aggregate hll metadata
+                                filePathRel = str(filePath.relative_to(Path(hpr.outputDir).parent)) #includes SR name; for aggregate hll metadata
+                                hllMetadata.append('Download', {'id':downloadUUID,
+                                                                'category': 'Results',
+                                                                'subcategory':'Report',
+                                                                'name':'report_summary.pdf',
+                                                                'icon':'pdf',
+                                                                'file':filePathRel,
+                                                                'analysis':scenarioUUID})
+                            except Exception as e:
+                                print('\n')
+                                print(e)
+                                exc_type, exc_obj, exc_tb = sys.exc_info()
+                                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                                print(fname)
+                                print(exc_type, exc_tb.tb_lineno)
+                                print('\n')
+
+                                print('\nUnexpected error exporting to Report PDF:')
+                                print(e)
+                        else:
+                            print('\nSkiping Report exports')
 
-            hllMetadataAnalysisPath = str(Path.joinpath(Path(outputPath), "Analysis.csv"))
-            hllMetadataScenario.to_csv(hllMetadataAnalysisPath, index=False)
+                        #JOURNAL THE RETURN PERIOD SO A RERUN CAN SKIP IT...
+                        if journal is not None:
+                            downloads = [{key: value for key, value in download.items() if key not in ['id', 'analysis']}
+                                         for download in hllMetadata.getRecords('Download', start=downloadStart)]
+                            journal.completeReturnPeriod(hprKey, *artifactKey, outputs, {
+                                'geographicCount':scenarioGeographicCount,
+                                'geographicUnit':scenarioGeographicUnit,
+                                'losses':scenarioLosses,
+                                'lossesUnit':scenarioLossesUnit,
+                                'source':scenarioSource,
+                                'geom':scenarioGEOM,
+                                'downloads':downloads})
 
-            hllMetadataDownloadPath = str(Path.joinpath(Path(outputPath), "Download.csv"))
-            hllMetadataDownload.to_csv(hllMetadataDownloadPath, index=False)
 
-            #DROP SQL SERVER HPR DATABASE...
-            if deleteDB == 1:
-                hpr.dropDB()
+                #Analysis Metadata part two of two...
+                #ADD ROW TO hllMetadataScenario TABLE...
+                hllMetadata.append('Analysis', {'id':scenarioUUID,
+                                                'name':scenario['ScenarioName'],
+                                                'hazard':hazard['Hazard'], #flood, hurricane, earthquake, tsunami, tornado
+                                                'analysisType':analysisType, #historic, deterministic, probabilistic
+                                                'date':analysisDate, #YYYY-MM-DD
+                                                'source':scenarioSource, #Max100 chars
+                                                'modifiedInventory':'false', #true/false
+                                                'geographicCount':scenarioGeographicCount,
+                                                'geographicUnit':scenarioGeographicUnit,
+                                                'losses':scenarioLosses,
+                                                'lossesUnit':scenarioLossesUnit,
+                                                'meta':str(scenarioMETA).replace("'",'"'), #needs to be double quotes; one level Python dict/json
+                                                'event':hazardUUID,
+                                                'geom':scenarioGEOM}) #filepath to geojson
+        
+        #EXPORT HLL METADATA (NOTE: openpyxl (*et_xmlfile, &jdcal)) not installed, can't export to excel)...
+        ##hllMetadataPath = str(Path.joinpath(Path(outputPath), "exportHLLMetadata.xlsx"))
+        ##hllMetadata.to_excel(hllMetadataPath)
+        
+        #Event.csv, Analysis.csv and Download.csv...
+        hllMetadataPaths = hllMetadata.save(outputPath)
+
+        #ADD THE HPR TO THE BATCH HLL METADATA...
+        if metadataStore is not None:
+            metadataStore.publishCollector(Path(outputPath).name, hllMetadata, hllMetadataPaths)
+
+        if journal is not None:
+            for path in hllMetadataPaths:
+                journal.completeArtifact(hprKey, '', '', '', Path(path).name, path)
+            journal.completeHPR(hprKey, outputs)
+
+        return True
+    except Exception as e:
+        print('\n')
+        print(e)
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        print(fname)
+        print(exc_type, exc_tb.tb_lineno)
+        print('\n')
+        return False
+
+
+def saveReport(hpr, context, scenarioName, exportPath):
+    """Builds and saves the PDF report of a scenario
+
+        Keyword Arguments:
+            hpr: StudyRegion -- a restored Hazus Package Region
+            context: ScenarioContext -- the hazard, scenario and return period to report
+            scenarioName: str -- the scenario name used as the report title
+            exportPath: str -- the output directory
+    """
+    hpr.setReport(context=context)
+    hpr.report.title = scenarioName.title().replace('Fema', 'FEMA')
+    hpr.report.subtitle = 'SubTitle'
+    hpr.report.save(exportPath, openFile=False, premade='')
+
 
-            #DELETE UNZIPPED HPR FOLDER...
-            if deleteTempDir == 1:
-                hpr.deleteTempDir()
+def cleanupHPR(hpr, deleteDB=1, deleteTempDir=1, registry=None):
+    """Drops the restored database and deletes the unzipped hpr folder
+
+        Keyword Arguments:
+            hpr: StudyRegion -- a restored Hazus Package Region
+            deleteDB: int -- if 1, delete database, if 0 don't
+            deleteTempDir: int -- if 1, delete temp dir, if 0 don't
+            registry: RestoreRegistry -- if given, the database and folder are kept for reuse and the
+                least recently used restored hpr files are dropped instead (default: None)
+    """
+    #KEEP RESTORED HPR FOR THE NEXT RUN...
+    if registry is not None:
+        try:
+            registry.evict(keep=[hpr.getHPRFingerprint()])
         except Exception as e:
-            print('\n')
             print(e)
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            print(fname)
-            print(exc_type, exc_tb.tb_lineno)
-            print('\n')
-            
-    else:
-        print('\nHPR version not supported. HPR not processed')
-    print("-----------------------------------------------------------------------------------------------------------------------------")
+        return
 
+    #DROP SQL SERVER HPR DATABASE...
+    if deleteDB == 1:
+        hpr.dropDB()
 
-def aggregateHllMetadataFiles(directory):
-    """This tool crawls a directory and subdirectory for hll metadata files and
-    aggregates them into one at the root level.
-    
-    Keyword Arguments:
-        directory: str -- a batchExport root directory
+    #DELETE UNZIPPED HPR FOLDER...
+    if deleteTempDir == 1:
+        hpr.deleteTempDir()
+
+
+def initExportWorker(restoreSemaphore):
+    """Process pool initializer that shares the restore limit with each worker
 
-    Notes:
-        The path should be the root folder containing all the exported hpr folder.
-        'Event.csv','Analysis.csv','Download.csv'. Watch out for the relative path in
-        the hll metadata.
+        Keyword Arguments:
+            restoreSemaphore: multiprocessing.Semaphore -- limits concurrent unzip and RESTORE work
     """
-    print(directory) #user defined outputdir
-    try:
-        df = pd.concat(map(pd.read_csv, list(Path(directory).glob('**/Event.csv'))))
-        df.to_csv(str(Path.joinpath(Path(directory), "Event.csv")), index=False)
-    except Exception as e:
-        print('\nUnexpected error aggregating HLL Metadata')
-        print(e)
-    try:
-        df = pd.concat(map(pd.read_csv, list(Path(directory).glob('**/Analysis.csv'))))
-        df.to_csv(str(Path.joinpath(Path(directory), "Analysis.csv")), index=False)
-    except Exception as e:
-        print('\nUnexpected error aggregating HLL Metadata')
-        print(e)
-    try:
-        df = pd.concat(map(pd.read_csv, list(Path(directory).glob('**/Download.csv'))))
-        #df['file'] = str(Path(directory).name) + df['file'].astype(str)
-        df.to_csv(str(Path.joinpath(Path(directory), "Download.csv")), index=False)
-    except Exception as e:
-        print('\nUnexpected error aggregating HLL Metadata')
-        print(e)
-        
+    global _restoreSemaphore
+    _restoreSemaphore = restoreSemaphore
+
+
+def exportHPRJob(hprFile, outputDir, dbSuffix, logDir, exportOptions):
+    """Runs exportHPR in a worker process with its output written to its own log file
+
+        Keyword Arguments:
+            hprFile: str -- the path to the hpr file
+            outputDir: str -- a directory to write export files to
+            dbSuffix: str -- a suffix that makes the bk_ database and temp folder unique
+            logDir: str -- the directory for the log file
+            exportOptions: dict -- keyword arguments passed to exportHPR
+
+        Returns:
+            logPath: str -- the path to the log file
+    """
+    logPath = Path.joinpath(Path(logDir), Path(hprFile).stem + dbSuffix + '.txt')
+    stdout_fileno = sys.stdout
+    stderr_fileno = sys.stderr
+    with open(logPath, 'w+') as log:
+        sys.stdout = log
+        sys.stderr = log
+        try:
+            startTime = time.time()
+            print("startTime:", time.ctime(startTime))
+            exportHPR(hprFile, outputDir, dbSuffix=dbSuffix, **exportOptions)
+            endTime = time.time()
+            print("endTime:", time.ctime(endTime))
+            print("Elapsed Time (Hour:Minute:Seconds):", str(timedelta(seconds=endTime-startTime)))
+            getConnectionPool().printStats()
+        except Exception as e:
+            print(e)
+        finally:
+            sys.stdout = stdout_fileno
+            sys.stderr = stderr_fileno
+    return str(logPath)
+
+
+def exportHPRsParallel(hprList, outputDir, jobs, maxRestores=1, **exportOptions):
+    """Exports hpr files in a process pool
+
+        Keyword Arguments:
+            hprList: list -- paths to hpr files
+            outputDir: str -- a directory to write export files to
+            jobs: int -- the number of hpr files exported at once
+            maxRestores: int -- the number of unzip and RESTORE operations allowed at once (default: 1)
+            exportOptions: keyword arguments passed to exportHPR (deleteDB, outCsv, ...)
+
+        Notes:
+            Each hpr gets its own temp folder, bk_ database name and log file under outputDir/logs.
+            Each hpr publishes its HLL metadata to the metadataStore; call HLLMetadataStore.save when all exports finish.
+    """
+    logDir = Path.joinpath(Path(outputDir), 'logs')
+    logDir.mkdir(parents=True, exist_ok=True)
+    restoreSemaphore = multiprocessing.Semaphore(max(1, maxRestores))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initExportWorker, initargs=(restoreSemaphore,)) as executor:
+        futures = {}
+        for index, hprFile in enumerate(hprList):
+            dbSuffix = f'_job{index}'
+            future = executor.submit(exportHPRJob, str(hprFile), str(outputDir), dbSuffix, str(logDir), exportOptions)
+            futures[future] = hprFile
+        for future in as_completed(futures):
+            try:
+                print(f'Finished {futures[future]} (log: {future.result()})')
+            except Exception as e:
+                print(f'Unexpected error exporting {futures[future]}')
+                print(e)
+
+
+class HPRPipeline():
+    """Exports hpr files through unzip, restore, export and cleanup stages connected by bounded queues
+
+    Each stage runs in its own thread, so the next hpr is unzipped and restored while the
+    current one is exported. A full queue blocks the stage before it, which bounds how many
+    hpr files are staged on disk and in SQL Server at once. Like exportHPRsParallel, each hpr
+    gets its own bk_ database and temp folder suffix, so the next hpr is never restored over
+    a database the current one is still exported from.
+
+    Keyword Arguments: \n
+        outputDir: str -- a directory to write export files to
+        queueSize: int -- the number of hpr files allowed to wait between two stages (default: 1)
+        deleteDB: int -- if 1, delete database, if 0 don't
+        deleteTempDir: int -- if 1, delete temp dir, if 0 don't
+        registry: RestoreRegistry -- if given, restored databases are kept and reused across runs (default: None)
+        exportOptions: keyword arguments passed to exportHPRResults (outCsv, outShapefile, outReport, outJson, outGeoPackage, journal, metadataStore)
+    """
+
+    stages = ['unzip', 'restore', 'export', 'cleanup']
+
+    def __init__(self, outputDir, queueSize=1, deleteDB=1, deleteTempDir=1, registry=None, **exportOptions):
+        self.outputDir = outputDir
+        self.queueSize = max(1, queueSize)
+        self.deleteDB = deleteDB
+        self.deleteTempDir = deleteTempDir
+        self.registry = registry
+        self.exportOptions = exportOptions
+        self._stop = object()
+        self._lock = threading.Lock()
+        self._skip = object()
+        self.stats = {stage: {'items': 0, 'failed': 0, 'skipped': 0, 'busy': 0.0} for stage in self.stages}
+        self.startTime = None
+
+    def unzip(self, item):
+        index, hprFile = item
+        hpr = prepareHPR(hprFile, self.outputDir, dbSuffix=f'_pipe{index}')
+        outputs = {key: value for key, value in self.exportOptions.items() if key not in ['journal', 'metadataStore']}
+        if hpr is not None and isHPRExported(hpr, self.exportOptions.get('journal'), self.exportOptions.get('metadataStore'), **outputs):
+            return self._skip
+        if hpr is not None:
+            # a kept database is reused by the restore stage without unzipping
+            if self.registry is None or not hpr.reuseRestoredHPR(self.registry):
+                hpr.unzipHPR(hpr.hprFilePath, hpr.tempDir)
+        return hpr
+
+    def restore(self, hpr):
+        stageHPR(hpr, unzip=False, registry=self.registry)
+        return hpr
+
+    def export(self, hpr):
+        if exportHPRResults(hpr, **self.exportOptions):
+            return hpr
+        return None
+
+    def cleanup(self, hpr):
+        cleanupHPR(hpr, deleteDB=self.deleteDB, deleteTempDir=self.deleteTempDir, registry=self.registry)
+        return hpr
+
+    def runStage(self, stage, inQueue, outQueue):
+        """Processes items from inQueue until the stop marker arrives"""
+        function = getattr(self, stage)
+        while True:
+            item = inQueue.get()
+            if item is self._stop:
+                if outQueue is not None:
+                    outQueue.put(self._stop)
+                break
+            start = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as e:
+                print(f'\nUnexpected error in {stage} stage:')
+                print(e)
+                result = None
+            with self._lock:
+                self.stats[stage]['busy'] += time.perf_counter() - start
+                self.stats[stage]['items'] += 1
+                if result is self._skip:
+                    self.stats[stage]['skipped'] += 1
+                elif result is None:
+                    self.stats[stage]['failed'] += 1
+            # a full queue blocks here until the next stage catches up
+            if outQueue is not None and result is not None and result is not self._skip:
+                outQueue.put(result)
+
+    def run(self, hprList):
+        """Runs every hpr file through the pipeline and waits for the last one to finish
+
+            Keyword Arguments:
+                hprList: list -- paths to hpr files
+        """
+        self.startTime = time.perf_counter()
+        queues = [queue.Queue(maxsize=self.queueSize) for stage in self.stages]
+        threads = []
+        for index, stage in enumerate(self.stages):
+            outQueue = queues[index + 1] if index + 1 < len(queues) else None
+            thread = threading.Thread(target=self.runStage, args=(stage, queues[index], outQueue), name=f'hpr-{stage}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        for index, hprFile in enumerate(hprList):
+            queues[0].put((index, str(hprFile)))
+        queues[0].put(self._stop)
+        for thread in threads:
+            thread.join()
+        self.printStats()
+
+    def getStats(self):
+        """Summarizes stage usage
+
+            Returns:
+                stats: dict -- per stage items, failed, skipped, busy seconds, occupancy (busy share of the run) and throughput (items per hour)
+        """
+        elapsed = time.perf_counter() - self.startTime if self.startTime is not None else 0.0
+        with self._lock:
+            stats = {stage: dict(values) for stage, values in self.stats.items()}
+        for stage in stats:
+            stats[stage]['occupancy'] = stats[stage]['busy'] / elapsed if elapsed > 0 else 0.0
+            stats[stage]['throughput'] = stats[stage]['items'] / elapsed * 3600 if elapsed > 0 else 0.0
+        return stats
+
+    def printStats(self):
+        stats = self.getStats()
+        print('\nPipeline stages:')
+        for stage in self.stages:
+            values = stats[stage]
+            print(f"  {stage}: {values['items']} hpr ({values['failed']} failed, {values['skipped']} skipped), {values['busy']:.0f}s busy, "
+                  f"{values['occupancy']:.0%} occupancy, {values['throughput']:.1f} hpr/hour")
+
+
+def getHPRKeys(journal, hprList, outputDir):
+    """Reads the journal key of every hpr file of a batch
+
+        Keyword Arguments:
+            journal: ExportJournal -- the export journal
+            hprList: list -- paths to hpr files
+            outputDir: str -- the batch output directory
+
+        Returns:
+            hprKeys: dict -- the hpr file of each journal key
+    """
+    hprKeys = {}
+    for hprFile in hprList:
+        try:
+            hpr = StudyRegion(studyRegion=None, hprFilePath=hprFile, outputDir=outputDir)
+            hprKeys[journal.getHPRKey(hpr)] = hprFile
+        except Exception as e:
+            print(f'Unable to read {hprFile}')
+            print(e)
+    return hprKeys
+
+
+def printExportStatus(journal, hprList, outputDir, jobs=1, verbose=True, hprKeys=None):
+    """Prints which hpr files of a batch are exported and estimates the time to finish
+
+        Keyword Arguments:
+            journal: ExportJournal -- the export journal
+            hprList: list -- paths to hpr files
+            outputDir: str -- the batch output directory
+            jobs: int -- the number of hpr files exported at once (default: 1)
+            verbose: bool -- if False, only the totals and estimate are printed (default: True)
+            hprKeys: dict -- the keys from getHPRKeys; read from the hpr files if None (default: None)
+    """
+    if hprKeys is None:
+        hprKeys = getHPRKeys(journal, hprList, outputDir)
+    status = journal.getStatus(list(hprKeys))
+    counts = {'complete': 0, 'started': 0, 'pending': 0}
+    for hprKey, hprFile in hprKeys.items():
+        counts[status[hprKey]['status']] = counts.get(status[hprKey]['status'], 0) + 1
+        if verbose:
+            print(f"{status[hprKey]['status']:>9} {status[hprKey]['artifacts']:>5} artifacts  {hprFile}")
+    print(f"{counts['complete']} complete, {counts['started']} partially exported, {counts['pending']} pending")
+    remaining = journal.estimateRemaining(list(hprKeys), jobs=jobs)
+    if remaining is not None:
+        print("Estimated time to finish (Hour:Minute:Seconds):", str(timedelta(seconds=int(remaining))))
+
+
 if __name__ == '__main__':
     print('\nRunning batch export...')
     startTime = time.time()
     print(time.ctime(startTime))
     print("startTime:", time.ctime(startTime))
+    parser = argparse.ArgumentParser(description='Batch export Hazus Package Region (.hpr) files.')
+    parser.add_argument('--input', default=r'./batch_input', help='the directory containing hpr files (default: ./batch_input)')
+    parser.add_argument('--output', default=r'./batch_output', help='the directory for the output files (default: ./batch_output)')
+    parser.add_argument('--jobs', type=int, default=1, help='number of hpr files exported at once in separate processes (default: 1)')
+    parser.add_argument('--max-restores', type=int, default=1, help='number of unzip and RESTORE operations allowed at once with --jobs (default: 1)')
+    parser.add_argument('--pipeline', action='store_true', help='unzip and restore the next hpr while the current one is exported')
+    parser.add_argument('--queue-size', type=int, default=1, help='number of hpr files staged ahead of each --pipeline stage (default: 1)')
+    parser.add_argument('--keep-restored', action='store_true', help='keep restored bk_ databases and reuse them when an hpr is exported again')
+    parser.add_argument('--restore-budget', type=float, default=None, help='GB of disk kept restored hpr files may use before the least recently used are dropped (default: no limit)')
+    parser.add_argument('--no-resume', action='store_true', help='export every artifact again instead of skipping the ones recorded in the export journal')
+    parser.add_argument('--status', action='store_true', help='print which hpr files are exported and the estimated time to finish, then exit')
+    parser.add_argument('--geopackage', action='store_true', help='also export a results.gpkg with the results, damaged facilities and hazard layers')
+    args = parser.parse_args()
+
     #USER DEFINED VALUES
-    hprDir = Path.absolute(Path(r'./batch_input'))      #The directory containing hpr files
-    outDir = Path.absolute(Path(r'./batch_output'))     #The directory for the output files
+    hprDir = Path.absolute(Path(args.input))      #The directory containing hpr files
+    outDir = Path.absolute(Path(args.output))     #The directory for the output files
     _outCsv = 1         #Export csv files: 1 to export or 0 to skip
     _outShapefile = 1   #Export shapefiles: 1 to export or 0 to skip
     _outReport = 1      #Export report pdf files: 1 to export or 0 to skip
     _outJson = 1        #Export json files: 1 to export or 0 to skip
+    _outGeoPackage = 1 if args.geopackage else 0  #Export geopackage files: 1 to export or 0 to skip
 
     #CREATE A DIRECTORY FOR THE OUTPUT FOLDERS...
     if not os.path.exists(outDir):
         os.mkdir(outDir)
 
+    #RESTORED HPR REGISTRY FOR --keep-restored...
+    registry = None
+    if args.keep_restored:
+        diskBudget = None if args.restore_budget is None else int(args.restore_budget * 1024**3)
+        registry = RestoreRegistry(Path.joinpath(outDir, 'restore-registry.json'), diskBudget=diskBudget)
+
+    #EXPORT JOURNAL FOR RESUMING AN INTERRUPTED BATCH...
+    journal = None
+    if not args.no_resume or args.status:
+        journal = ExportJournal(Path.joinpath(outDir, 'export-journal.sqlite'))
+
+    #BATCH HLL METADATA, PUBLISHED AS EACH HPR FINISHES...
+    metadataStore = HLLMetadataStore(Path.joinpath(outDir, 'hll-metadata.sqlite'))
+
     #print(f'Input Directory: {hprDir}') #debug
     #print(f'Output Directory: {outDir}') #debug
     
@@ -718,6 +1158,10 @@ if __name__ == '__main__':
     for hpr in hprList:
         print(hpr)
 
+    if args.status:
+        printExportStatus(journal, hprList, outDir, jobs=args.jobs)
+        sys.exit()
+
     if len(hprList) > 0:
         print(f'Processing HPRs...')
 
@@ -727,16 +1171,33 @@ if __name__ == '__main__':
         sys.stderr = sys.stdout
         print("startTime:", time.ctime(startTime))
         
-        for hpr in hprList:
-            try:
-                exportHPR(str(hpr), outDir, deleteDB=1, deleteTempDir=1, 
-                          outCsv=_outCsv, outShapefile=_outShapefile, outReport=_outReport, outJson=_outJson)
-            except Exception as e:
-                print(e)
+        if args.pipeline:
+            print(f'Exporting with a staged pipeline (queue size {args.queue_size})...')
+            pipeline = HPRPipeline(outDir, queueSize=args.queue_size, deleteDB=1, deleteTempDir=1, registry=registry,
+                                   journal=journal, metadataStore=metadataStore, outCsv=_outCsv, outShapefile=_outShapefile, outReport=_outReport, outJson=_outJson, outGeoPackage=_outGeoPackage)
+            pipeline.run(hprList)
+        elif args.jobs > 1:
+            print(f'Exporting with {args.jobs} jobs and at most {args.max_restores} concurrent restores...')
+            exportHPRsParallel(hprList, outDir, args.jobs, maxRestores=args.max_restores, deleteDB=1, deleteTempDir=1, registry=registry,
+                               journal=journal, metadataStore=metadataStore, outCsv=_outCsv, outShapefile=_outShapefile, outReport=_outReport, outJson=_outJson, outGeoPackage=_outGeoPackage)
+        else:
+            #READ THE JOURNAL KEYS ONCE, NOT AFTER EVERY HPR...
+            hprKeys = getHPRKeys(journal, hprList, outDir) if journal is not None else None
+            for hpr in hprList:
+                try:
+                    exportHPR(str(hpr), outDir, deleteDB=1, deleteTempDir=1, registry=registry, journal=journal, metadataStore=metadataStore,
+                              outCsv=_outCsv, outShapefile=_outShapefile, outReport=_outReport, outJson=_outJson, outGeoPackage=_outGeoPackage)
+                except Exception as e:
+                    print(e)
+                if journal is not None:
+                    printExportStatus(journal, hprList, outDir, verbose=False, hprKeys=hprKeys)
 
         endTime = time.time()
         print("endTime:", time.ctime(endTime))
         print("Elapsed Time (Hour:Minute:Seconds):", str(timedelta(seconds=endTime-startTime)))
+        getConnectionPool().printStats()
+        if registry is not None:
+            registry.printStats()
         
         sys.stdout.close()
         sys.stderr.close()
@@ -744,8 +1205,8 @@ if __name__ == '__main__':
         sys.stderr = sys.stdout
         print(f'Done. Check the {logfile}.')
         
-        print('\nAggregating HLL Metadata...')
-        aggregateHllMetadataFiles(outDir)
+        print('\nWriting batch HLL Metadata...')
+        metadataStore.save(outDir)
         print('\nDone.')
         print(time.ctime())
 
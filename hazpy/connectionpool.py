@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pyodbc as py
+
+
+class ConnectionPool:
+    """Hands out pooled pyodbc connections to the local Hazus SQL Server database
+
+    The working driver and connection string are resolved once and reused for every
+    connection the pool opens. Idle connections are health checked before they are
+    handed out and broken ones are closed and replaced.
+
+    Keyword Arguments: \n
+        maxSize: int -- the maximum number of open connections (default: 8)
+        timeout: float -- seconds to wait for a free connection before raising (default: 300)
+        connectionStringsPath: str -- path to the connection strings json file
+    """
+
+    # list all Windows SQL Server drivers
+    drivers = [
+        '{ODBC Driver 17 for SQL Server}',
+        '{ODBC Driver 13.1 for SQL Server}',
+        '{ODBC Driver 13 for SQL Server}',
+        '{ODBC Driver 11 for SQL Server}',
+        '{SQL Server Native Client 11.0}',
+        '{SQL Server Native Client 10.0}',
+        '{SQL Native Client}',
+        '{SQL Server}'
+    ]
+
+    def __init__(self, maxSize=8, timeout=300, connectionStringsPath='./src/connectionStrings.json'):
+        self.maxSize = maxSize
+        self.timeout = timeout
+        self.connectionStringsPath = connectionStringsPath
+        self.connectionString = None
+        self._idle = []
+        self._open = 0
+        self._condition = threading.Condition()
+        self._resolveLock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'recycled': 0,
+            'waits': 0,
+            'waitTime': 0.0,
+        }
+
+    def getConnectionString(self, stringName):
+        """ Looks up a connection string in a json file based on an input argument
+
+            Keyword Arguments:
+                stringName: str -- the name of the connection string in the json file
+
+            Returns:
+                conn: pyodbc connection string that needs driver and computername updated
+        """
+        with open(self.connectionStringsPath) as f:
+            connectionStrings = json.load(f)
+            connectionString = connectionStrings[stringName]
+        return connectionString
+
+    def resolveConnectionString(self):
+        """Finds the first driver and credential combination that connects and caches it
+
+            Returns:
+                conn: pyodbc connection -- the connection opened while resolving
+        """
+        with self._resolveLock:
+            if self.connectionString is not None:
+                return py.connect(self.connectionString)
+            computer_name = os.environ['COMPUTERNAME']
+            templates = [self.getConnectionString('pyodbc'), self.getConnectionString('pyodbc_auth')]
+            error = None
+            # create connection with the latest driver
+            for driver in self.drivers:
+                for template in templates:
+                    connectionString = template.format(d=driver, cn=computer_name)
+                    try:
+                        conn = py.connect(connectionString)
+                        self.connectionString = connectionString
+                        return conn
+                    except py.Error as e:
+                        error = e
+            raise error
+
+    def createConnection(self):
+        """Opens a new, unpooled connection using the resolved connection string
+
+            Returns:
+                conn: pyodbc connection
+        """
+        if self.connectionString is None:
+            return self.resolveConnectionString()
+        return py.connect(self.connectionString)
+
+    def isHealthy(self, conn):
+        """Checks that a connection can still execute a statement
+
+            Keyword Arguments:
+                conn: pyodbc connection
+
+            Returns:
+                healthy: bool
+        """
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except py.Error:
+            return False
+
+    def closeConnection(self, conn):
+        try:
+            conn.close()
+        except py.Error:
+            pass
+
+    def acquire(self):
+        """Takes a healthy connection from the pool, opening one if none are idle
+
+            Returns:
+                conn: pyodbc connection -- must be handed back with release()
+        """
+        with self._condition:
+            waitStart = None
+            while not self._idle and self._open >= self.maxSize:
+                if waitStart is None:
+                    waitStart = time.perf_counter()
+                    self.stats['waits'] += 1
+                remaining = self.timeout - (time.perf_counter() - waitStart)
+                if remaining <= 0:
+                    raise TimeoutError(f'No database connection available after {self.timeout} seconds')
+                self._condition.wait(remaining)
+            if waitStart is not None:
+                self.stats['waitTime'] += time.perf_counter() - waitStart
+            if self._idle:
+                conn = self._idle.pop()
+                self.stats['hits'] += 1
+            else:
+                conn = None
+                self.stats['misses'] += 1
+            self._open += 1
+
+        try:
+            if conn is not None and not self.isHealthy(conn):
+                self.closeConnection(conn)
+                with self._condition:
+                    self.stats['recycled'] += 1
+                conn = None
+            if conn is None:
+                conn = self.createConnection()
+            return conn
+        except:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        """Hands a connection back to the pool
+
+            Keyword Arguments:
+                conn: pyodbc connection -- a connection from acquire()
+                broken: bool -- if True, the connection is closed instead of reused
+        """
+        if broken:
+            self.closeConnection(conn)
+        else:
+            try:
+                conn.rollback()
+            except py.Error:
+                broken = True
+                self.closeConnection(conn)
+        with self._condition:
+            self._open -= 1
+            if broken:
+                self.stats['recycled'] += 1
+            else:
+                self._idle.append(conn)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that acquires a pooled connection and releases it on exit
+
+            Example:
+                with pool.connection() as conn:
+                    df = pd.read_sql(sql, conn)
+        """
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except py.Error:
+            broken = not self.isHealthy(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def getStats(self):
+        """Summarizes pool usage
+
+            Returns:
+                stats: dict -- hits, misses, recycled, waits, waitTime (seconds), hitRate, open and idle counts
+        """
+        with self._condition:
+            stats = dict(self.stats)
+            stats['idle'] = len(self._idle)
+            stats['open'] = self._open + len(self._idle)
+        requests = stats['hits'] + stats['misses']
+        stats['hitRate'] = stats['hits'] / requests if requests > 0 else 0.0
+        return stats
+
+    def printStats(self):
+        stats = self.getStats()
+        print(f"Connection pool: {stats['hits']} hits, {stats['misses']} misses ({stats['hitRate']:.0%} hit rate), "
+              f"{stats['recycled']} recycled, {stats['waits']} waits ({stats['waitTime']:.2f}s waiting), "
+              f"{stats['open']} open")
+
+    def closeAll(self):
+        """Closes every idle connection in the pool"""
+        with self._condition:
+            idle = self._idle
+            self._idle = []
+        for conn in idle:
+            self.closeConnection(conn)
+
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+def getConnectionPool():
+    """Returns the process wide connection pool shared by StudyRegion and HazusDB
+
+        Returns:
+            pool: ConnectionPool
+    """
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
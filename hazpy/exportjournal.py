@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class ExportJournal:
+    """Records completed batch export artifacts so an interrupted batch can resume
+
+    Every artifact is journaled under the hpr key, hazard, scenario, return period and
+    artifact name with its path, size and sha256 once it is written. A rerun skips an
+    artifact whose file still matches its size and checksum, skips a return period whose
+    artifacts all match, and skips an hpr whose export finished with the same or fewer
+    outputs selected. The journal is a SQLite database, so the worker processes of a
+    parallel export can share it.
+
+    Keyword Arguments: \n
+        journalPath: str -- the path to the SQLite journal
+        verifyChecksum: bool -- if False, artifacts are verified by size only (default: True)
+    """
+
+    def __init__(self, journalPath, verifyChecksum=True):
+        self.journalPath = Path(journalPath)
+        self.verifyChecksum = verifyChecksum
+        self.createTables()
+
+    @contextmanager
+    def connect(self):
+        # a connection per call keeps the journal usable from threads and worker processes
+        conn = sqlite3.connect(str(self.journalPath), timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def createTables(self):
+        self.journalPath.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""CREATE TABLE IF NOT EXISTS artifacts (
+                hprKey TEXT NOT NULL,
+                hazard TEXT NOT NULL,
+                scenario TEXT NOT NULL,
+                returnPeriod TEXT NOT NULL,
+                artifact TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                completedAt REAL NOT NULL,
+                PRIMARY KEY (hprKey, hazard, scenario, returnPeriod, artifact))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS returnPeriods (
+                hprKey TEXT NOT NULL,
+                hazard TEXT NOT NULL,
+                scenario TEXT NOT NULL,
+                returnPeriod TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                completedAt REAL NOT NULL,
+                PRIMARY KEY (hprKey, hazard, scenario, returnPeriod))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS hprs (
+                hprKey TEXT PRIMARY KEY,
+                hprFilePath TEXT NOT NULL,
+                status TEXT NOT NULL,
+                outputs TEXT,
+                startedAt REAL,
+                finishedAt REAL,
+                elapsed REAL)""")
+
+    @staticmethod
+    def getHPRKey(hpr):
+        """Returns the journal key of an hpr
+
+            Keyword Arguments:
+                hpr: StudyRegion -- a Hazus Package Region
+
+            Returns:
+                hprKey: str -- the sha256 of the hpr fingerprint
+        """
+        return hashlib.sha256(hpr.getHPRFingerprint().encode('UTF-8')).hexdigest()
+
+    @staticmethod
+    def getFileChecksum(path, blockSize=1024 * 1024):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(blockSize), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    @staticmethod
+    def coversOutputs(recorded, requested):
+        """Checks that every output requested now was also exported when the record was written"""
+        return all(int(recorded.get(key, 0)) >= int(value) for key, value in requested.items())
+
+    def verify(self, path, size, sha256):
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            if self.verifyChecksum:
+                return self.getFileChecksum(path) == sha256
+            return True
+        except OSError:
+            return False
+
+    def isArtifactComplete(self, hprKey, hazard, scenario, returnPeriod, artifact):
+        """Checks that an artifact was journaled and its file still matches
+
+            Keyword Arguments:
+                hprKey: str -- the hpr key (getHPRKey)
+                hazard: str -- the hazard
+                scenario: str -- the scenario name ('' for hazard level artifacts)
+                returnPeriod: str -- the return period ('' for hazard and scenario level artifacts)
+                artifact: str -- the artifact name, i.e. 'results.csv'
+
+            Returns:
+                complete: bool
+        """
+        with self.connect() as conn:
+            row = conn.execute(
+                """SELECT path, size, sha256 FROM artifacts
+                WHERE hprKey = ? AND hazard = ? AND scenario = ? AND returnPeriod = ? AND artifact = ?""",
+                (hprKey, hazard, str(scenario), str(returnPeriod), artifact)
+            ).fetchone()
+        return row is not None and self.verify(*row)
+
+    def completeArtifact(self, hprKey, hazard, scenario, returnPeriod, artifact, path):
+        """Journals an artifact that was written
+
+            Keyword Arguments:
+                hprKey: str -- the hpr key (getHPRKey)
+                hazard: str -- the hazard
+                scenario: str -- the scenario name
+                returnPeriod: str -- the return period
+                artifact: str -- the artifact name
+                path: str -- the path to the written file
+        """
+        try:
+            size = os.path.getsize(path)
+            sha256 = self.getFileChecksum(path)
+            with self.connect() as conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (hprKey, hazard, str(scenario), str(returnPeriod), artifact, str(path), size, sha256, time.time())
+                )
+        except:
+            print("Unexpected error completeArtifact:", sys.exc_info()[0])
+            raise
+
+    def exportArtifact(self, hprKey, hazard, scenario, returnPeriod, path, writer):
+        """Writes an artifact unless a verified copy is journaled
+
+            Keyword Arguments:
+                hprKey: str -- the hpr key (getHPRKey)
+                hazard: str -- the hazard
+                scenario: str -- the scenario name
+                returnPeriod: str -- the return period
+                path: str -- the file the writer produces; its name is the artifact name
+                writer: function -- called without arguments to write the file
+
+            Returns:
+                written: bool -- False if the journaled artifact was reused
+        """
+        artifact = Path(path).name
+        if self.isArtifactComplete(hprKey, hazard, scenario, returnPeriod, artifact):
+            print(f'Skipping {artifact}, already exported')
+            return False
+        writer()
+        if Path(path).exists():
+            self.completeArtifact(hprKey, hazard, scenario, returnPeriod, artifact, path)
+        return True
+
+    def getReturnPeriod(self, hprKey, hazard, scenario, returnPeriod, outputs):
+        """Returns the metadata of a return period whose artifacts are all exported and verified
+
+            Keyword Arguments:
+                hprKey: str -- the hpr key (getHPRKey)
+                hazard: str -- the hazard
+                scenario: str -- the scenario name
+                returnPeriod: str -- the return period
+                outputs: dict -- the selected outputs, i.e. {'outCsv': 1, 'outShapefile': 0, ...}
+
+            Returns:
+                metadata: dict -- the metadata journaled with completeReturnPeriod, or None
+        """
+        with self.connect() as conn:
+            row = conn.execute(
+                """SELECT outputs, metadata FROM returnPeriods
+                WHERE hprKey = ? AND hazard = ? AND scenario = ? AND returnPeriod = ?""",
+                (hprKey, hazard, str(scenario), str(returnPeriod))
+            ).fetchone()
+            if row is None or not self.coversOutputs(json.loads(row[0]), outputs):
+                return None
+            artifacts = conn.execute(
+                """SELECT path, size, sha256 FROM artifacts
+                WHERE hprKey = ? AND hazard = ? AND scenario = ? AND returnPeriod = ?""",
+                (hprKey, hazard, str(scenario), str(returnPeriod))
+            ).fetchall()
+        if not all(self.verify(*artifact) for artifact in artifacts):
+            return None
+        return json.loads(row[1])
+
+    def completeReturnPeriod(self, hprKey, hazard, scenario, returnPeriod, outputs, metadata):
+        """Journals a return period once all its artifacts were attempted
+
+            Keyword Arguments:
+                hprKey: str -- the hpr key (getHPRKey)
+                hazard: str -- the hazard
+                scenario: str -- the scenario name
+                returnPeriod: str -- the return period
+                outputs: dict -- the selected outputs
+                metadata: dict -- json serializable values needed to resume without querying the database
+        """
+        with self.connect() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO returnPeriods VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (hprKey, hazard, str(scenario), str(returnPeriod), json.dumps(outputs), json.dumps(metadata, default=str), time.time())
+            )
+
+    def startHPR(self, hprKey, hprFilePath):
+        with self.connect() as conn:
+            conn.execute(
+                """INSERT INTO hprs (hprKey, hprFilePath, status, startedAt) VALUES (?, ?, 'started', ?)
+                ON CONFLICT(hprKey) DO UPDATE SET hprFilePath = excluded.hprFilePath, status = 'started', startedAt = excluded.startedAt""",
+                (hprKey, str(hprFilePath), time.time())
+            )
+
+    def completeHPR(self, hprKey, outputs):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                """UPDATE hprs SET status = 'complete', outputs = ?, finishedAt = ?, elapsed = ? - startedAt WHERE hprKey = ?""",
+                (json.dumps(outputs), now, now, hprKey)
+            )
+
+    def isHPRComplete(self, hprKey, outputs):
+        """Checks that an hpr finished exporting the selected outputs and its artifacts still match
+
+            Keyword Arguments:
+                hprKey: str -- the hpr key (getHPRKey)
+                outputs: dict -- the selected outputs
+
+            Returns:
+                complete: bool
+        """
+        with self.connect() as conn:
+            row = conn.execute("""SELECT status, outputs FROM hprs WHERE hprKey = ?""", (hprKey,)).fetchone()
+            if row is None or row[0] != 'complete' or not self.coversOutputs(json.loads(row[1]), outputs):
+                return False
+            artifacts = conn.execute("""SELECT path, size, sha256 FROM artifacts WHERE hprKey = ?""", (hprKey,)).fetchall()
+        return all(self.verify(*artifact) for artifact in artifacts)
+
+    def getStatus(self, hprKeys):
+        """Summarizes the journal for a batch
+
+            Keyword Arguments:
+                hprKeys: list -- the hpr keys in the batch
+
+            Returns:
+                status: dict -- hprKey: {'status': 'complete'|'started'|'pending', 'artifacts': int, 'elapsed': float}
+        """
+        status = {}
+        with self.connect() as conn:
+            for hprKey in hprKeys:
+                row = conn.execute("""SELECT status, elapsed FROM hprs WHERE hprKey = ?""", (hprKey,)).fetchone()
+                artifacts = conn.execute("""SELECT COUNT(*) FROM artifacts WHERE hprKey = ?""", (hprKey,)).fetchone()[0]
+                status[hprKey] = {
+                    'status': 'pending' if row is None else row[0],
+                    'artifacts': artifacts,
+                    'elapsed': None if row is None else row[1],
+                }
+        return status
+
+    def estimateRemaining(self, hprKeys, jobs=1):
+        """Estimates the seconds needed to finish a batch from the hpr files already exported
+
+            Keyword Arguments:
+                hprKeys: list -- the hpr keys in the batch
+                jobs: int -- the number of hpr files exported at once (default: 1)
+
+            Returns:
+                seconds: float -- the estimate, or None until an hpr has finished
+        """
+        with self.connect() as conn:
+            elapsed = [row[0] for row in conn.execute(
+                """SELECT elapsed FROM hprs WHERE status = 'complete' AND elapsed IS NOT NULL""").fetchall()]
+        if len(elapsed) == 0:
+            return None
+        status = self.getStatus(hprKeys)
+        remaining = len([key for key in status if status[key]['status'] != 'complete'])
+        return sum(elapsed) / len(elapsed) * remaining / max(1, jobs)
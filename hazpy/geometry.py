@@ -0,0 +1,68 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from geopandas.array import GeometryArray, from_shapely, from_wkb, from_wkt
+from shapely.geometry.base import BaseGeometry
+
+# geometry transport modes for SQL Server spatial columns
+geometryTransports = {
+    'wkt': 'STAsText()',
+    'wkb': 'STAsBinary()',
+}
+
+
+def geometrySelect(column='Shape', alias='geometry', transport='wkt'):
+    """Builds the select expression that fetches a SQL Server spatial column
+
+        Keyword Arguments:
+            column: str -- the spatial column, optionally prefixed with a table alias (default: 'Shape')
+            alias: str -- the output column name (default: 'geometry')
+            transport: str -- 'wkt' fetches STAsText(), 'wkb' fetches STAsBinary() (default: 'wkt')
+
+        Returns:
+            expression: str -- a T-SQL select expression
+    """
+    if transport not in geometryTransports:
+        raise ValueError(f"Unknown geometry transport '{transport}' (choices: {', '.join(geometryTransports)})")
+    return f'{column}.{geometryTransports[transport]} AS {alias}'
+
+
+def _isMissing(value):
+    if value is None:
+        return True
+    if isinstance(value, float) and np.isnan(value):
+        return True
+    if isinstance(value, str) and (value == '' or value == 'null'):
+        return True
+    return False
+
+
+def decodeGeometry(values):
+    """Decodes a column of WKT strings or WKB bytes into shapely geometries in one pass
+
+        Columns that are already decoded are returned unchanged, so writers can call this
+        on any frame without parsing the geometry a second time. Missing values become None.
+
+        Keyword Arguments:
+            values: pandas series or list -- WKT strings, WKB bytes or shapely geometries
+
+        Returns:
+            geometry: geopandas geoseries -- the decoded geometry, aligned to the input index
+    """
+    if isinstance(values, gpd.GeoSeries):
+        return values
+    index = values.index if isinstance(values, pd.Series) else None
+    name = values.name if isinstance(values, pd.Series) else None
+    if isinstance(values, pd.Series) and isinstance(values.array, GeometryArray):
+        return gpd.GeoSeries(values.array, index=index, name=name)
+    data = np.asarray(values, dtype=object)
+    present = [x for x in data if not _isMissing(x)]
+    if len(present) > 0 and all(isinstance(x, BaseGeometry) for x in present):
+        geometry = from_shapely([None if _isMissing(x) else x for x in data])
+    else:
+        data = np.array([None if _isMissing(x) else x for x in data], dtype=object)
+        if len(present) > 0 and isinstance(present[0], (bytes, bytearray, memoryview)):
+            geometry = from_wkb(np.array([None if x is None else bytes(x) for x in data], dtype=object))
+        else:
+            geometry = from_wkt(np.array([None if x is None else str(x) for x in data], dtype=object))
+    return gpd.GeoSeries(geometry, index=index, name=name)
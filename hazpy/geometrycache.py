@@ -0,0 +1,298 @@
+import importlib.util
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+import pyodbc as py
+
+try:
+    from .geometry import decodeGeometry, geometrySelect
+except:
+    from geometry import decodeGeometry, geometrySelect
+
+# pyarrow is only needed by geopandas to read and write GeoParquet
+hasParquet = importlib.util.find_spec('pyarrow') is not None
+
+
+class GeometryCache:
+    """Caches census geometry per study region and geography level in memory and on disk
+
+    Each level is read from the study region database once and kept as a decoded
+    GeoDataFrame. Levels are persisted to GeoParquet when pyarrow is installed and to
+    pickle otherwise. A cached level, in memory or on disk, is only reused while the database create date
+    and the source table modify date match the ones recorded when it was written, so a
+    restored or rebuilt study region is read again.
+
+    Keyword Arguments: \n
+        cacheDir: str -- the directory used to persist cached levels (default: 'hazpy-cache')
+        persist: bool -- if False, levels are only cached in memory (default: True)
+    """
+
+    # level: (source table, select columns, geometry column)
+    levels = {
+        'tract': ('hzTract', 'Tract as tract, Shape.STSrid as crs', 'Shape'),
+        'block': ('hzCensusBlock_TIGER', 'CensusBlock as block', 'Shape'),
+        'county': ('hzCounty', 'State as stateid, CountyFips as countyfips, CountyName as name, NumAggrTracts as size, Shape.STSrid as crs', 'Shape'),
+        'state': ('hzState', 'Shape.STSrid as crs', 'Shape'),
+    }
+
+    # level: key column in the source table, used to fetch only the geometry of given keys
+    keyColumns = {
+        'tract': 'Tract',
+        'block': 'CensusBlock',
+    }
+
+    def __init__(self, cacheDir='hazpy-cache', persist=True, semijoinRatio=0.5):
+        self.cacheDir = Path(cacheDir)
+        self.persist = persist
+        # below this share of a level's rows, only the requested keys are read from the database
+        self.semijoinRatio = semijoinRatio
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'memoryHits': 0,
+            'diskHits': 0,
+            'misses': 0,
+            'semijoins': 0,
+        }
+
+    def getToken(self, query, studyRegion, level):
+        """Reads the values that identify the current version of a cached level
+
+            Keyword Arguments:
+                query: function -- a query method returning a dataframe (StudyRegion.query)
+                studyRegion: str -- the study region database name
+                level: str -- the geography level (choices: 'tract', 'block', 'county', 'state')
+
+            Returns:
+                token: str -- the database create date and the source table modify date
+        """
+        table = self.levels[level][0]
+        sql = """SELECT
+                    (SELECT CONVERT(varchar(33), create_date, 126) FROM sys.databases WHERE name = N'{s}') as createDate,
+                    (SELECT CONVERT(varchar(33), MAX(modify_date), 126) FROM [{s}].sys.tables WHERE name = N'{t}') as modifyDate""".format(
+            s=studyRegion, t=table
+        )
+        df = query(sql)
+        return '{c}|{m}'.format(c=df['createDate'].iloc[0], m=df['modifyDate'].iloc[0])
+
+    def getPath(self, studyRegion, level):
+        suffix = '.parquet' if hasParquet else '.pkl'
+        return Path.joinpath(self.cacheDir, studyRegion, level + suffix)
+
+    def readDisk(self, studyRegion, level, token):
+        path = self.getPath(studyRegion, level)
+        tokenPath = path.with_suffix('.json')
+        if not path.exists() or not tokenPath.exists():
+            return None
+        try:
+            with open(tokenPath) as f:
+                if json.load(f).get('token') != token:
+                    return None
+            if hasParquet:
+                return gpd.read_parquet(path)
+            return pd.read_pickle(path)
+        except Exception as e:
+            print('Unable to read cached geometry ' + str(path))
+            print(e)
+            return None
+
+    def writeDisk(self, studyRegion, level, token, gdf):
+        path = self.getPath(studyRegion, level)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temporary name first so readers never see a partial file
+            tempPath = path.with_name(path.name + '.tmp')
+            if hasParquet:
+                gdf.to_parquet(tempPath)
+            else:
+                gdf.to_pickle(tempPath)
+            os.replace(tempPath, path)
+            with open(path.with_suffix('.json'), 'w') as f:
+                json.dump({'token': token}, f)
+        except Exception as e:
+            print('Unable to persist cached geometry ' + str(path))
+            print(e)
+
+    def readDatabase(self, query, studyRegion, level, transport='wkt'):
+        table, columns, geometryColumn = self.levels[level]
+        sql = """SELECT {c}, {g} FROM [{s}].[dbo].[{t}]""".format(
+            c=columns, g=geometrySelect(geometryColumn, transport=transport), s=studyRegion, t=table
+        )
+        df = pd.DataFrame(query(sql))
+        df['geometry'] = decodeGeometry(df['geometry'])
+        return gpd.GeoDataFrame(df, geometry='geometry')
+
+    def getMemory(self, key, token):
+        """Returns a level cached in memory, or None if it is missing or was read from another version of the database"""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None or entry[0] != token:
+            return None
+        return entry[1]
+
+    def loadGeometry(self, query, studyRegion, level, transport='wkt', token=None):
+        """Returns the cached geometry for a study region and geography level, loading it on a miss
+
+            Keyword Arguments:
+                token: str -- the getToken value if the caller already read it (default: None)
+
+            Notes:
+                The returned geodataframe is the cached one; callers copy what they hand out. A level
+                cached in memory is checked against the database token too, so a rebuilt or restored
+                study region is read again in a long running process.
+        """
+        key = (studyRegion, level)
+        if token is None:
+            token = self.getToken(query, studyRegion, level)
+        gdf = self.getMemory(key, token)
+        if gdf is not None:
+            with self._lock:
+                self.stats['memoryHits'] += 1
+            return gdf
+        if self.persist:
+            gdf = self.readDisk(studyRegion, level, token)
+        if gdf is not None:
+            with self._lock:
+                self.stats['diskHits'] += 1
+        else:
+            gdf = self.readDatabase(query, studyRegion, level, transport)
+            if self.persist:
+                self.writeDisk(studyRegion, level, token, gdf)
+            with self._lock:
+                self.stats['misses'] += 1
+        with self._lock:
+            self._memory[key] = (token, gdf)
+        return gdf
+
+    def getGeometry(self, query, studyRegion, level, transport='wkt'):
+        """Returns the decoded geometry for a study region and geography level
+
+            Keyword Arguments:
+                query: function -- a query method returning a dataframe (StudyRegion.query)
+                studyRegion: str -- the study region database name
+                level: str -- the geography level (choices: 'tract', 'block', 'county', 'state')
+                transport: str -- the geometry transport used when the level is read from the database (default: 'wkt')
+
+            Returns:
+                gdf: geopandas geodataframe -- a copy of the cached level
+        """
+        try:
+            return self.loadGeometry(query, studyRegion, level, transport).copy()
+        except:
+            print("Unexpected error getGeometry:", sys.exc_info()[0])
+            raise
+
+    def readDatabaseKeys(self, pool, studyRegion, level, keys, transport='wkt'):
+        """Reads the geometry of the given keys only, joined against a temp table of the keys on the server
+
+            Keyword Arguments:
+                pool: ConnectionPool -- the connection pool of the study region
+                studyRegion: str -- the study region database name
+                level: str -- the geography level (choices: 'tract', 'block')
+                keys: list -- the tract or block ids to read
+                transport: str -- the geometry transport (default: 'wkt')
+
+            Returns:
+                gdf: geopandas geodataframe
+        """
+        table, columns, geometryColumn = self.levels[level]
+        keyColumn = self.keyColumns[level]
+        sql = """SELECT {c}, {g} FROM [{s}].[dbo].[{t}] WHERE [{k}] IN (SELECT [key] FROM #geometryKeys)""".format(
+            c=columns, g=geometrySelect(geometryColumn, transport=transport), s=studyRegion, t=table, k=keyColumn
+        )
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # the temp table lives on the pooled connection, so a leftover one is dropped first
+                cursor.execute("IF OBJECT_ID('tempdb..#geometryKeys') IS NOT NULL DROP TABLE #geometryKeys")
+                cursor.execute("CREATE TABLE #geometryKeys ([key] varchar(20) COLLATE DATABASE_DEFAULT PRIMARY KEY)")
+                if len(keys) > 0:
+                    cursor.fast_executemany = True
+                    cursor.setinputsizes([(py.SQL_VARCHAR, 20, 0)])
+                    cursor.executemany("INSERT INTO #geometryKeys ([key]) VALUES (?)", [(str(key),) for key in keys])
+                df = pd.read_sql(sql, conn)
+            finally:
+                cursor.execute("IF OBJECT_ID('tempdb..#geometryKeys') IS NOT NULL DROP TABLE #geometryKeys")
+                cursor.close()
+        df['geometry'] = decodeGeometry(df['geometry'])
+        return gpd.GeoDataFrame(df, geometry='geometry')
+
+    def getGeometryForKeys(self, pool, query, studyRegion, level, keys, transport='wkt'):
+        """Returns the decoded geometry of the given tracts or blocks
+
+            A level already cached in memory or on disk is filtered. Otherwise, when the keys are
+            a small share of the level, only their geometry is read with a server side semijoin;
+            those partial reads are not cached. Larger requests read and cache the whole level.
+
+            Keyword Arguments:
+                pool: ConnectionPool -- the connection pool of the study region
+                query: function -- a query method returning a dataframe (StudyRegion.query)
+                studyRegion: str -- the study region database name
+                level: str -- the geography level (choices: 'tract', 'block')
+                keys: list -- the tract or block ids, i.e. the geography column of the results
+                transport: str -- the geometry transport used when reading the database (default: 'wkt')
+
+            Returns:
+                gdf: geopandas geodataframe -- the rows of the requested keys
+        """
+        try:
+            keys = pd.unique(pd.Series(keys).dropna().astype(str))
+            cacheKey = (studyRegion, level)
+            token = self.getToken(query, studyRegion, level)
+            cached = self.getMemory(cacheKey, token) is not None
+            if not cached and self.persist:
+                gdf = self.readDisk(studyRegion, level, token)
+                if gdf is not None:
+                    with self._lock:
+                        self._memory[cacheKey] = (token, gdf)
+                    cached = True
+            if not cached:
+                table = self.levels[level][0]
+                total = query("SELECT COUNT(*) as total FROM [{s}].[dbo].[{t}]".format(s=studyRegion, t=table))['total'].iloc[0]
+                if len(keys) < total * self.semijoinRatio:
+                    gdf = self.readDatabaseKeys(pool, studyRegion, level, keys, transport)
+                    with self._lock:
+                        self.stats['semijoins'] += 1
+                    return gdf
+            # filter the cached level first so only the selected rows are copied
+            gdf = self.loadGeometry(query, studyRegion, level, transport, token)
+            return gdf[gdf[level].astype(str).isin(keys)].copy()
+        except:
+            print("Unexpected error getGeometryForKeys:", sys.exc_info()[0])
+            raise
+
+    def invalidate(self, studyRegion=None):
+        """Drops cached levels from memory
+
+            Keyword Arguments:
+                studyRegion: str -- the study region to drop; all study regions if None (default: None)
+
+            Notes:
+                Persisted levels are kept; they are checked against the database before reuse.
+        """
+        with self._lock:
+            for key in list(self._memory.keys()):
+                if studyRegion is None or key[0] == studyRegion:
+                    del self._memory[key]
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+def getGeometryCache():
+    """Returns the process wide census geometry cache
+
+        Returns:
+            cache: GeometryCache
+    """
+    global _cache
+    with _cacheLock:
+        if _cache is None:
+            _cache = GeometryCache()
+        return _cache
@@ -13,6 +13,7 @@ from PIL import Image, ImageTk
 from draftemail import draftEmail
 from hazusdb import HazusDB
 from studyregion import StudyRegion
+from studyregiondataframe import writeGeoPackage
 
 
 class App:
@@ -153,6 +154,7 @@ class App:
                         self.exportOptions['csv']
                         + self.exportOptions['shapefile']
                         + self.exportOptions['geojson']
+                        + self.exportOptions['geopackage']
                         + self.exportOptions['report']
                         == 0
                     ):
@@ -176,6 +178,8 @@ class App:
                 exportOptionsCount += 3
             if self.exportOptions['geojson']:
                 exportOptionsCount += 3
+            if self.exportOptions['geopackage']:
+                exportOptionsCount += 1
             if self.exportOptions['report']:
                 exportOptionsCount += 2
             # if self.exportOptions['draftEmail']:
@@ -194,11 +198,22 @@ class App:
                 progressValue = progressValue + progressIncrement
                 msg = 'Retrieving base results'
                 self.updateProgressBar(progressValue, msg)
-                results = self.studyRegion.getResults()
-                essentialFacilities = self.studyRegion.getEssentialFacilities()
+                # independent datasets are fetched concurrently over pooled connections
+                requests = {
+                    'results': 'getResults',
+                    'essentialFacilities': 'getEssentialFacilities',
+                }
+                if self.exportOptions['csv']:
+                    requests['buildingDamageByOccupancy'] = 'getBuildingDamageByOccupancy'
+                    requests['buildingDamageByType'] = 'getBuildingDamageByType'
+                if self.exportOptions['shapefile'] or self.exportOptions['geojson'] or self.exportOptions['geopackage']:
+                    requests['hazard'] = 'getHazardGeoDataFrame'
+                datasets = self.studyRegion.fetchMany(requests)
+                results = datasets['results']
+                essentialFacilities = datasets['essentialFacilities']
 
                 # check if the study region contains result data
-                if len(results) < 1:
+                if results is None or len(results) < 1:
                     tk.messagebox.showwarning(
                         'HazPy',
                         'No results found. Please check your study region and try again.',
@@ -227,9 +242,7 @@ class App:
                         self.updateProgressBar(
                             progressValue, 'Writing building damage by occupancy to CSV'
                             )
-                        buildingDamageByOccupancy = (
-                            self.studyRegion.getBuildingDamageByOccupancy()
-                        )
+                        buildingDamageByOccupancy = datasets.get('buildingDamageByOccupancy')
                         if buildingDamageByOccupancy is not None:
                             buildingDamageByOccupancy.toCSV(
                                 outputPath + '/building_damage_by_occupancy.csv'
@@ -241,9 +254,7 @@ class App:
                         self.updateProgressBar(
                             progressValue, 'Writing building damage by type to CSV'
                             )
-                        buildingDamageByType = (
-                            self.studyRegion.getBuildingDamageByType()
-                            )
+                        buildingDamageByType = datasets.get('buildingDamageByType')
                         if buildingDamageByType is not None:
                             buildingDamageByType.toCSV(
                                 outputPath + '/building_damage_by_type.csv'
@@ -297,8 +308,7 @@ class App:
                         self.updateProgressBar(
                             progressValue, 'Writing hazard to Shapefile'
                         )
-                        if not 'hazard' in dir():
-                            hazard = self.studyRegion.getHazardGeoDataFrame()
+                        hazard = datasets.get('hazard')
                         if hazard is not None:
                             hazard.toShapefile(outputPath + '/hazard.shp')
                     except:
@@ -339,8 +349,7 @@ class App:
                         self.updateProgressBar(
                             progressValue, 'Writing hazard to GeoJSON'
                         )
-                        if not 'hazard' in dir():
-                            hazard = self.studyRegion.getHazardGeoDataFrame()
+                        hazard = datasets.get('hazard')
                         if hazard is not None:
                             hazard.toGeoJSON(outputPath + '/hazard.geojson')
                     except:
@@ -354,6 +363,30 @@ class App:
                         0,
                     )
 
+            # export study region to GeoPackage if the checkbox is selected
+            if self.exportOptions['geopackage']:
+                try:
+                    progressValue = progressValue + progressIncrement
+                    self.updateProgressBar(
+                        progressValue, 'Writing results to GeoPackage'
+                    )
+                    writeGeoPackage(
+                        outputPath + '/results.gpkg',
+                        {
+                            'results': results,
+                            'damaged_facilities': essentialFacilities,
+                            'hazard': datasets.get('hazard'),
+                        },
+                    )
+                except:
+                    ctypes.windll.user32.MessageBoxW(
+                        None,
+                        u"Unexpected error exporting GeoPackage: "
+                        + str(sys.exc_info()[0]),
+                        u'HazPy - Message',
+                        0,
+                    )
+
             # export study region to pdf if the checkbox is selected
             if self.exportOptions['report']:
                 try:
@@ -382,6 +415,7 @@ class App:
             self.updateProgressBar(100, 'Complete')
             print('Results available at: ' + outputPath)
             print('Total elapsed time: ' + str(time() - t0))
+            self.studyRegion.pool.printStats()
             tk.messagebox.showinfo(
                 "HazPy", "Complete - Output files can be found at: " + outputPath
             )
@@ -467,6 +501,7 @@ class App:
             self.exportOptions['csv'] = self.opt_csv.get()
             self.exportOptions['shapefile'] = self.opt_shp.get()
             self.exportOptions['geojson'] = self.opt_geojson.get()
+            self.exportOptions['geopackage'] = self.opt_gpkg.get()
             self.exportOptions['report'] = self.opt_report.get()
 
             # validates if the sum is greater than zero - if selected, they each checkbox will have a value of 1
@@ -1010,6 +1045,15 @@ class App:
                 style='BW.TCheckbutton',
             ).grid(row=self.row, column=1, padx=(xpadl, 0), pady=0, sticky=W)
             self.row += 1
+            # geopackage
+            self.opt_gpkg = tk.IntVar(value=0)
+            ttk.Checkbutton(
+                self.root,
+                text="GeoPackage",
+                variable=self.opt_gpkg,
+                style='BW.TCheckbutton',
+            ).grid(row=self.row, column=1, padx=(xpadl, 0), pady=0, sticky=W)
+            self.row += 1
             # report
             self.opt_report = tk.IntVar(value=1)
             ttk.Checkbutton(
@@ -1174,6 +1218,7 @@ class App:
         self.root.mainloop()
 
 
-# Start the app
-app = App()
-app.start()
\ No newline at end of file
+# Start the app; process pool workers re-import this module on Windows and must not open the GUI
+if __name__ == '__main__':
+    app = App()
+    app.start()
\ No newline at end of file
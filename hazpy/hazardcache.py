@@ -0,0 +1,247 @@
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+
+# pyarrow is only needed by geopandas to read and write GeoParquet
+hasParquet = importlib.util.find_spec('pyarrow') is not None
+
+
+class HazardCache:
+    """Caches polygonized hazard layers in memory and on disk
+
+    A layer is keyed by the raster fingerprint and the options it was built with (band,
+    rounding, threshold, target crs, ...), so a cached layer is only reused for the same
+    grid and the same processing. Layers are persisted to GeoParquet when pyarrow is
+    installed and to pickle otherwise. The disk cache is bounded by size; the least
+    recently used layers are evicted first.
+
+    Keyword Arguments: \n
+        cacheDir: str -- the directory used to persist layers (default: 'hazpy-cache/hazard')
+        maxBytes: int -- the disk budget for persisted layers (default: 2 GB)
+        memoryItems: int -- the number of layers kept in memory (default: 8)
+        fingerprint: str -- 'stat' identifies a raster by the size and modified time of its files, or by
+            the CRC-32 and size of their hpr members when the raster was extracted from an hpr; 'content'
+            by a sha256 of their content (default: 'stat')
+        persist: bool -- if False, layers are only cached in memory (default: True)
+    """
+
+    def __init__(self, cacheDir='hazpy-cache/hazard', maxBytes=2 * 1024**3, memoryItems=8, fingerprint='stat', persist=True):
+        self.cacheDir = Path(cacheDir)
+        self.maxBytes = maxBytes
+        self.memoryItems = memoryItems
+        self.fingerprint = fingerprint
+        self.persist = persist
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'memoryHits': 0,
+            'diskHits': 0,
+            'misses': 0,
+            'evicted': 0,
+        }
+
+    def getRasterFiles(self, path):
+        """Returns the files a raster is read from
+
+            Notes:
+                An ArcInfo grid (w001001.adf) is a folder of .adf files; all of them are part of the raster.
+        """
+        path = Path(path)
+        if path.suffix.lower() == '.adf':
+            return sorted(path.parent.glob('*.adf'))
+        return [path]
+
+    def getArchiveMembers(self, archive):
+        """Reads the central directory of an hpr
+
+            Returns:
+                members: dict -- member name: (size, CRC-32)
+        """
+        with zipfile.ZipFile(archive, 'r') as z:
+            return {info.filename.replace('\\', '/'): (info.file_size, info.CRC) for info in z.infolist()}
+
+    def getRasterFingerprint(self, path, archive=None, root=None):
+        """Identifies the content of a raster
+
+            Keyword Arguments:
+                path: str -- the raster path
+                archive: str -- the hpr the raster was extracted from (default: None)
+                root: str -- the folder the hpr was extracted to; raster files are named relative to it (default: None)
+
+            Returns:
+                fingerprint: str
+
+            Notes:
+                The fingerprint does not include the folder the raster sits in, so an hpr extracted again
+                to another temp folder gets the same fingerprint. Extracting stamps files with the time of
+                extraction, so files found in archive are identified by their member size and CRC-32.
+        """
+        sha = hashlib.sha256()
+        members = self.getArchiveMembers(archive) if archive is not None and self.fingerprint == 'stat' else {}
+        for file in self.getRasterFiles(path):
+            try:
+                name = file.resolve().relative_to(Path(root).resolve()).as_posix() if root is not None else file.name
+            except ValueError:
+                name = file.name
+            if name in members:
+                size, crc = members[name]
+                sha.update(f'{name}|{size}|{crc:08x}'.encode('UTF-8'))
+            elif self.fingerprint == 'content':
+                sha.update(name.encode('UTF-8'))
+                with open(file, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        sha.update(block)
+            else:
+                stat = os.stat(file)
+                sha.update(f'{name}|{stat.st_size}|{stat.st_mtime_ns}'.encode('UTF-8'))
+        return sha.hexdigest()
+
+    def getKey(self, path, archive=None, root=None, **options):
+        """Builds the cache key of a layer
+
+            Keyword Arguments:
+                path: str -- the raster path
+                archive: str -- the hpr the raster was extracted from (default: None)
+                root: str -- the folder the hpr was extracted to (default: None)
+                options: keyword arguments the layer was built with, i.e. band=1, round=True, threshold=1, crs='epsg:4326'
+
+            Returns:
+                key: str
+        """
+        description = json.dumps({'raster': self.getRasterFingerprint(path, archive, root), 'options': options}, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode('UTF-8')).hexdigest()
+
+    def getPath(self, key):
+        suffix = '.parquet' if hasParquet else '.pkl'
+        return Path.joinpath(self.cacheDir, key + suffix)
+
+    def readDisk(self, key):
+        path = self.getPath(key)
+        if not path.exists():
+            return None
+        try:
+            gdf = gpd.read_parquet(path) if hasParquet else pd.read_pickle(path)
+            # the modified time orders the layers for eviction
+            os.utime(path, None)
+            return gdf
+        except Exception as e:
+            print('Unable to read cached hazard ' + str(path))
+            print(e)
+            return None
+
+    def writeDisk(self, key, gdf):
+        path = self.getPath(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tempPath = path.with_name(path.name + '.tmp')
+            if hasParquet:
+                gdf.to_parquet(tempPath)
+            else:
+                gdf.to_pickle(tempPath)
+            os.replace(tempPath, path)
+            self.evict()
+        except Exception as e:
+            print('Unable to persist cached hazard ' + str(path))
+            print(e)
+
+    def evict(self):
+        """Deletes the least recently used persisted layers until the cache fits its disk budget
+
+            Returns:
+                evicted: int -- the number of deleted layers
+        """
+        files = []
+        for file in self.cacheDir.glob('*.parquet' if hasParquet else '*.pkl'):
+            try:
+                stat = file.stat()
+                files.append((stat.st_mtime, stat.st_size, file))
+            except OSError:
+                pass
+        totalSize = sum(size for mtime, size, file in files)
+        evicted = 0
+        for mtime, size, file in sorted(files, key=lambda x: x[0]):
+            if totalSize <= self.maxBytes:
+                break
+            try:
+                file.unlink()
+                totalSize -= size
+                evicted += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.stats['evicted'] += evicted
+        return evicted
+
+    def remember(self, key, gdf):
+        with self._lock:
+            self._memory[key] = gdf
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memoryItems:
+                self._memory.popitem(last=False)
+
+    def getLayer(self, path, build, archive=None, root=None, **options):
+        """Returns a polygonized hazard layer, building it on a miss
+
+            Keyword Arguments:
+                path: str -- the raster path
+                build: function -- called without arguments to build the layer on a miss
+                archive: str -- the hpr the raster was extracted from (default: None)
+                root: str -- the folder the hpr was extracted to (default: None)
+                options: keyword arguments that change the layer, part of the cache key
+
+            Returns:
+                gdf: geopandas geodataframe -- a copy of the cached layer
+        """
+        try:
+            key = self.getKey(path, archive, root, **options)
+            with self._lock:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    self.stats['memoryHits'] += 1
+                    return self._memory[key].copy()
+            gdf = self.readDisk(key) if self.persist else None
+            if gdf is not None:
+                with self._lock:
+                    self.stats['diskHits'] += 1
+            else:
+                gdf = build()
+                if self.persist:
+                    self.writeDisk(key, gdf)
+                with self._lock:
+                    self.stats['misses'] += 1
+            self.remember(key, gdf)
+            return gdf.copy()
+        except:
+            print("Unexpected error getLayer:", sys.exc_info()[0])
+            raise
+
+    def clear(self):
+        """Drops every layer from memory; persisted layers are kept"""
+        with self._lock:
+            self._memory.clear()
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+def getHazardCache():
+    """Returns the process wide hazard layer cache
+
+        Returns:
+            cache: HazardCache
+    """
+    global _cache
+    with _cacheLock:
+        if _cache is None:
+            _cache = HazardCache()
+        return _cache
@@ -1,10 +1,13 @@
 import json
-import os
 import pandas as pd
-import pyodbc as py
 from sqlalchemy import create_engine
 import sys
 
+try:
+    from .connectionpool import getConnectionPool
+except:
+    from connectionpool import getConnectionPool
+
 # API new methods
 
 # GET
@@ -27,6 +30,7 @@ class HazusDB():
     """
 
     def __init__(self):
+        self.pool = getConnectionPool()
         self.conn = self.createConnection()
         self.databases = self.getDatabases()
         self.studyRegions = self.getStudyRegions()
@@ -39,7 +43,7 @@ class HazusDB():
         """
         try:
             query = 'SELECT name FROM sys.databases'
-            df = pd.read_sql(query, self.conn)
+            df = self.query(query)
             return df
         except:
             print("Unexpected error getting databases:", sys.exc_info()[0])
@@ -56,7 +60,7 @@ class HazusDB():
         """
         try:
             query = 'SELECT * FROM [%s].INFORMATION_SCHEMA.TABLES;' % databaseName
-            df = pd.read_sql(query, self.conn)
+            df = self.query(query)
             self.tables = df
             return df
         except:
@@ -89,7 +93,8 @@ class HazusDB():
                 df: pandas dataframe
         """
         try:
-            df = pd.read_sql(sql, self.conn)
+            with self.pool.connection() as conn:
+                df = pd.read_sql(sql, conn)
             return df
         except:
             print("Unexpected error:", sys.exc_info()[0])
@@ -164,30 +169,12 @@ class HazusDB():
         Key Argument:
             orm: string - - type of connection to return (choices: 'pyodbc', 'sqlalchemy')
         Returns:
-            conn: pyodbc connection
+            conn: pyodbc connection -- a dedicated connection outside the pool (use query for pooled reads)
         """
         try:
-            # list all Windows SQL Server drivers
-            drivers = [
-                "{ODBC Driver 17 for SQL Server}",
-                "{ODBC Driver 13.1 for SQL Server}",
-                "{ODBC Driver 13 for SQL Server}",
-                "{ODBC Driver 11 for SQL Server} ",
-                "{SQL Server Native Client 11.0}",
-                "{SQL Server Native Client 10.0}",
-                "{SQL Native Client}",
-                "{SQL Server}",
-            ]
-            computer_name = os.environ['COMPUTERNAME']
-            if orm == 'pyodbc':
-                # create connection with the latest driver
-                for driver in drivers:
-                    try:
-                        conn = py.connect(self.getConnectionString('pyodbc').format(d=driver, cn=computer_name))
-                        break
-                    except:
-                        conn = py.connect(self.getConnectionString('pyodbc_auth').format(d=driver, cn=computer_name))
-                        break
+            # the pool resolves the working driver once per process
+            if orm == "pyodbc":
+                conn = self.pool.createConnection()
             return conn
         except:
             print("Unexpected error creating database connection:", sys.exc_info()[0])
@@ -0,0 +1,397 @@
+import os
+import sqlite3
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+# Hazus Loss Library (HLL) metadata tables and their columns, keyed by csv name
+hllMetadataTables = {
+    'Event': ['id',
+              'name',
+              'geom',
+              'date',
+              'image'],
+    'Analysis': ['id',
+                 'name',
+                 'hazard',
+                 'analysisType',
+                 'date',
+                 'source',
+                 'modifiedInventory',
+                 'geographicCount',
+                 'geographicUnit',
+                 'losses',
+                 'lossesUnit',
+                 'meta',
+                 'event',
+                 'geom'],
+    'Download': ['id',
+                 'category',
+                 'subcategory',
+                 'name',
+                 'icon',
+                 'link',
+                 'file',
+                 'meta',
+                 'analysis'],
+}
+
+
+def writeCSVAtomic(df, path):
+    """Writes a dataframe to csv through a temporary file so readers never see a partial file
+
+        Keyword Arguments:
+            df: pandas dataframe
+            path: str -- the csv path
+    """
+    path = Path(path)
+    tempPath = path.with_name(path.name + '.tmp')
+    df.to_csv(tempPath, index=False)
+    os.replace(tempPath, path)
+
+
+class HLLMetadataCollector:
+    """Collects the HLL Event, Analysis and Download records of an hpr export
+
+    Records are appended to one list per column and the tables are only built as
+    dataframes when they are saved, so adding a record does not copy the rows before it.
+
+    Keyword Arguments: \n
+        tables: dict -- table name: column names (default: hllMetadataTables)
+    """
+
+    def __init__(self, tables=hllMetadataTables):
+        self.tables = tables
+        self._columns = {table: {column: [] for column in columns} for table, columns in tables.items()}
+        self._counts = {table: 0 for table in tables}
+
+    def append(self, table, record):
+        """Adds a record to a table
+
+            Keyword Arguments:
+                table: str -- the table name (choices: 'Event', 'Analysis', 'Download')
+                record: dict -- column: value; missing columns are left empty
+        """
+        columns = self._columns[table]
+        unknown = set(record) - set(columns)
+        if len(unknown) > 0:
+            raise KeyError(f'Unknown {table} columns: {", ".join(sorted(unknown))}')
+        for column, values in columns.items():
+            values.append(record.get(column))
+        self._counts[table] += 1
+
+    def getCount(self, table):
+        """Returns the number of records in a table"""
+        return self._counts[table]
+
+    def getRecords(self, table, start=0):
+        """Returns the records of a table as dictionaries
+
+            Keyword Arguments:
+                table: str -- the table name
+                start: int -- the first record to return (default: 0)
+
+            Returns:
+                records: list
+        """
+        columns = self._columns[table]
+        return [{column: values[index] for column, values in columns.items()} for index in range(start, self._counts[table])]
+
+    def toDataFrame(self, table):
+        """Builds a table as a dataframe
+
+            Keyword Arguments:
+                table: str -- the table name
+
+            Returns:
+                df: pandas dataframe
+        """
+        return pd.DataFrame(self._columns[table], columns=self.tables[table])
+
+    def save(self, directory):
+        """Writes every table to <table>.csv in a directory
+
+            Keyword Arguments:
+                directory: str -- the output directory
+
+            Returns:
+                paths: list -- the written csv paths
+        """
+        try:
+            paths = []
+            for table in self.tables:
+                path = Path.joinpath(Path(directory), table + '.csv')
+                writeCSVAtomic(self.toDataFrame(table), path)
+                paths.append(path)
+            return paths
+        except:
+            print("Unexpected error save:", sys.exc_info()[0])
+            raise
+
+
+def readMetadataDirectory(directory, tables=hllMetadataTables):
+    """Reads the Event, Analysis and Download csv files of an exported hpr
+
+        Keyword Arguments:
+            directory: str -- the hpr output folder
+            tables: dict -- table name: column names (default: hllMetadataTables)
+
+        Returns:
+            records: dict -- table name: list of record dictionaries; missing files give no records
+    """
+    records = {}
+    for table in tables:
+        path = Path.joinpath(Path(directory), table + '.csv')
+        if path.exists():
+            df = pd.read_csv(path, dtype=str)
+            records[table] = df.where(pd.notnull(df), None).to_dict('records')
+        else:
+            records[table] = []
+    return records
+
+
+class HLLMetadataStore:
+    """A batch level store of the HLL metadata of every exported hpr
+
+    Each hpr publishes its records when its export finishes, replacing the records of
+    an earlier export of the same hpr. The batch Event, Analysis and Download csv files are
+    written from the store in one pass, without reading the per hpr csv files. The store is
+    a SQLite database, so the worker processes of a parallel export can share it.
+
+    The store also keeps a manifest of the modified time and size of the csv files each hpr
+    was published from, so aggregateDirectory only reads the files that changed.
+
+    Keyword Arguments: \n
+        storePath: str -- the path to the SQLite store
+        tables: dict -- table name: column names (default: hllMetadataTables)
+    """
+
+    def __init__(self, storePath, tables=hllMetadataTables):
+        self.storePath = Path(storePath)
+        self.tables = tables
+        self.createTables()
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(str(self.storePath), timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def createTables(self):
+        self.storePath.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            for table, columns in self.tables.items():
+                conn.execute("""CREATE TABLE IF NOT EXISTS [{t}] (hprKey TEXT NOT NULL, position INTEGER NOT NULL, {c})""".format(
+                    t=table, c=', '.join(f'[{column}] TEXT' for column in columns)
+                ))
+                conn.execute("""CREATE INDEX IF NOT EXISTS [{t}_hprKey] ON [{t}] (hprKey)""".format(t=table))
+            conn.execute("""CREATE TABLE IF NOT EXISTS manifest (
+                path TEXT PRIMARY KEY,
+                hprKey TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL)""")
+
+    def getManifestPath(self, path):
+        # manifest paths are relative to the store so an output tree can be moved
+        return os.path.relpath(str(path), str(self.storePath.parent))
+
+    def writeRecords(self, conn, hprKey, tables, paths=()):
+        """Replaces the records and manifest entries of an hpr on an open connection"""
+        conn.execute("""DELETE FROM manifest WHERE hprKey = ?""", (hprKey,))
+        for path in paths:
+            stat = os.stat(path)
+            conn.execute("""INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?)""",
+                         (self.getManifestPath(path), hprKey, stat.st_mtime_ns, stat.st_size))
+        for table, records in tables.items():
+            columns = self.tables[table]
+            conn.execute("""DELETE FROM [{t}] WHERE hprKey = ?""".format(t=table), (hprKey,))
+            conn.executemany(
+                """INSERT INTO [{t}] VALUES (?, ?, {p})""".format(t=table, p=', '.join('?' * len(columns))),
+                [[hprKey, position] + [None if record.get(column) is None else str(record.get(column)) for column in columns]
+                 for position, record in enumerate(records)]
+            )
+
+    def deleteRecords(self, conn, hprKey):
+        """Drops the records and manifest entries of an hpr on an open connection"""
+        for table in self.tables:
+            conn.execute("""DELETE FROM [{t}] WHERE hprKey = ?""".format(t=table), (hprKey,))
+        conn.execute("""DELETE FROM manifest WHERE hprKey = ?""", (hprKey,))
+
+    def publish(self, hprKey, tables, paths=()):
+        """Replaces the records of an hpr
+
+            Keyword Arguments:
+                hprKey: str -- identifies the hpr, i.e. its output folder name
+                tables: dict -- table name: list of record dictionaries
+                paths: list -- the csv files the records were read from or written to, recorded in the manifest (default: ())
+        """
+        try:
+            with self.connect() as conn:
+                self.writeRecords(conn, hprKey, tables, paths)
+        except:
+            print("Unexpected error publish:", sys.exc_info()[0])
+            raise
+
+    def publishCollector(self, hprKey, collector, paths=()):
+        """Replaces the records of an hpr with the records of an HLLMetadataCollector
+
+            Keyword Arguments:
+                hprKey: str -- identifies the hpr, i.e. its output folder name
+                collector: HLLMetadataCollector -- the hpr metadata
+                paths: list -- the csv files the collector was saved to (default: ())
+        """
+        self.publish(hprKey, {table: collector.getRecords(table) for table in self.tables}, paths)
+
+    def remove(self, hprKey):
+        """Drops the records of an hpr"""
+        with self.connect() as conn:
+            self.deleteRecords(conn, hprKey)
+
+    def publishDirectory(self, hprKey, directory):
+        """Replaces the records of an hpr with the Event, Analysis and Download csv files in its output folder
+
+            Keyword Arguments:
+                hprKey: str -- identifies the hpr, i.e. its output folder name
+                directory: str -- the hpr output folder
+
+            Returns:
+                published: bool -- False if the csv files are missing
+        """
+        paths = [Path.joinpath(Path(directory), table + '.csv') for table in self.tables]
+        if not all(path.exists() for path in paths):
+            return False
+        self.publish(hprKey, readMetadataDirectory(directory, self.tables), paths)
+        return True
+
+    def findMetadataDirectories(self, directory):
+        """Walks an output tree once for the folders holding hpr HLL metadata csv files
+
+            Keyword Arguments:
+                directory: str -- the batch output directory
+
+            Returns:
+                directories: dict -- hprKey (the folder relative to directory): list of csv paths
+
+            Notes:
+                The csv files in directory itself are the batch files and are skipped. Folders
+                below an hpr folder are not searched, as an hpr only writes its metadata at its root.
+        """
+        directories = {}
+        fileNames = [table + '.csv' for table in self.tables]
+        for root, dirs, files in os.walk(directory):
+            if os.path.samefile(root, directory):
+                continue
+            paths = [os.path.join(root, fileName) for fileName in fileNames if fileName in files]
+            if len(paths) > 0:
+                directories[os.path.relpath(root, directory)] = paths
+                dirs[:] = []
+        return directories
+
+    def aggregateDirectory(self, directory, maxWorkers=8):
+        """Brings the store up to date with the hpr metadata csv files of an output tree
+
+            Keyword Arguments:
+                directory: str -- the batch output directory
+                maxWorkers: int -- the number of threads reading changed csv files (default: 8)
+
+            Returns:
+                counts: dict -- the number of 'changed', 'unchanged' and 'removed' hpr folders
+        """
+        try:
+            directories = self.findMetadataDirectories(directory)
+            with self.connect() as conn:
+                manifest = {row[0]: row[1:] for row in conn.execute("""SELECT path, hprKey, mtime, size FROM manifest""")}
+                published = set(row[0] for row in conn.execute("""SELECT DISTINCT hprKey FROM [Event]"""))
+            published.update(entry[0] for entry in manifest.values())
+            recorded = Counter(entry[0] for entry in manifest.values())
+
+            changed = []
+            for hprKey, paths in directories.items():
+                current = True
+                for path in paths:
+                    stat = os.stat(path)
+                    entry = manifest.get(self.getManifestPath(path))
+                    if entry is None or entry[0] != hprKey or entry[1] != stat.st_mtime_ns or entry[2] != stat.st_size:
+                        current = False
+                if not current or recorded[hprKey] != len(paths):
+                    changed.append(hprKey)
+            removed = [hprKey for hprKey in published if hprKey not in directories]
+
+            # csv parsing releases the GIL for most of its work, so changed folders are read in threads;
+            # they are written over one connection in one transaction
+            with ThreadPoolExecutor(max_workers=max(1, maxWorkers)) as executor, self.connect() as conn:
+                readFolders = executor.map(lambda hprKey: readMetadataDirectory(Path.joinpath(Path(directory), hprKey), self.tables), changed)
+                for hprKey, records in zip(changed, readFolders):
+                    self.writeRecords(conn, hprKey, records, directories[hprKey])
+                for hprKey in removed:
+                    self.deleteRecords(conn, hprKey)
+            counts = {'changed': len(changed), 'unchanged': len(directories) - len(changed), 'removed': len(removed)}
+            print(f"HLL metadata: {counts['changed']} hpr folders read, {counts['unchanged']} unchanged, {counts['removed']} removed")
+            return counts
+        except:
+            print("Unexpected error aggregateDirectory:", sys.exc_info()[0])
+            raise
+
+    def hasHPR(self, hprKey):
+        with self.connect() as conn:
+            return conn.execute("""SELECT 1 FROM [Event] WHERE hprKey = ? LIMIT 1""", (hprKey,)).fetchone() is not None
+
+    def toDataFrame(self, table):
+        """Returns a table for every published hpr, in publishing order"""
+        with self.connect() as conn:
+            return pd.read_sql_query(
+                """SELECT {c} FROM [{t}] ORDER BY rowid""".format(
+                    t=table, c=', '.join(f'[{column}]' for column in self.tables[table])
+                ), conn
+            )
+
+    def save(self, directory):
+        """Writes the batch Event, Analysis and Download csv files
+
+            Keyword Arguments:
+                directory: str -- the batch output directory
+
+            Returns:
+                paths: list -- the written csv paths
+        """
+        try:
+            paths = []
+            for table in self.tables:
+                path = Path.joinpath(Path(directory), table + '.csv')
+                writeCSVAtomic(self.toDataFrame(table), path)
+                paths.append(path)
+            return paths
+        except:
+            print("Unexpected error save:", sys.exc_info()[0])
+            raise
+
+
+def aggregateHllMetadataFiles(directory, maxWorkers=8):
+    """Aggregates the hll metadata files of a batch export into one set at the root level
+
+    Keyword Arguments:
+        directory: str -- a batchExport root directory
+        maxWorkers: int -- the number of threads reading changed csv files (default: 8)
+
+    Notes:
+        The path should be the root folder containing all the exported hpr folder.
+        'Event.csv','Analysis.csv','Download.csv'. Watch out for the relative path in
+        the hll metadata. The hpr folders are recorded in hll-metadata.sqlite, so a rerun
+        only reads the csv files that were added or changed.
+    """
+    print(directory) #user defined outputdir
+    try:
+        store = HLLMetadataStore(Path.joinpath(Path(directory), 'hll-metadata.sqlite'))
+        store.aggregateDirectory(directory, maxWorkers=maxWorkers)
+        store.save(directory)
+    except Exception as e:
+        print('\nUnexpected error aggregating HLL Metadata')
+        print(e)
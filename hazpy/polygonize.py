@@ -0,0 +1,363 @@
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from geopandas.array import from_shapely, from_wkb, to_wkb
+from osgeo import gdal, ogr, osr
+from rasterio import features, windows
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from shapely.geometry import shape
+
+
+@contextmanager
+def openRaster(path, crs=None):
+    """Opens a raster, warped on the fly to crs when given
+
+        Keyword Arguments:
+            path: str -- the raster path
+            crs: str -- the target crs, i.e. 'epsg:4326'; the raster crs if None (default: None)
+
+        Notes:
+            The warp uses nearest neighbour resampling, so every output cell keeps a value of the source grid.
+    """
+    with rio.open(path) as raster:
+        if crs is None:
+            yield raster
+        else:
+            with WarpedVRT(raster, crs=crs, resampling=Resampling.nearest) as vrt:
+                yield vrt
+
+
+def getTileWindows(raster, tileSize=2048):
+    """Splits a raster into windows aligned to its internal blocks
+
+        Keyword Arguments:
+            raster: rasterio dataset -- an open raster
+            tileSize: int -- the approximate tile width and height in cells (default: 2048)
+
+        Returns:
+            windows: list -- rasterio windows covering the raster
+    """
+    blockHeight, blockWidth = raster.block_shapes[0]
+    # round the tile up to whole blocks so every block is decoded by one tile only
+    tileHeight = max(blockHeight, int(np.ceil(tileSize / blockHeight)) * blockHeight)
+    tileWidth = max(blockWidth, int(np.ceil(tileSize / blockWidth)) * blockWidth)
+    tiles = []
+    for rowOff in range(0, raster.height, tileHeight):
+        for colOff in range(0, raster.width, tileWidth):
+            tiles.append(windows.Window(colOff, rowOff, min(tileWidth, raster.width - colOff), min(tileHeight, raster.height - rowOff)))
+    return tiles
+
+
+def prepareBand(band, round=True, maxValue=None):
+    """Clamps negative values to zero, optionally rounds and casts to a dtype features.shapes accepts
+
+        Keyword Arguments:
+            band: numpy array -- the raster values
+            round: bool -- if True, values are rounded to the nearest integer (default: True)
+            maxValue: float -- values above this, i.e. tsunami sentinel depths, are set to zero; kept if None (default: None)
+
+        Returns:
+            band: numpy array
+    """
+    band = np.where(band < 0, 0, band)
+    if round:
+        band = np.around(band, 0)
+    if maxValue is not None:
+        band = np.where(band > maxValue, 0, band)
+    #features.shapes requires the input array dtype be one of 'int16', 'int32', 'uint8', 'uint16', 'float32'
+    if 'int' in str(band.dtype):
+        band = band.astype('int32', copy=False)
+    if 'float' in str(band.dtype):
+        band = band.astype('float32', copy=False)
+    return band
+
+
+def classifyValues(values, breaks):
+    """Bins values into classes, replacing each value with the lower break of its class
+
+        Keyword Arguments:
+            values: numpy array -- the values to classify
+            breaks: list -- ascending class breaks, i.e. [1, 2, 4, 8]; values below the first break become 0
+
+        Returns:
+            classes: numpy array -- values with the dtype of the breaks
+    """
+    breaks = np.asarray(sorted(breaks))
+    lowerBreaks = np.concatenate([[0], breaks]).astype(breaks.dtype)
+    return lowerBreaks[np.digitize(values, breaks)]
+
+
+def getValidMask(band, threshold=1, nodata=None):
+    """Marks the cells that become polygons
+
+        Keyword Arguments:
+            band: numpy array -- the prepared raster values (prepareBand)
+            threshold: float -- cells below this value are dry and skipped (default: 1)
+            nodata: numpy array -- True where the raster has no data (default: None)
+
+        Returns:
+            mask: numpy array -- True for the cells to polygonize
+    """
+    mask = band >= threshold
+    if nodata is not None:
+        mask &= ~nodata
+    return mask
+
+
+def polygonizeTile(path, window, round=True, threshold=1, classes=None, crs=None, maxValue=None):
+    """Polygonizes the wet cells of one window of a raster
+
+        Keyword Arguments:
+            path: str -- the raster path
+            window: rasterio window -- the tile to read
+            round: bool -- if True, values are rounded to the nearest integer (default: True)
+            threshold: float -- cells below this value, and nodata cells, are not polygonized (default: 1)
+            classes: list -- class breaks the values are binned into before polygonizing (default: None)
+            crs: str -- the crs the raster is warped to before polygonizing (default: None)
+            maxValue: float -- values above this are set to zero before masking and classifying (default: None)
+
+        Returns:
+            tile: tuple -- WKB geometries, values and whether each polygon touches an inner tile seam
+    """
+    with openRaster(path, crs) as raster:
+        data = raster.read(1, window=window, masked=True)
+        transform = raster.window_transform(window)
+        left, bottom, right, top = windows.bounds(window, raster.transform)
+        halfCell = min(abs(raster.transform.a), abs(raster.transform.e)) / 2
+        # only edges shared with another tile are seams; the raster edges are not
+        seams = {
+            'left': window.col_off > 0,
+            'right': window.col_off + window.width < raster.width,
+            'top': window.row_off > 0,
+            'bottom': window.row_off + window.height < raster.height,
+        }
+    band = prepareBand(data.data, round=round, maxValue=maxValue)
+    mask = getValidMask(band, threshold, np.ma.getmaskarray(data))
+    if classes is not None:
+        # adjacent cells of one class are traced as a single polygon
+        band = prepareBand(classifyValues(band, classes), round=False)
+    if not mask.any():
+        return [], np.array([], dtype=band.dtype), np.array([], dtype=bool)
+    # dry and nodata cells are excluded by the mask, so features.shapes never traces them
+    shapes = list(features.shapes(band, mask=mask, transform=transform))
+    values = np.array([value for geometry, value in shapes], dtype=band.dtype)
+    geometries = from_shapely([shape(geometry) for geometry, value in shapes])
+    del shapes
+    top, bottom = max(top, bottom), min(top, bottom)
+    bounds = geometries.bounds
+    touchesSeam = np.zeros(len(values), dtype=bool)
+    if seams['left']:
+        touchesSeam |= bounds[:, 0] <= left + halfCell
+    if seams['bottom']:
+        touchesSeam |= bounds[:, 1] <= bottom + halfCell
+    if seams['right']:
+        touchesSeam |= bounds[:, 2] >= right - halfCell
+    if seams['top']:
+        touchesSeam |= bounds[:, 3] >= top - halfCell
+    return list(to_wkb(geometries)), values, touchesSeam
+
+
+def stitchTiles(tiles):
+    """Joins tile polygons into one geodataframe, dissolving polygons split by tile seams
+
+        Keyword Arguments:
+            tiles: list -- polygonizeTile results
+
+        Returns:
+            gdf: geopandas geodataframe -- PARAMVALUE and geometry columns
+    """
+    geometries = np.array([geometry for tile in tiles for geometry in tile[0]], dtype=object)
+    values = np.concatenate([tile[1] for tile in tiles]) if len(tiles) > 0 else np.array([])
+    touchesSeam = np.concatenate([tile[2] for tile in tiles]) if len(tiles) > 0 else np.array([], dtype=bool)
+    gdf = gpd.GeoDataFrame({'PARAMVALUE': values}, geometry=from_wkb(geometries))
+    if not touchesSeam.any():
+        return gdf
+    # polygons of the same value that meet across a seam are one polygon of the full raster
+    inner = gdf[~touchesSeam]
+    seam = gdf[touchesSeam].dissolve(by='PARAMVALUE', as_index=False)
+    seam = seam.explode().reset_index(drop=True)
+    return gpd.GeoDataFrame(pd.concat([inner, seam[['PARAMVALUE', 'geometry']]], ignore_index=True), geometry='geometry')
+
+
+def getDefaultWorkers():
+    """Returns the number of polygonize processes used when maxWorkers is not given
+
+        Notes:
+            A call from a worker process (batch_export --jobs) already runs next to other exports, so it
+            polygonizes in the calling process instead of starting a pool per call. Worker threads, i.e.
+            StudyRegion.fetchMany, use every core.
+    """
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return os.cpu_count() or 1
+
+
+def polygonizeRaster(path, round=True, threshold=1, classes=None, crs=None, maxValue=None, tileSize=2048, maxWorkers=None):
+    """Polygonizes a hazard raster tile by tile in a process pool
+
+        Keyword Arguments:
+            path: str -- the raster path, i.e. a flood w001001.adf or the tsunami maxdg_ft grid
+            round: bool -- if True, values are rounded to the nearest integer (default: True)
+            threshold: float -- cells below this value, and nodata cells, are not polygonized (default: 1)
+            classes: list -- class breaks the values are binned into before polygonizing, i.e. [1, 2, 4, 8];
+                PARAMVALUE is the lower break of each class. Every distinct value is kept if None (default: None)
+            crs: str -- if given, the raster is warped to this crs before polygonizing, so cell edges stay
+                straight and no polygon vertices are reprojected afterwards (default: None)
+            maxValue: float -- values above this, i.e. tsunami sentinel depths, are set to zero before cells
+                are masked and classified; kept if None (default: None)
+            tileSize: int -- the approximate tile width and height in cells (default: 2048)
+            maxWorkers: int -- the number of processes; all cores if None, or 1 when called from a worker
+                process (default: None)
+
+        Returns:
+            gdf: geopandas geodataframe -- PARAMVALUE and geometry columns in crs, or the raster crs if None
+
+        Notes:
+            Only one tile per process is held in memory. A raster that fits in one tile, or
+            maxWorkers=1, is polygonized in the calling process.
+    """
+    try:
+        with openRaster(path, crs) as raster:
+            rasterCrs = raster.crs
+            tiles = getTileWindows(raster, tileSize)
+        maxWorkers = maxWorkers or getDefaultWorkers()
+        if len(tiles) == 1 or maxWorkers == 1:
+            results = [polygonizeTile(path, window, round, threshold, classes, crs, maxValue) for window in tiles]
+        else:
+            with ProcessPoolExecutor(max_workers=min(maxWorkers, len(tiles))) as executor:
+                results = list(executor.map(polygonizeTile, [str(path)] * len(tiles), tiles, [round] * len(tiles),
+                                            [threshold] * len(tiles), [classes] * len(tiles), [crs] * len(tiles), [maxValue] * len(tiles)))
+        gdf = stitchTiles(results)
+        gdf.crs = rasterCrs
+        return gdf
+    except:
+        print("Unexpected error polygonizeRaster:", sys.exc_info()[0])
+        raise
+
+
+def contourRaster(path, interval=1, levels=None, filled=True, threshold=1):
+    """Traces isolines or filled contour bands of a hazard raster
+
+        Keyword Arguments:
+            path: str -- the raster path, i.e. a flood w001001.adf or the tsunami maxdg_ft grid
+            interval: float -- the spacing between contour levels (default: 1)
+            levels: list -- fixed contour levels, used instead of interval, i.e. [1, 2, 4, 8] (default: None)
+            filled: bool -- if True, returns polygons between levels; if False, returns isolines (default: True)
+            threshold: float -- bands and lines below this value are left out (default: 1)
+
+        Returns:
+            gdf: geopandas geodataframe -- PARAMVALUE and geometry columns in the raster crs; PARAMVALUE is the
+                level of an isoline or the lower level of a band, and bands also carry ELEV_MIN and ELEV_MAX
+
+        Notes:
+            GDAL traces the contours over the whole array, so a statewide grid yields one feature per band or
+            line instead of one polygon per group of equal cells.
+    """
+    try:
+        raster = gdal.Open(str(path))
+        band = raster.GetRasterBand(1)
+        source = ogr.GetDriverByName('Memory').CreateDataSource('contour')
+        srs = osr.SpatialReference(wkt=raster.GetProjection())
+        layer = source.CreateLayer('contour', srs=srs, geom_type=ogr.wkbMultiPolygon if filled else ogr.wkbLineString)
+        layer.CreateField(ogr.FieldDefn('ID', ogr.OFTInteger))
+        if filled:
+            layer.CreateField(ogr.FieldDefn('ELEV_MIN', ogr.OFTReal))
+            layer.CreateField(ogr.FieldDefn('ELEV_MAX', ogr.OFTReal))
+            options = ['ID_FIELD=0', 'ELEV_FIELD_MIN=1', 'ELEV_FIELD_MAX=2', 'POLYGONIZE=YES']
+        else:
+            layer.CreateField(ogr.FieldDefn('ELEV', ogr.OFTReal))
+            options = ['ID_FIELD=0', 'ELEV_FIELD=1']
+        if levels is not None:
+            options.append('FIXED_LEVELS=' + ','.join(str(level) for level in sorted(levels)))
+        else:
+            options.append(f'LEVEL_INTERVAL={interval}')
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            options.append(f'NODATA={nodata}')
+        gdal.ContourGenerateEx(band, layer, options=options)
+        fields = ['ELEV_MIN', 'ELEV_MAX'] if filled else ['ELEV']
+        records = {field: [] for field in fields}
+        geometries = []
+        for feature in layer:
+            for field in fields:
+                records[field].append(feature.GetField(field))
+            geometries.append(bytes(feature.GetGeometryRef().ExportToWkb()))
+        gdf = gpd.GeoDataFrame(records, geometry=from_wkb(np.array(geometries, dtype=object)), crs=raster.GetProjection())
+        gdf['PARAMVALUE'] = gdf[fields[0]]
+        source = None
+        raster = None
+        gdf = gdf[gdf['PARAMVALUE'] >= threshold].reset_index(drop=True)
+        return gdf[['PARAMVALUE'] + (fields if filled else []) + ['geometry']]
+    except:
+        print("Unexpected error contourRaster:", sys.exc_info()[0])
+        raise
+
+
+def benchmarkReprojection(path, crs='epsg:4326', round=True, threshold=1, classes=None, maxWorkers=None):
+    """Times polygonizing then reprojecting the polygons against warping the raster before polygonizing
+
+        Keyword Arguments:
+            path: str -- the raster path
+            crs: str -- the target crs (default: 'epsg:4326')
+            round: bool -- if True, values are rounded to the nearest integer (default: True)
+            threshold: float -- cells below this value, and nodata cells, are not polygonized (default: 1)
+            classes: list -- class breaks the values are binned into before polygonizing (default: None)
+            maxWorkers: int -- the number of processes; all cores if None (default: None)
+
+        Returns:
+            benchmark: dict -- seconds and feature counts of both paths, and the area of each value in the
+                warped output relative to the reprojected output (1.0 is an identical area)
+    """
+    try:
+        startTime = time.time()
+        vector = polygonizeRaster(path, round=round, threshold=threshold, classes=classes, maxWorkers=maxWorkers)
+        vector.geometry = vector.geometry.to_crs(crs)
+        vectorSeconds = time.time() - startTime
+        startTime = time.time()
+        warp = polygonizeRaster(path, round=round, threshold=threshold, classes=classes, crs=crs, maxWorkers=maxWorkers)
+        warpSeconds = time.time() - startTime
+        # areas are compared in the raster crs, where cells have a constant area
+        with rio.open(path) as raster:
+            rasterCrs = raster.crs
+        vectorArea = vector.geometry.to_crs(rasterCrs).area.groupby(vector['PARAMVALUE']).sum()
+        warpArea = warp.geometry.to_crs(rasterCrs).area.groupby(warp['PARAMVALUE']).sum()
+        return {
+            'vectorSeconds': vectorSeconds,
+            'warpSeconds': warpSeconds,
+            'vectorFeatures': len(vector),
+            'warpFeatures': len(warp),
+            'areaRatio': (warpArea / vectorArea).to_dict(),
+        }
+    except:
+        print("Unexpected error benchmarkReprojection:", sys.exc_info()[0])
+        raise
+
+
+def dissolveClasses(gdf, classes, field='PARAMVALUE'):
+    """Bins the values of a polygon layer into classes and dissolves adjacent polygons of one class
+
+        Keyword Arguments:
+            gdf: geopandas geodataframe -- a hazard layer, i.e. earthquake or hurricane tracts
+            classes: list -- ascending class breaks; field becomes the lower break of each class
+            field: str -- the column holding the hazard value (default: 'PARAMVALUE')
+
+        Returns:
+            gdf: geopandas geodataframe -- field and geometry columns, one row per contiguous class area
+    """
+    try:
+        gdf = gdf[[field, 'geometry']].copy()
+        gdf[field] = classifyValues(gdf[field].to_numpy(), classes)
+        gdf = gdf.dissolve(by=field, as_index=False).explode().reset_index(drop=True)
+        return gpd.GeoDataFrame(gdf[[field, 'geometry']], geometry='geometry', crs=gdf.crs)
+    except:
+        print("Unexpected error dissolveClasses:", sys.exc_info()[0])
+        raise
@@ -6,7 +6,6 @@ from mpl_toolkits.axes_grid1.axes_divider import make_axes_locatable
 from PyPDF2 import PdfFileReader, PdfFileWriter, PdfFileMerger
 from PyPDF2.generic import BooleanObject, IndirectObject, NameObject, TextStringObject, DictionaryObject, NumberObject
 from reportlab.pdfgen import canvas
-from shapely.wkt import loads
 from uuid import uuid4 as uuid
 
 import contextily as cx
@@ -22,6 +21,11 @@ import shutil
 import sys
 import warnings
 
+try:
+    from .geometry import decodeGeometry
+except:
+    from geometry import decodeGeometry
+
 #from xhtml2pdf import pisa
 
 # Disable pandas warnings
@@ -37,10 +41,14 @@ class Report:
         title: str -- report title
         subtitle: str -- report subtitle
         icon: str -- report hazard icon (choices: 'earthquake', 'flood', 'hurricane', 'tsunami')
+        context (optional): ScenarioContext -- the hazard, scenario and return period the report is built for; default = None
 
     """
 
-    def __init__(self, studyRegionClass, title, subtitle, icon):
+    def __init__(self, studyRegionClass, title, subtitle, icon, context=None):
+        # bind to a private view so later changes to the study region do not leak into the report
+        if context is not None:
+            studyRegionClass = studyRegionClass.withContext(context)
         # double underscores make the method private and not accessible when the class is initialized
         self.__getResults = studyRegionClass.getResults
         self.__getBuildingDamageByOccupancy = (
@@ -75,7 +83,8 @@ class Report:
             technique. Therefore, there may be significant differences between the modeled results contained in this report and the actual social and economic losses following a specific {}.""".format(self.hazard)
         self.getCounties = studyRegionClass.getCounties
         self.getStates = studyRegionClass.getStates
-        self._tempDirectory = 'hazpy-report-temp'
+        # each report builds in its own folder, so reports saved at once (batch --jobs) never share or delete each other's files
+        self._tempDirectory = 'hazpy-report-temp-' + uuid().hex
 
     def format_tick(self, num, pos):
         num = float('{:.3g}'.format(num))
@@ -252,20 +261,14 @@ class Report:
             if boundary:
                 boundary = self._Report__getHazardBoundary()
                 if type(boundary) != gpd.GeoDataFrame:
-                    try:
-                        boundary['geometry'] = boundary['geometry'].apply(str)
-                        boundary['geometry'] = boundary['geometry'].apply(loads)
-                        boundary = gpd.GeoDataFrame(boundary, geometry='geometry', crs=crs)
-                    except:
-                        boundary['geometry'] = boundary['geometry'].apply(loads)
-                        boundary = gpd.GeoDataFrame(boundary, geometry='geometry', crs=crs)
+                    boundary['geometry'] = decodeGeometry(boundary['geometry'])
+                    boundary = gpd.GeoDataFrame(boundary, geometry='geometry', crs=crs)
                 # Apply minimal buffer to not cover hazards near study area boundary
                 boundary['geometry'] = boundary.geometry.buffer(.0005)
                 boundary.to_crs('EPSG:3857').plot(ax=ax, facecolor="none", edgecolor="darkgray", linewidth=0.5, alpha=0.7, linestyle='solid')
             
             if type(gdf) != gpd.GeoDataFrame:
-                gdf['geometry'] = gdf['geometry'].apply(str)
-                gdf['geometry'] = gdf['geometry'].apply(loads)
+                gdf['geometry'] = decodeGeometry(gdf['geometry'])
                 gdf = gpd.GeoDataFrame(gdf, geometry='geometry', crs=crs)
             gdf.crs='EPSG:4326'
 
@@ -283,8 +286,7 @@ class Report:
                     alpha=0.9
                 )
             except:
-                gdf['geometry'] = gdf['geometry'].apply(str)
-                gdf['geometry'] = gdf['geometry'].apply(loads)
+                gdf['geometry'] = decodeGeometry(gdf['geometry'])
                 gdf.to_crs('EPSG:3857').plot(
                     column=field,
                     cmap=cmap,
@@ -1149,7 +1151,7 @@ class Report:
                         + self.abbreviate(legend_item5)
                     )
                     # convert to GeoDataFrame
-                    economicLoss.geometry = economicLoss.geometry.apply(loads)
+                    economicLoss.geometry = decodeGeometry(economicLoss.geometry)
                     gdf = gpd.GeoDataFrame(economicLoss)
                     map_colors = ['#fabfa1', '#f3694c', '#d62128', '#6b0d0d']
                     color_ramp = LinearSegmentedColormap.from_list(
@@ -1549,7 +1551,7 @@ class Report:
                         + '-'
                         + self.abbreviate(legend_item5)
                     )
-                    economicLoss.geometry = economicLoss.geometry.apply(loads)
+                    economicLoss.geometry = decodeGeometry(economicLoss.geometry)
                     gdf = gpd.GeoDataFrame(economicLoss)
                     map_colors = ['#fabfa1', '#f3694c', '#d62128', '#6b0d0d']
                     color_ramp = LinearSegmentedColormap.from_list(
@@ -1966,7 +1968,7 @@ class Report:
                         + self.abbreviate(legend_item5)
                     )
                     # convert to GeoDataFrame
-                    economicLoss.geometry = economicLoss.geometry.apply(loads)
+                    economicLoss.geometry = decodeGeometry(economicLoss.geometry)
                     gdf = gpd.GeoDataFrame(economicLoss)
                     map_colors = ['#fabfa1', '#f3694c', '#d62128', '#6b0d0d']
                     color_ramp = LinearSegmentedColormap.from_list(
@@ -2438,7 +2440,7 @@ class Report:
                         + '-'
                         + self.abbreviate(legend_item5)
                     )
-                    economicLoss.geometry = economicLoss.geometry.apply(loads)
+                    economicLoss.geometry = decodeGeometry(economicLoss.geometry)
                     gdf = gpd.GeoDataFrame(economicLoss)
                     map_colors = ['#fabfa1', '#f3694c', '#d62128', '#6b0d0d']
                     color_ramp = LinearSegmentedColormap.from_list(
@@ -0,0 +1,273 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    from .connectionpool import getConnectionPool
+except:
+    from connectionpool import getConnectionPool
+
+
+class RestoreRegistry:
+    """Records the bk_ databases restored from hpr files so unchanged hpr files can reuse them
+
+    Each entry is keyed by the hpr fingerprint (StudyRegion.getHPRFingerprint) and holds the
+    restored database name, the logical file names of the .bk, the unzipped hpr folder that
+    holds the .mdf files and rasters, its size on disk and when it was last used. The registry
+    is a json file shared by every process exporting into the same output directory; writes
+    are serialized with a lock file and replace the json atomically.
+
+    Keyword Arguments: \n
+        registryPath: str -- the path to the registry json file
+        diskBudget: int -- the number of bytes restored hpr folders may use before the least
+            recently used ones are dropped; no limit if None (default: None)
+    """
+
+    def __init__(self, registryPath, diskBudget=None):
+        self.registryPath = Path(registryPath)
+        self.lockPath = self.registryPath.with_name(self.registryPath.name + '.lock')
+        self.diskBudget = diskBudget
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the registry is passed to worker processes; each process gets its own thread lock
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self, timeout=600, staleAfter=3600):
+        """Holds the registry lock across threads and processes"""
+        with self._lock:
+            self.registryPath.parent.mkdir(parents=True, exist_ok=True)
+            startTime = time.time()
+            while True:
+                try:
+                    handle = os.open(self.lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    os.close(handle)
+                    break
+                except FileExistsError:
+                    # a lock left behind by a killed process is removed
+                    try:
+                        if time.time() - os.path.getmtime(self.lockPath) > staleAfter:
+                            os.remove(self.lockPath)
+                            continue
+                    except OSError:
+                        pass
+                    if time.time() - startTime > timeout:
+                        raise TimeoutError(f'Timed out waiting for the restore registry lock {self.lockPath}')
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                try:
+                    os.remove(self.lockPath)
+                except OSError:
+                    pass
+
+    def read(self):
+        if not self.registryPath.exists():
+            return {}
+        try:
+            with open(self.registryPath) as f:
+                return json.load(f)
+        except Exception as e:
+            print('Unable to read the restore registry ' + str(self.registryPath))
+            print(e)
+            return {}
+
+    def write(self, entries):
+        tempPath = self.registryPath.with_name(self.registryPath.name + '.tmp')
+        with open(tempPath, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tempPath, self.registryPath)
+
+    def lookup(self, fingerprint):
+        """Returns the entry for an hpr fingerprint and marks it as used
+
+            Keyword Arguments:
+                fingerprint: str -- the hpr fingerprint
+
+            Returns:
+                entry: dict -- the registry entry, or None if the hpr has not been restored
+        """
+        try:
+            with self.locked():
+                entries = self.read()
+                entry = entries.get(fingerprint)
+                if entry is None:
+                    return None
+                entry['lastUsed'] = time.time()
+                self.write(entries)
+                return dict(entry)
+        except:
+            print("Unexpected error lookup:", sys.exc_info()[0])
+            raise
+
+    def register(self, fingerprint, name, dbName, regionName, tempDir, bkFilePath, logicalNames, hprFilePath=''):
+        """Records a restored hpr
+
+            Keyword Arguments:
+                fingerprint: str -- the hpr fingerprint
+                name: str -- the restored database name (i.e. 'bk_' + dbName)
+                dbName: str -- the database name without the bk_ prefix
+                regionName: str -- the study region name from the .bk file
+                tempDir: str -- the unzipped hpr folder holding the .mdf files
+                bkFilePath: str -- the path to the .bk file
+                logicalNames: tuple -- the data and log logical file names of the .bk
+                hprFilePath: str -- the path to the hpr file (default: '')
+
+            Notes:
+                Entries for other hpr files restored to the same database name are removed,
+                as the RESTORE replaced that database.
+        """
+        try:
+            with self.locked():
+                entries = self.read()
+                for key in [key for key, entry in entries.items() if entry['name'] == name and key != fingerprint]:
+                    del entries[key]
+                now = time.time()
+                entries[fingerprint] = {
+                    'name': name,
+                    'dbName': dbName,
+                    'regionName': regionName,
+                    'tempDir': str(tempDir),
+                    'bkFilePath': str(bkFilePath),
+                    'logicalNames': list(logicalNames),
+                    'hprFilePath': str(hprFilePath),
+                    'sizeBytes': getDirectorySize(tempDir),
+                    'restoredAt': now,
+                    'lastUsed': now,
+                }
+                self.write(entries)
+        except:
+            print("Unexpected error register:", sys.exc_info()[0])
+            raise
+
+    def remove(self, fingerprint):
+        """Forgets an entry without dropping its database
+
+            Keyword Arguments:
+                fingerprint: str -- the hpr fingerprint
+        """
+        with self.locked():
+            entries = self.read()
+            if entries.pop(fingerprint, None) is not None:
+                self.write(entries)
+
+    def getTotalSize(self):
+        """Returns the bytes used by every registered hpr folder"""
+        return sum(entry.get('sizeBytes', 0) for entry in self.read().values())
+
+    def evict(self, keep=()):
+        """Drops the least recently used restored hpr files until the disk budget is met
+
+            Keyword Arguments:
+                keep: list -- fingerprints that must not be evicted, i.e. hpr files being exported (default: ())
+
+            Returns:
+                evicted: list -- the names of the dropped databases
+        """
+        if self.diskBudget is None:
+            return []
+        try:
+            evicted = []
+            with self.locked():
+                entries = self.read()
+                totalSize = sum(entry.get('sizeBytes', 0) for entry in entries.values())
+                candidates = sorted(
+                    [key for key in entries if key not in keep],
+                    key=lambda key: entries[key].get('lastUsed', 0)
+                )
+                for key in candidates:
+                    if totalSize <= self.diskBudget:
+                        break
+                    entry = entries.pop(key)
+                    print(f"Evicting restored hpr {entry['name']} ({entry.get('sizeBytes', 0) / 1024**3:.2f} GB)...")
+                    dropRestoredDatabase(entry['name'])
+                    shutil.rmtree(entry['tempDir'], ignore_errors=True)
+                    totalSize -= entry.get('sizeBytes', 0)
+                    evicted.append(entry['name'])
+                self.write(entries)
+            return evicted
+        except:
+            print("Unexpected error evict:", sys.exc_info()[0])
+            raise
+
+    def printStats(self):
+        entries = self.read()
+        print(f'Restore registry {self.registryPath}: {len(entries)} restored hpr files, {self.getTotalSize() / 1024**3:.2f} GB')
+        if self.diskBudget is not None:
+            print(f'Disk budget: {self.diskBudget / 1024**3:.2f} GB')
+
+
+def getDirectorySize(path):
+    """Returns the number of bytes used by the files under path
+
+        Keyword Arguments:
+            path: str -- a directory
+
+        Returns:
+            size: int
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return size
+
+
+def databaseExists(name):
+    """Checks that a database is attached and online
+
+        Keyword Arguments:
+            name: str -- the database name
+
+        Returns:
+            exists: bool
+    """
+    conn = getConnectionPool().createConnection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT state_desc FROM sys.databases WHERE name = ?", name)
+        row = cursor.fetchone()
+        return row is not None and row[0] == 'ONLINE'
+    finally:
+        conn.close()
+
+
+def dropRestoredDatabase(name):
+    """Drops a restored bk_ database if it exists
+
+        Keyword Arguments:
+            name: str -- the database name
+    """
+    conn = getConnectionPool().createConnection()
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute(f"""USE MASTER
+            IF EXISTS (SELECT * FROM sys.databases WHERE name = N'{name}')
+            BEGIN
+                ALTER DATABASE [{name}] SET SINGLE_USER WITH ROLLBACK IMMEDIATE
+                DROP DATABASE [{name}]
+            END""")
+        while cursor.nextset():
+            pass
+    except Exception as e:
+        print(f'Unexpected error dropping {name}:')
+        print(e)
+    finally:
+        conn.close()
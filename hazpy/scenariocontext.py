@@ -0,0 +1,63 @@
+import copy
+from collections import namedtuple
+from functools import wraps
+
+
+class ScenarioContext(namedtuple('ScenarioContext', ['hazard', 'scenario', 'returnPeriod', 'name'])):
+    """An immutable hazard, scenario, return period and database selection for StudyRegion queries
+
+    A StudyRegion normally reads the mutable hazard, scenario and returnPeriod attributes.
+    Passing a ScenarioContext to a getter evaluates it against a private view of the study
+    region instead, so several contexts can be queried in parallel against the same database.
+
+    Keyword Arguments: \n
+        hazard: str -- the hazard (choices: 'earthquake', 'flood', 'hurricane', 'tsunami')
+        scenario: str -- the scenario name
+        returnPeriod: str -- the return period
+        name: str -- the study region database name (i.e. 'bk_' + dbName for Hazus Package Regions)
+    """
+
+    __slots__ = ()
+
+    def replace(self, **kwargs):
+        """Returns a copy of the context with the given fields replaced
+
+            Example:
+                context.replace(returnPeriod='100')
+        """
+        return self._replace(**kwargs)
+
+
+def getStudyRegionView(studyRegion, context):
+    """Creates a shallow copy of a StudyRegion bound to a ScenarioContext
+
+        The view shares the connection pool and caches with the study region; only the
+        hazard, scenario, return period and database name are its own.
+
+        Keyword Arguments:
+            studyRegion: StudyRegion -- an initialized StudyRegion
+            context: ScenarioContext -- the selection to bind
+
+        Returns:
+            view: StudyRegion
+    """
+    view = copy.copy(studyRegion)
+    view.hazard = context.hazard
+    view.scenario = context.scenario
+    view.returnPeriod = context.returnPeriod
+    view.name = context.name
+    return view
+
+
+def acceptsContext(method):
+    """Adds an optional context keyword argument to a StudyRegion method
+
+        When a ScenarioContext is passed the method runs against a view bound to it,
+        otherwise it reads the study region attributes as before.
+    """
+    @wraps(method)
+    def wrapper(self, *args, context=None, **kwargs):
+        if context is not None:
+            return method(getStudyRegionView(self, context), *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
@@ -3,25 +3,37 @@ import os
 import shutil
 import subprocess
 import sys
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 from pathlib import Path
 
 import geopandas as gpd
-import numpy as np
 import pandas as pd
 import pyodbc as py
-import rasterio as rio
 from osgeo import ogr
-from rasterio import features
-from shapely.wkt import loads
 
 try:
+    from .connectionpool import getConnectionPool
+    from .geometry import decodeGeometry, geometrySelect
+    from .geometrycache import getGeometryCache
+    from .hazardcache import getHazardCache
+    from .polygonize import contourRaster, dissolveClasses, polygonizeRaster
     from .report import Report
-    from .studyregiondataframe import StudyRegionDataFrame
+    from .restorecache import databaseExists
+    from .scenariocontext import ScenarioContext, acceptsContext, getStudyRegionView
+    from .studyregiondataframe import StudyRegionDataFrame, privateDirectory, writeChunks, zipShapefiles
 except:
+    from connectionpool import getConnectionPool
+    from geometry import decodeGeometry, geometrySelect
+    from geometrycache import getGeometryCache
+    from hazardcache import getHazardCache
+    from polygonize import contourRaster, dissolveClasses, polygonizeRaster
     from report import Report
-    from studyregiondataframe import StudyRegionDataFrame
+    from restorecache import databaseExists
+    from scenariocontext import ScenarioContext, acceptsContext, getStudyRegionView
+    from studyregiondataframe import StudyRegionDataFrame, privateDirectory, writeChunks, zipShapefiles
 
 #from shapely.geometry.multipolygon import MultiPolygon
 #from shapely.geometry.polygon import Polygon
@@ -39,19 +51,83 @@ class StudyRegion:
     Keyword Arguments:
         studyRegion: str -- the name of the study region
         hazard: str -- the name of the peril. Only necessary if the study region has more than one hazard.
+        geometryTransport: str -- 'wkt' or 'wkb' geometry transfer from SQL Server (default: 'wkt')
+
+    Notes:
+        Query methods read the hazard, scenario and returnPeriod attributes. Methods marked with
+        acceptsContext also take a context=ScenarioContext(...) keyword to query another selection
+        without changing those attributes, which is safe to do from several threads at once.
     """
 
     scenario = ''
 
-    def __init__(self, studyRegion=None, hprFilePath='', outputDir=''):
+    essentialFacilityTypes = [
+        "AirportFlty",
+        "BusFlty",
+        "CareFlty",
+        "CommunicationFlty",
+        "Dams",
+        "ElectricPowerFlty",
+        "EmergencyCtr",
+        "FerryFlty",
+        "FireStation",
+        "HighwayBridge",
+        "HighwaySegment",
+        "HighwayTunnel",
+        "Levees",
+        "LightRailBridge",
+        "LightRailFlty",
+        "LightRailSegment",
+        "LightRailTunnel",
+        "Military",
+        "NaturalGasFlty",
+        "NaturalGasPl",
+        "NuclearFlty",
+        "OilFlty",
+        "OilPl",
+        "PoliceStation",
+        "PortFlty",
+        "PotableWaterFlty",
+        "RailFlty",
+        "RailwayBridge",
+        "RailwaySegment",
+        "RailwayTunnel",
+        "Runway",
+        "School",
+        "WasteWaterFlty",
+        "WasteWaterPl",
+    ]
+
+    # TODO should tsunami be ts or eq? tsunami doesn't appear to contain essential facilities
+    essentialFacilityPrefixes = {
+        "earthquake": "eq",
+        "hurricane": "huResults",
+        "flood": "flFR",
+        "tsunami": "ts",
+    }
+
+    # column metadata and essential facility plans shared by every StudyRegion for the same database
+    _columnCatalogCache = {}
+    _essentialFacilityPlanCache = {}
+    _resultsColumnCache = {}
+    _catalogLock = threading.Lock()
+
+    def __init__(self, studyRegion=None, hprFilePath='', outputDir='', geometryTransport='wkt', dbSuffix=''):
         self.hprFilePath = Path(hprFilePath)
         self.outputDir = Path.joinpath(Path(outputDir), self.hprFilePath.stem)
-        self.tempDir = Path.joinpath(Path(outputDir), self.hprFilePath.stem + '_temp')
+        # a suffix keeps the temp folder and restored database unique when HPRs are exported in parallel
+        self.dbSuffix = dbSuffix
+        self.tempDir = Path.joinpath(Path(outputDir), self.hprFilePath.stem + '_temp' + dbSuffix)
         
         self.hazard = ''
         #self.scenario = ''
         self.returnPeriod = '' #this can sometimes have trailing spaces
         self.hazusPackageRegion = self.hprFilePath.stem #for HazusPackageRegionDataFrame
+        self.pool = getConnectionPool()
+        # 'wkt' fetches geometry as text, 'wkb' fetches binary geometry that is decoded once per frame
+        self.geometryTransport = geometryTransport
+        self.geometryCache = getGeometryCache()
+        self.hazardCache = getHazardCache()
         # TODO: Create subclasses for HPR & 'StudyRegion' - BC
         # TODO: Think of name for parent class - BC
         if studyRegion:
@@ -59,6 +135,7 @@ class StudyRegion:
             self.name = studyRegion
             self.hazard = ''
             self.dbName = studyRegion
+            self.regionName = studyRegion
             self.setHazard()
             self.report = Report(self, self.name, "", self.hazard)
         else:
@@ -66,6 +143,7 @@ class StudyRegion:
             self.HazusVersion = self.getHPRHazusVersion(self.hprComment)
             self.Hazards = self.getHPRHazards(self.hprComment)
             self.dbName = '' #does not include 'bk_' prefix
+            self.regionName = '' #the bk file name without the dbSuffix
             self.name = '' #'bk_' + self.dbName #also used in HazusPackageRegionDataFrame
             self.bkFilePath = ''
             self.LogicalNames = []
@@ -97,49 +175,6 @@ class StudyRegion:
             if scenario in scenarios:
                 self.scenario = scenario
 
-    def createConnection(self, orm='pyodbc'):
-        """ Creates a connection object to the local Hazus SQL Server database
-
-            Key Argument:
-                orm: string - - type of connection to return (choices: 'pyodbc', 'sqlalchemy')
-            Returns:
-                conn: pyodbc connection
-        """
-        try:
-            # list all Windows SQL Server drivers
-            drivers = [
-                '{ODBC Driver 17 for SQL Server}',
-                '{ODBC Driver 13.1 for SQL Server}',
-                '{ODBC Driver 13 for SQL Server}',
-                '{ODBC Driver 11 for SQL Server} ',
-                '{SQL Server Native Client 11.0}',
-                '{SQL Server Native Client 10.0}',
-                '{SQL Native Client}',
-                '{SQL Server}'
-            ]
-            computer_name = os.environ['COMPUTERNAME']
-            if orm == 'pyodbc':
-                # create connection with the latest driver
-                for driver in drivers:
-                    try:
-                        conn = py.connect(self.getConnectionString('pyodbc').format(d=driver, cn=computer_name))
-                        break
-                    except:
-                        conn = py.connect(self.getConnectionString('pyodbc_auth').format(d=driver, cn=computer_name))
-                        break
-            return conn
-        except Exception as e:
-            print('\n')
-            print(e)
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            print(fname)
-            print(exc_type, exc_tb.tb_lineno)
-            print('\n')
-
-            print("Unexpected error:", sys.exc_info()[0])
-            raise
-
     def query(self, sql):
         """Performs a SQL query on the Hazus SQL Server database
 
@@ -150,8 +185,8 @@ class StudyRegion:
             df: pandas dataframe
         """
         try:
-            self.conn = self.createConnection()
-            df = pd.read_sql(sql, self.conn)
+            with self.pool.connection() as conn:
+                df = pd.read_sql(sql, conn)
             return StudyRegionDataFrame(self, df)
         except Exception as e:
             print('\n')
@@ -165,6 +200,101 @@ class StudyRegion:
             print("Unexpected error with study region query:", sys.exc_info()[0])
             raise
 
+    def queryChunks(self, sql, chunkSize=50000):
+        """Performs a SQL query on the Hazus SQL Server database and yields the rows in chunks
+
+        Keyword Arguments:
+            sql: str -- a T-SQL query
+            chunkSize: int -- the number of rows fetched at a time with fetchmany (default: 50000)
+
+        Returns:
+            chunks: generator -- StudyRegionDataFrames of at most chunkSize rows
+
+        Notes:
+            A pooled connection is held until the generator is exhausted or closed.
+        """
+        try:
+            with self.pool.connection() as conn:
+                for df in pd.read_sql(sql, conn, chunksize=chunkSize):
+                    yield StudyRegionDataFrame(self, df)
+        except Exception:
+            # GeneratorExit is not an error: the consumer stopped early and the generator is being closed
+            print(f'{sql}\n')
+            print("Unexpected error with study region chunked query:", sys.exc_info()[0])
+            raise
+
+    def getContext(self, **kwargs):
+        """Captures the current hazard, scenario, return period and database name
+
+        Keyword Arguments:
+            kwargs: optional ScenarioContext fields to override (example: returnPeriod='100')
+
+        Returns:
+            context: ScenarioContext
+        """
+        context = ScenarioContext(self.hazard, self.scenario, self.returnPeriod, self.name)
+        return context.replace(**kwargs)
+
+    def withContext(self, context):
+        """Creates a view of the study region bound to a ScenarioContext
+
+        The view shares the connection pool and caches but not the hazard, scenario and
+        return period attributes, so it is unaffected when they are changed on the study region.
+
+        Keyword Arguments:
+            context: ScenarioContext -- the selection to bind
+
+        Returns:
+            view: StudyRegion
+        """
+        return getStudyRegionView(self, context)
+
+    def fetchMany(self, requests, maxWorkers=None, asFutures=False, context=None):
+        """Runs independent dataset requests concurrently over pooled connections
+
+        Keyword Arguments:
+            requests: dict -- name keys with a StudyRegion method name, a callable, or a (callable, args) tuple
+                (example: {'results': 'getResults', 'hazard': (self.getHazardGeoDataFrame, (True,))})
+            maxWorkers: int -- the number of requests run at once (default: the connection pool size)
+            asFutures: boolean -- if True, returns futures without waiting for them (default: False)
+            context: ScenarioContext -- optional selection that method name requests are evaluated against (default: None)
+
+        Returns:
+            frames: dict -- name keys with the returned dataframe, or None if the request failed;
+                name keys with concurrent.futures.Future objects if asFutures is True
+        """
+        try:
+            if maxWorkers is None:
+                maxWorkers = self.pool.maxSize
+            maxWorkers = max(1, min(maxWorkers, len(requests)))
+            studyRegion = self if context is None else self.withContext(context)
+            executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix='hazpy-fetch')
+            futures = {}
+            for name, request in requests.items():
+                args = ()
+                if isinstance(request, tuple):
+                    request, args = request
+                if isinstance(request, str):
+                    request = getattr(studyRegion, request)
+                futures[name] = executor.submit(request, *args)
+            # running requests still finish after shutdown; it only stops new submissions
+            executor.shutdown(wait=False)
+            if asFutures:
+                return futures
+            frames = {}
+            for name, future in futures.items():
+                try:
+                    frames[name] = future.result()
+                except Exception as e:
+                    print(f"Unexpected error fetching {name}:", sys.exc_info()[0])
+                    print(e)
+                    frames[name] = None
+            return frames
+        except:
+            print("Unexpected error fetchMany:", sys.exc_info()[0])
+            raise
+
+    @acceptsContext
     def getHazardBoundary(self):
         """Fetches the hazard boundary from a Hazus SQL Server database
 
@@ -173,8 +303,8 @@ class StudyRegion:
         """
         try:
             sql = (
-                "SELECT Shape.STAsText() as geometry from [%s].[dbo].[hzboundary]"
-                % self.name
+                "SELECT %s from [%s].[dbo].[hzboundary]"
+                % (geometrySelect(transport=self.geometryTransport), self.name)
             )
             df = self.query(sql)
             return StudyRegionDataFrame(self, df)
@@ -182,6 +312,55 @@ class StudyRegion:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
+    def getEconomicLossSQL(self):
+        """Builds the economic loss query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query
+        """
+        # constant to convert to real USD
+        constant = 1000
+        sqlDict = {
+            "earthquake": """select Tract as tract, SUM(ISNULL(TotalLoss, 0)) * {c} as EconLoss 
+            from {s}.dbo.[eqTractEconLoss] group by [eqTractEconLoss].Tract
+            HAVING Sum(ISNULL(TotalLoss, 0)) * {c} > 0
+            """.format(
+                s=self.name, c=constant
+            ),
+            "flood": """select CensusBlock as block, 
+            Sum(ISNULL(CAST(TotalLoss AS BIGINT), 0)) * {c} as EconLoss from {s}.dbo.flFRGBSEcLossByTotal
+                where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
+                and ReturnPeriodId = '{rp}'
+             group by CensusBlock
+             HAVING Sum(ISNULL(CAST(TotalLoss AS BIGINT), 0)) * {c} > 0
+             """.format(
+                s=self.name, c=constant, sc=self.scenario, rp=self.returnPeriod
+            ),
+            # NOTE: huSummaryLoss will result in double economic loss. It stores results for occupancy and structure type
+            # 'hurricane': """select TRACT as tract, SUM(ISNULL(TotLoss, 0)) * {c} as EconLoss from {s}.dbo.[huSummaryLoss]
+            #     where ReturnPeriod = '{rp} '
+            #     and huScenarioName = '{sc}'
+            #     group by Tract""".format(s=self.name, c=constant, rp=self.returnPeriod, sc=self.scenario),
+            "hurricane": """
+                select TRACT as tract, SUM(ISNULL(Total, 0)) * {c} as EconLoss from {s}.dbo.[hv_huResultsOccAllLossT]
+                    where Return_Period = '{rp}' 
+                    and huScenarioName = '{sc}'
+                    group by Tract
+                    HAVING Sum(ISNULL(Total, 0)) * {c} > 0
+            """.format(
+                s=self.name, c=constant, rp=self.returnPeriod, sc=self.scenario
+            ),
+            "tsunami": """select CensusBlock as block, SUM(ISNULL(TotalLoss, 0)) * {c} as EconLoss 
+            from {s}.dbo.tsuvResDelKTotB group by CensusBlock
+            HAVING Sum(ISNULL(TotalLoss, 0)) * {c} > 0
+            """.format(
+                s=self.name, c=constant
+            ),
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getEconomicLoss(self):
         """
         Queries the total economic loss for a study region from the local Hazus SQL Server database
@@ -190,51 +369,14 @@ class StudyRegion:
                 df: pandas dataframe -- a dataframe of economic loss
         """
         try:
-            # constant to convert to real USD
-            constant = 1000
-            sqlDict = {
-                "earthquake": """select Tract as tract, SUM(ISNULL(TotalLoss, 0)) * {c} as EconLoss 
-                from {s}.dbo.[eqTractEconLoss] group by [eqTractEconLoss].Tract
-                HAVING Sum(ISNULL(TotalLoss, 0)) * {c} > 0
-                """.format(
-                    s=self.name, c=constant
-                ),
-                "flood": """select CensusBlock as block, 
-                Sum(ISNULL(CAST(TotalLoss AS BIGINT), 0)) * {c} as EconLoss from {s}.dbo.flFRGBSEcLossByTotal
-                    where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
-                    and ReturnPeriodId = '{rp}'
-                 group by CensusBlock
-                 HAVING Sum(ISNULL(CAST(TotalLoss AS BIGINT), 0)) * {c} > 0
-                 """.format(
-                    s=self.name, c=constant, sc=self.scenario, rp=self.returnPeriod
-                ),
-                # NOTE: huSummaryLoss will result in double economic loss. It stores results for occupancy and structure type
-                # 'hurricane': """select TRACT as tract, SUM(ISNULL(TotLoss, 0)) * {c} as EconLoss from {s}.dbo.[huSummaryLoss]
-                #     where ReturnPeriod = '{rp} '
-                #     and huScenarioName = '{sc}'
-                #     group by Tract""".format(s=self.name, c=constant, rp=self.returnPeriod, sc=self.scenario),
-                "hurricane": """
-                    select TRACT as tract, SUM(ISNULL(Total, 0)) * {c} as EconLoss from {s}.dbo.[hv_huResultsOccAllLossT]
-                        where Return_Period = '{rp}' 
-                        and huScenarioName = '{sc}'
-                        group by Tract
-                        HAVING Sum(ISNULL(Total, 0)) * {c} > 0
-                """.format(
-                    s=self.name, c=constant, rp=self.returnPeriod, sc=self.scenario
-                ),
-                "tsunami": """select CensusBlock as block, SUM(ISNULL(TotalLoss, 0)) * {c} as EconLoss 
-                from {s}.dbo.tsuvResDelKTotB group by CensusBlock
-                HAVING Sum(ISNULL(TotalLoss, 0)) * {c} > 0
-                """.format(
-                    s=self.name, c=constant
-                ),
-            }
-            df = self.query(sqlDict[self.hazard])
+            sql = self.getEconomicLossSQL()
+            df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
     def getTotalEconomicLoss(self):
         """
         Queries the total economic loss summation for a study region from the local Hazus SQL Server database
@@ -245,60 +387,71 @@ class StudyRegion:
         totalLoss = self.getEconomicLoss()["EconLoss"].sum()
         return totalLoss
 
+    @acceptsContext
+    def getBuildingDamageSQL(self):
+        """Builds the building damage by census geography query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query
+        """
+        constant = 1000
+        sqlDict = {
+            "earthquake": """SELECT Tract as tract, SUM(ISNULL(PDsNoneBC, 0))
+                    As NoDamage, SUM(ISNULL(PDsSlightBC, 0)) AS Affected, SUM(ISNULL(PDsModerateBC, 0))
+                    AS Minor, SUM(ISNULL(PDsExtensiveBC, 0)) AS Major,
+                    SUM(ISNULL(PDsCompleteBC, 0)) AS Destroyed FROM [{s}].dbo.[eqTractDmg]
+                    WHERE DmgMechType = 'STR' group by Tract
+            """.format(
+                s=self.name
+            ),
+            "flood": """SELECT CensusBlock as block, 
+                    SUM(ISNULL(CAST(TotalLoss AS BIGINT), 0)) * {c}
+                    AS TotalLoss, 
+                    SUM(ISNULL(CAST(BuildingLoss AS BIGINT), 0)) * {c} AS BldgLoss,
+                    SUM(ISNULL(CAST(ContentsLoss AS BIGINT), 0)) * {c} AS ContLoss
+                    FROM [{s}].dbo.[flFRGBSEcLossBySOccup] 
+                    where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
+                    and ReturnPeriodId = '{rp}'
+                    GROUP BY CensusBlock
+                    """.format(
+                s=self.name, c=constant, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "hurricane": """SELECT Tract AS tract,
+                    SUM(ISNULL(NonDamage, 0)) As NoDamage, SUM(ISNULL(MinDamage, 0)) AS Affected,
+                    SUM(ISNULL(ModDamage, 0)) AS Minor, SUM(ISNULL(SevDamage, 0)) AS Major,
+                    SUM(ISNULL(ComDamage, 0)) AS Destroyed FROM [{s}].dbo.[huSummaryDamage]
+                    WHERE GenBldgOrGenOcc IN('COM', 'AGR', 'GOV', 'EDU', 'REL','RES', 'IND')
+                    and ReturnPeriod = '{rp}' 
+                    and huScenarioName = '{sc}'
+                    GROUP BY Tract""".format(
+                s=self.name, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "tsunami": """select CBFips as block,
+                    ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) <= 0.05 then 1 end), 0) as Affected,
+                    ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) > 0.05 and BldgLoss/(ValStruct) <= 0.3 then 1 end), 0) as Minor,
+                    ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) > 0.3 and BldgLoss/(ValStruct) <= 0.5 then 1 end), 0) as Major,
+                    ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) > 0.5 then 1 end), 0) as Destroyed
+                    from (select NsiID, ValStruct, ValCont  from {s}.dbo.tsHazNsiGbs) haz
+                        left join (select NsiID, CBFips from {s}.dbo.tsNsiGbs) gbs
+                        on haz.NsiID = gbs.NsiID
+                        left join (select NsiID, BldgLoss from {s}.dbo.tsFRNsiGbs) frn
+                        on haz.NsiID = frn.NsiID
+                        group by CBFips""".format(
+                s=self.name
+            ),
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getBuildingDamage(self):
         try:
-            constant = 1000
-            sqlDict = {
-                "earthquake": """SELECT Tract as tract, SUM(ISNULL(PDsNoneBC, 0))
-                        As NoDamage, SUM(ISNULL(PDsSlightBC, 0)) AS Affected, SUM(ISNULL(PDsModerateBC, 0))
-                        AS Minor, SUM(ISNULL(PDsExtensiveBC, 0)) AS Major,
-                        SUM(ISNULL(PDsCompleteBC, 0)) AS Destroyed FROM [{s}].dbo.[eqTractDmg]
-                        WHERE DmgMechType = 'STR' group by Tract
-                """.format(
-                    s=self.name
-                ),
-                "flood": """SELECT CensusBlock as block, 
-                        SUM(ISNULL(CAST(TotalLoss AS BIGINT), 0)) * {c}
-                        AS TotalLoss, 
-                        SUM(ISNULL(CAST(BuildingLoss AS BIGINT), 0)) * {c} AS BldgLoss,
-                        SUM(ISNULL(CAST(ContentsLoss AS BIGINT), 0)) * {c} AS ContLoss
-                        FROM [{s}].dbo.[flFRGBSEcLossBySOccup] 
-                        where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
-                        and ReturnPeriodId = '{rp}'
-                        GROUP BY CensusBlock
-                        """.format(
-                    s=self.name, c=constant, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "hurricane": """SELECT Tract AS tract,
-                        SUM(ISNULL(NonDamage, 0)) As NoDamage, SUM(ISNULL(MinDamage, 0)) AS Affected,
-                        SUM(ISNULL(ModDamage, 0)) AS Minor, SUM(ISNULL(SevDamage, 0)) AS Major,
-                        SUM(ISNULL(ComDamage, 0)) AS Destroyed FROM [{s}].dbo.[huSummaryDamage]
-                        WHERE GenBldgOrGenOcc IN('COM', 'AGR', 'GOV', 'EDU', 'REL','RES', 'IND')
-                        and ReturnPeriod = '{rp}' 
-                        and huScenarioName = '{sc}'
-                        GROUP BY Tract""".format(
-                    s=self.name, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "tsunami": """select CBFips as block,
-                        ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) <= 0.05 then 1 end), 0) as Affected,
-                        ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) > 0.05 and BldgLoss/(ValStruct) <= 0.3 then 1 end), 0) as Minor,
-                        ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) > 0.3 and BldgLoss/(ValStruct) <= 0.5 then 1 end), 0) as Major,
-                        ISNULL(count(case when BldgLoss/NULLIF(ValStruct, 0) > 0.5 then 1 end), 0) as Destroyed
-                        from (select NsiID, ValStruct, ValCont  from {s}.dbo.tsHazNsiGbs) haz
-                            left join (select NsiID, CBFips from {s}.dbo.tsNsiGbs) gbs
-                            on haz.NsiID = gbs.NsiID
-                            left join (select NsiID, BldgLoss from {s}.dbo.tsFRNsiGbs) frn
-                            on haz.NsiID = frn.NsiID
-                            group by CBFips""".format(
-                    s=self.name
-                ),
-            }
-
-            df = self.query(sqlDict[self.hazard])
+            sql = self.getBuildingDamageSQL()
+            df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             raise
 
+    @acceptsContext
     def getBuildingDamageByOccupancy(self):
         """Queries the building damage by occupancy type for a study region from the local Hazus SQL Server database
 
@@ -376,6 +529,7 @@ class StudyRegion:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
     def getBuildingDamageByType(self):
         """Queries the building damage by structure type for a study region from the local Hazus SQL Server database
 
@@ -450,6 +604,58 @@ class StudyRegion:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
+    def getInjuriesSQL(self):
+        """Builds the injuries query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query, or None if the hazard has no injuries results
+        """
+        # NOTE injuries not available for flood model - placeholder below
+        # NOTE injuries not available for hurricane model - placeholder below
+        sqlDict = {
+            "earthquake": """SELECT Tract as tract, SUM(CASE WHEN CasTime = 'N' THEN Level1Injury
+                    ELSE 0 END) AS Injury_NightLevel1, SUM(CASE WHEN CasTime = 'N'
+                    THEN Level2Injury ELSE 0 END) AS Injury_NightLevel2, SUM(CASE WHEN CasTime = 'N'
+                    THEN Level3Injury ELSE 0 END) AS Injury_NightLevel3, 
+                    SUM(CASE WHEN CasTime = 'N' THEN Level4Injury ELSE 0 END) AS Injury_NightLevel4,
+                    SUM(CASE WHEN CasTime = 'N'
+                    THEN Level1Injury ELSE 0 END) AS Injury_DayLevel1,  SUM(CASE WHEN CasTime = 'D'
+                    THEN Level2Injury ELSE 0 END) AS Injury_DayLevel2, SUM(CASE WHEN CasTime = 'D'
+                    THEN Level3Injury ELSE 0 END) AS Injury_DayLevel3,
+                    SUM(CASE WHEN CasTime = 'D' THEN Level4Injury ELSE 0 END) AS Injury_DayLevel4
+                     FROM {s}.dbo.[eqTractCasOccup]
+                    WHERE CasTime IN ('N', 'D') AND InOutTot = 'Tot' GROUP BY Tract""".format(
+                s=self.name
+            ),
+            "flood": None,
+            "hurricane": None,
+            "tsunami": """SELECT
+                    cdf.CensusBlock as block,
+                    SUM(cdf.InjuryDayTotal) as Injuries_DayFair,
+                    SUM(cdg.InjuryDayTotal) As Injuries_DayGood,
+                    SUM(cdp.InjuryDayTotal) As Injuries_DayPoor,
+                    SUM(cnf.InjuryNightTotal) As Injuries_NightFair,
+                    SUM(cng.InjuryNightTotal) As Injuries_NightGood,
+                    SUM(cnp.InjuryNightTotal) As Injuries_NightPoor
+                        FROM {s}.dbo.tsCasualtyDayFair as cdf
+                            FULL JOIN {s}.dbo.tsCasualtyDayGood as cdg
+                                ON cdf.CensusBlock = cdg.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyDayPoor as cdp
+                                ON cdf.CensusBlock = cdp.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyNightFair as cnf
+                                ON cdf.CensusBlock = cnf.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyNightGood as cng
+                                ON cdf.CensusBlock = cng.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyNightPoor as cnp
+                                ON cdf.CensusBlock = cnp.CensusBlock
+                            group by cdf.CensusBlock""".format(
+                s=self.name
+            ),
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getInjuries(self):
         """Queries the injuries for a study region from the local Hazus SQL Server database
 
@@ -457,60 +663,62 @@ class StudyRegion:
             df: pandas dataframe -- a dataframe of injuries
         """
         try:
-
-            # NOTE injuries not available for flood model - placeholder below
-            # NOTE injuries not available for hurricane model - placeholder below
-            sqlDict = {
-                "earthquake": """SELECT Tract as tract, SUM(CASE WHEN CasTime = 'N' THEN Level1Injury
-                        ELSE 0 END) AS Injury_NightLevel1, SUM(CASE WHEN CasTime = 'N'
-                        THEN Level2Injury ELSE 0 END) AS Injury_NightLevel2, SUM(CASE WHEN CasTime = 'N'
-                        THEN Level3Injury ELSE 0 END) AS Injury_NightLevel3, 
-                        SUM(CASE WHEN CasTime = 'N' THEN Level4Injury ELSE 0 END) AS Injury_NightLevel4,
-                        SUM(CASE WHEN CasTime = 'N'
-                        THEN Level1Injury ELSE 0 END) AS Injury_DayLevel1,  SUM(CASE WHEN CasTime = 'D'
-                        THEN Level2Injury ELSE 0 END) AS Injury_DayLevel2, SUM(CASE WHEN CasTime = 'D'
-                        THEN Level3Injury ELSE 0 END) AS Injury_DayLevel3,
-                        SUM(CASE WHEN CasTime = 'D' THEN Level4Injury ELSE 0 END) AS Injury_DayLevel4
-                         FROM {s}.dbo.[eqTractCasOccup]
-                        WHERE CasTime IN ('N', 'D') AND InOutTot = 'Tot' GROUP BY Tract""".format(
-                    s=self.name
-                ),
-                "flood": None,
-                "hurricane": None,
-                "tsunami": """SELECT
-                        cdf.CensusBlock as block,
-                        SUM(cdf.InjuryDayTotal) as Injuries_DayFair,
-                        SUM(cdg.InjuryDayTotal) As Injuries_DayGood,
-                        SUM(cdp.InjuryDayTotal) As Injuries_DayPoor,
-                        SUM(cnf.InjuryNightTotal) As Injuries_NightFair,
-                        SUM(cng.InjuryNightTotal) As Injuries_NightGood,
-                        SUM(cnp.InjuryNightTotal) As Injuries_NightPoor
-                            FROM {s}.dbo.tsCasualtyDayFair as cdf
-                                FULL JOIN {s}.dbo.tsCasualtyDayGood as cdg
-                                    ON cdf.CensusBlock = cdg.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyDayPoor as cdp
-                                    ON cdf.CensusBlock = cdp.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyNightFair as cnf
-                                    ON cdf.CensusBlock = cnf.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyNightGood as cng
-                                    ON cdf.CensusBlock = cng.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyNightPoor as cnp
-                                    ON cdf.CensusBlock = cnp.CensusBlock
-                                group by cdf.CensusBlock""".format(
-                    s=self.name
-                ),
-            }
-            if (sqlDict[self.hazard] == None) and self.hazard == "hurricane":
+            sql = self.getInjuriesSQL()
+            if (sql == None) and self.hazard == "hurricane":
                 df = pd.DataFrame(columns=["tract", "Injuries"])
-            elif (sqlDict[self.hazard] == None) and self.hazard == "flood":
+            elif (sql == None) and self.hazard == "flood":
                 df = pd.DataFrame(columns=["block", "Injuries"])
             else:
-                df = self.query(sqlDict[self.hazard])
+                df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
+    def getFatalitiesSQL(self):
+        """Builds the fatalities query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query, or None if the hazard has no fatalities results
+        """
+        # NOTE fatatilies not available for flood model - placeholder below
+        # NOTE fatatilies not available for hurricane model - placeholder below
+        sqlDict = {
+            "earthquake": """SELECT Tract as tract, SUM(CASE WHEN CasTime = 'N'
+                    THEN Level4Injury ELSE 0 End) AS Fatalities_Night, SUM(CASE WHEN CasTime = 'D'
+                    THEN Level4Injury ELSE 0 End) AS Fatalities_Day FROM {s}.dbo.[eqTractCasOccup]
+                    WHERE CasTime IN ('N', 'D') AND InOutTot = 'Tot' GROUP BY Tract""".format(
+                s=self.name
+            ),
+            "flood": None,
+            "hurricane": None,
+            "tsunami": """SELECT
+                    cdf.CensusBlock as block,
+                    SUM(cdf.FatalityDayTotal) As Fatalities_DayFair,
+                    SUM(cdg.FatalityDayTotal) As Fatalities_DayGood,
+                    SUM(cdp.FatalityDayTotal) As Fatalities_DayPoor,
+                    SUM(cnf.FatalityNightTotal) As Fatalities_NightFair,
+                    SUM(cng.FatalityNightTotal) As Fatalities_NightGood,
+                    SUM(cnp.FatalityNightTotal) As Fatalities_NightPoor
+                        FROM {s}.dbo.tsCasualtyDayFair as cdf
+                            FULL JOIN {s}.dbo.tsCasualtyDayGood as cdg
+                                ON cdf.CensusBlock = cdg.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyDayPoor as cdp
+                                ON cdf.CensusBlock = cdp.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyNightFair as cnf
+                                ON cdf.CensusBlock = cnf.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyNightGood as cng
+                                ON cdf.CensusBlock = cng.CensusBlock
+                            FULL JOIN {s}.dbo.tsCasualtyNightPoor as cnp
+                                ON cdf.CensusBlock = cnp.CensusBlock
+                            group by cdf.CensusBlock""".format(
+                s=self.name
+            ),
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getFatalities(self):
         """Queries the fatalities for a study region from the local Hazus SQL Server database
 
@@ -518,53 +726,49 @@ class StudyRegion:
             df: pandas dataframe -- a dataframe of fatalities
         """
         try:
-
-            # NOTE fatatilies not available for flood model - placeholder below
-            # NOTE fatatilies not available for hurricane model - placeholder below
-            sqlDict = {
-                "earthquake": """SELECT Tract as tract, SUM(CASE WHEN CasTime = 'N'
-                        THEN Level4Injury ELSE 0 End) AS Fatalities_Night, SUM(CASE WHEN CasTime = 'D'
-                        THEN Level4Injury ELSE 0 End) AS Fatalities_Day FROM {s}.dbo.[eqTractCasOccup]
-                        WHERE CasTime IN ('N', 'D') AND InOutTot = 'Tot' GROUP BY Tract""".format(
-                    s=self.name
-                ),
-                "flood": None,
-                "hurricane": None,
-                "tsunami": """SELECT
-                        cdf.CensusBlock as block,
-                        SUM(cdf.FatalityDayTotal) As Fatalities_DayFair,
-                        SUM(cdg.FatalityDayTotal) As Fatalities_DayGood,
-                        SUM(cdp.FatalityDayTotal) As Fatalities_DayPoor,
-                        SUM(cnf.FatalityNightTotal) As Fatalities_NightFair,
-                        SUM(cng.FatalityNightTotal) As Fatalities_NightGood,
-                        SUM(cnp.FatalityNightTotal) As Fatalities_NightPoor
-                            FROM {s}.dbo.tsCasualtyDayFair as cdf
-                                FULL JOIN {s}.dbo.tsCasualtyDayGood as cdg
-                                    ON cdf.CensusBlock = cdg.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyDayPoor as cdp
-                                    ON cdf.CensusBlock = cdp.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyNightFair as cnf
-                                    ON cdf.CensusBlock = cnf.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyNightGood as cng
-                                    ON cdf.CensusBlock = cng.CensusBlock
-                                FULL JOIN {s}.dbo.tsCasualtyNightPoor as cnp
-                                    ON cdf.CensusBlock = cnp.CensusBlock
-                                group by cdf.CensusBlock""".format(
-                    s=self.name
-                ),
-            }
-
-            if (sqlDict[self.hazard] == None) and self.hazard == "hurricane":
+            sql = self.getFatalitiesSQL()
+            if (sql == None) and self.hazard == "hurricane":
                 df = pd.DataFrame(columns=["tract", "Fatalities"])
-            elif (sqlDict[self.hazard] == None) and self.hazard == "flood":
+            elif (sql == None) and self.hazard == "flood":
                 df = pd.DataFrame(columns=["block", "Fatalities"])
             else:
-                df = self.query(sqlDict[self.hazard])
+                df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
+    def getDisplacedHouseholdsSQL(self):
+        """Builds the displaced households query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query, or None if the hazard has no displaced households results
+        """
+        # TODO check to see if flood is displaced households or population -- database says pop
+        # NOTE displaced households not available in tsunami model - placeholder below
+        sqlDict = {
+            "earthquake": """select Tract as tract, SUM(DisplacedHouseholds) as DisplacedHouseholds from {s}.dbo.eqTract group by Tract""".format(
+                s=self.name
+            ),
+            # TODO: Confirm if this is displaced household, and not displaced population (for the summation) - BC
+            "flood": """select CensusBlock as block, SUM(DisplacedPop) as DisplacedPopulation from {s}.dbo.flFRShelter
+                where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
+                and ReturnPeriodId = '{rp}'
+                group by CensusBlock""".format(
+                s=self.name, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "hurricane": """select TRACT as tract, SUM(DISPLACEDHOUSEHOLDS) as DisplacedHouseholds from {s}.dbo.huShelterResultsT
+                    where Return_Period = '{rp}' 
+                    and huScenarioName = '{sc}'
+                group by Tract""".format(
+                s=self.name, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "tsunami": None,
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getDisplacedHouseholds(self):
         """Queries the displaced households for a study region from the local Hazus SQL Server database
 
@@ -572,38 +776,46 @@ class StudyRegion:
             df: pandas dataframe -- a dataframe of displaced households
         """
         try:
-
-            # TODO check to see if flood is displaced households or population -- database says pop
-            # NOTE displaced households not available in tsunami model - placeholder below
-            sqlDict = {
-                "earthquake": """select Tract as tract, SUM(DisplacedHouseholds) as DisplacedHouseholds from {s}.dbo.eqTract group by Tract""".format(
-                    s=self.name
-                ),
-                # TODO: Confirm if this is displaced household, and not displaced population (for the summation) - BC
-                "flood": """select CensusBlock as block, SUM(DisplacedPop) as DisplacedPopulation from {s}.dbo.flFRShelter
-                    where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
-                    and ReturnPeriodId = '{rp}'
-                    group by CensusBlock""".format(
-                    s=self.name, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "hurricane": """select TRACT as tract, SUM(DISPLACEDHOUSEHOLDS) as DisplacedHouseholds from {s}.dbo.huShelterResultsT
-                        where Return_Period = '{rp}' 
-                        and huScenarioName = '{sc}'
-                    group by Tract""".format(
-                    s=self.name, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "tsunami": None,
-            }
-
-            if (sqlDict[self.hazard] == None) and self.hazard == "tsunami":
+            sql = self.getDisplacedHouseholdsSQL()
+            if (sql == None) and self.hazard == "tsunami":
                 df = pd.DataFrame(columns=["block", "DisplacedHouseholds"])
             else:
-                df = self.query(sqlDict[self.hazard])
+                df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
+    def getShelterNeedsSQL(self):
+        """Builds the short term shelter needs query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query, or None if the hazard has no short term shelter needs results
+        """
+        # NOTE shelter needs aren't available for the tsunami model - placeholder below
+        sqlDict = {
+            "earthquake": """select Tract as tract, SUM(ShortTermShelter) as ShelterNeeds from {s}.dbo.eqTract group by Tract""".format(
+                s=self.name
+            ),
+            "flood": """select CensusBlock as block, SUM(ShortTermNeeds) as ShelterNeeds from {s}.dbo.flFRShelter
+                where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
+                and ReturnPeriodId = '{rp}'
+                group by CensusBlock""".format(
+                s=self.name, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "hurricane": """select TRACT as tract, SUM(SHORTTERMSHELTERNEEDS) as ShelterNeeds from {s}.dbo.huShelterResultsT
+                where Return_Period = '{rp}' 
+                and huScenarioName = '{sc}'
+                 group by Tract
+                    """.format(
+                s=self.name, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "tsunami": None,
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getShelterNeeds(self):
         """Queries the short term shelter needs for a study region from the local Hazus SQL Server database
 
@@ -611,36 +823,58 @@ class StudyRegion:
             df: pandas dataframe -- a dataframe of short term shelter needs
         """
         try:
-
-            # NOTE shelter needs aren't available for the tsunami model - placeholder below
-            sqlDict = {
-                "earthquake": """select Tract as tract, SUM(ShortTermShelter) as ShelterNeeds from {s}.dbo.eqTract group by Tract""".format(
-                    s=self.name
-                ),
-                "flood": """select CensusBlock as block, SUM(ShortTermNeeds) as ShelterNeeds from {s}.dbo.flFRShelter
-                    where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
-                    and ReturnPeriodId = '{rp}'
-                    group by CensusBlock""".format(
-                    s=self.name, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "hurricane": """select TRACT as tract, SUM(SHORTTERMSHELTERNEEDS) as ShelterNeeds from {s}.dbo.huShelterResultsT
-                    where Return_Period = '{rp}' 
-                    and huScenarioName = '{sc}'
-                     group by Tract
-                        """.format(
-                    s=self.name, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "tsunami": None,
-            }
-            if (sqlDict[self.hazard] == None) and self.hazard == "tsunami":
+            sql = self.getShelterNeedsSQL()
+            if (sql == None) and self.hazard == "tsunami":
                 df = pd.DataFrame(columns=["block", "ShelterNeeds"])
             else:
-                df = self.query(sqlDict[self.hazard])
+                df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
+    def getDebrisSQL(self):
+        """Builds the debris query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query
+        """
+        constant = 1000
+        # NOTE debris not available for tsunami model - placeholder below
+        # NOTE hurricane is the only model NOT in thousands of tons. It doesn't need to be multipled by the constant
+        sqlDict = {
+            "earthquake": """select Tract as tract, SUM(DebrisW) * {c} as DebrisBW, SUM(DebrisS) * {c} as DebrisCS, SUM(DebrisTotal) * {c} as DebrisTotal from {s}.dbo.eqTract group by Tract""".format(
+                s=self.name, c=constant
+            ),
+            "flood": """select CensusBlock as block, 
+            SUM(FinishTons) * {c} as FinishTonsTotal,
+            SUM(StructureTons) * {c} as StructureTonsTotal,
+            SUM(FoundationTons) * {c} as FoundationTonsTotal,
+            SUM(FinishTons) + SUM(StructureTons) + SUM(FoundationTons) as DebrisTotal
+             from {s}.dbo.flFRDebris
+                where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
+                and ReturnPeriodId = '{rp}'
+                group by CensusBlock""".format(
+                s=self.name, c=constant, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "hurricane": """select d.tract, d.DebrisTotal, d.DebrisBW, d.DebrisCS, d.DebrisTree, (d.DebrisTree * p.TreeCollectionFactor) as DebrisEligibleTree from
+                (select Tract as tract, SUM(BRICKANDWOOD) as DebrisBW, SUM(CONCRETEANDSTEEL) as DebrisCS, SUM(Tree) as DebrisTree, SUM(BRICKANDWOOD + CONCRETEANDSTEEL + Tree) as DebrisTotal from {s}.dbo.huDebrisResultsT
+                    where Return_Period = '{rp}'
+                    and huScenarioName = '{sc}'
+                    group by Tract) d
+                    inner join (select Tract as tract, TreeCollectionFactor from {s}.dbo.huTreeParameters) p
+                    on d.tract = p.tract
+            """.format(
+                s=self.name, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "tsunami": """select CensusBlock as block, SUM(FinishTons) * {c} as DebrisTotal from {s}.dbo.flFRDebris group by CensusBlock""".format(
+                s=self.name, c=constant
+            ),
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getDebris(self):
         """Queries the debris for a study region from the local Hazus SQL Server database
 
@@ -648,40 +882,8 @@ class StudyRegion:
             df: pandas dataframe -- a dataframe of debris
         """
         try:
-            constant = 1000
-            # NOTE debris not available for tsunami model - placeholder below
-            # NOTE hurricane is the only model NOT in thousands of tons. It doesn't need to be multipled by the constant
-            sqlDict = {
-                "earthquake": """select Tract as tract, SUM(DebrisW) * {c} as DebrisBW, SUM(DebrisS) * {c} as DebrisCS, SUM(DebrisTotal) * {c} as DebrisTotal from {s}.dbo.eqTract group by Tract""".format(
-                    s=self.name, c=constant
-                ),
-                "flood": """select CensusBlock as block, 
-                SUM(FinishTons) * {c} as FinishTonsTotal,
-                SUM(StructureTons) * {c} as StructureTonsTotal,
-                SUM(FoundationTons) * {c} as FoundationTonsTotal,
-                SUM(FinishTons) + SUM(StructureTons) + SUM(FoundationTons) as DebrisTotal
-                 from {s}.dbo.flFRDebris
-                    where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}')
-                    and ReturnPeriodId = '{rp}'
-                    group by CensusBlock""".format(
-                    s=self.name, c=constant, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "hurricane": """select d.tract, d.DebrisTotal, d.DebrisBW, d.DebrisCS, d.DebrisTree, (d.DebrisTree * p.TreeCollectionFactor) as DebrisEligibleTree from
-                    (select Tract as tract, SUM(BRICKANDWOOD) as DebrisBW, SUM(CONCRETEANDSTEEL) as DebrisCS, SUM(Tree) as DebrisTree, SUM(BRICKANDWOOD + CONCRETEANDSTEEL + Tree) as DebrisTotal from {s}.dbo.huDebrisResultsT
-                        where Return_Period = '{rp}'
-                        and huScenarioName = '{sc}'
-                        group by Tract) d
-                        inner join (select Tract as tract, TreeCollectionFactor from {s}.dbo.huTreeParameters) p
-                        on d.tract = p.tract
-                """.format(
-                    s=self.name, sc=self.scenario, rp=self.returnPeriod
-                ),
-                "tsunami": """select CensusBlock as block, SUM(FinishTons) * {c} as DebrisTotal from {s}.dbo.flFRDebris group by CensusBlock""".format(
-                    s=self.name, c=constant
-                ),
-            }
-
-            df = self.query(sqlDict[self.hazard])
+            sql = self.getDebrisSQL()
+            df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             print("Unexpected error:", sys.exc_info()[0])
@@ -726,15 +928,102 @@ class StudyRegion:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
-    def getHazardGeoDataFrame(self, round=True):
+    # class breaks for getHazardGeoDataFrame(classes=...); the pga and wind breaks are the report map bins
+    hazardClasses = {
+        'depth': [1, 2, 4, 8],
+        'pga': [.0017, .0140, .0390, .0920, .1800, .3400, .6500, 1.24],
+        'wind': [75, 98, 122, 145, 169],
+    }
+    defaultHazardClasses = {'flood': 'depth', 'tsunami': 'depth', 'earthquake': 'pga', 'hurricane': 'wind'}
+
+    def getHazardClasses(self, classes):
+        """Resolves the classes option of getHazardGeoDataFrame into class breaks
+
+        Keyword Arguments:
+            classes: list or str -- class breaks, a hazardClasses name, 'default' for the active hazard's breaks, or None
+
+        Returns:
+            breaks: list -- ascending class breaks, or None to keep every value
+        """
+        if classes is None or isinstance(classes, (list, tuple)):
+            return classes
+        if classes == 'default':
+            classes = self.defaultHazardClasses[self.hazard]
+        return self.hazardClasses[classes]
+
+    def getDepthLayer(self, path, round=True, threshold=1, maxDepth=None, classes=None, warp=False, contour=None, interval=1):
+        """Polygonizes a flood or tsunami depth raster, reusing the hazard cache
+
+        Keyword Arguments:
+            path: str -- the depth raster path
+            round: boolean -- if True, depths are rounded to the nearest integer (default: True)
+            threshold: float -- depth cells below this value are left out of the polygons (default: 1)
+            maxDepth: float -- depths above this value are set to 0; kept if None (default: None)
+            classes: list -- depth class breaks applied before polygonizing (default: None)
+            warp: boolean -- if True, the raster is warped to EPSG:4326 before polygonizing instead of
+                reprojecting the polygons (default: False)
+            contour: str -- 'bands' for filled contour polygons or 'lines' for isolines instead of cell
+                polygons; classes are used as the contour levels when given (default: None)
+            interval: float -- the spacing between contour levels without classes (default: 1)
+
+        Returns:
+            gdf: geopandas GeoDataFrame -- PARAMVALUE, Depth_ft and geometry in EPSG:4326
+        """
+        def build():
+            if contour is not None:
+                # contours have few vertices, so they are reprojected rather than warped
+                gdf = contourRaster(path, interval=interval, levels=classes, filled=contour == 'bands', threshold=threshold)
+                gdf.geometry = gdf.geometry.to_crs(epsg=4326)
+                if maxDepth is not None:
+                    gdf.loc[gdf.PARAMVALUE > maxDepth, 'PARAMVALUE'] = 0
+            else:
+                #polygonized in tiles across processes; depths above maxDepth are zeroed before classes are applied...
+                gdf = polygonizeRaster(path, round=round, threshold=threshold, classes=classes, crs='epsg:4326' if warp else None, maxValue=maxDepth)
+                if not warp:
+                    gdf.geometry = gdf.geometry.to_crs(epsg=4326)
+            gdf["Depth_ft"] = gdf["PARAMVALUE"]
+            return gdf
+        # rasters extracted from an hpr are identified by their hpr members, which stay the same across runs
+        archive = self.hprFilePath if self.hprFilePath.is_file() else None
+        return self.hazardCache.getLayer(path, build, archive=archive, root=self.tempDir, band=1, round=round, threshold=threshold,
+                                         maxDepth=maxDepth, classes=classes, crs='epsg:4326', warp=warp, contour=contour, interval=interval)
+
+    def classifyHazardLayers(self, hazardDict, classes):
+        """Bins earthquake and hurricane tract layers into classes and dissolves them
+
+        Keyword Arguments:
+            hazardDict: dict -- layer name keys with hazard geodataframes; updated in place
+            classes: list -- class breaks, or None to keep the layers unchanged
+        """
+        if classes is None:
+            return
+        for key in hazardDict.keys():
+            gdf = hazardDict[key]
+            if not isinstance(gdf, gpd.GeoDataFrame):
+                gdf = gpd.GeoDataFrame(gdf, geometry=decodeGeometry(gdf['geometry']))
+            hazardDict[key] = dissolveClasses(gdf, classes)
+
+    @acceptsContext
+    def getHazardGeoDataFrame(self, round=True, threshold=1, classes=None, warp=False, contour=None, interval=1):
         """Queries the local Hazus SQL Server database and returns a geodataframe of the hazard
 
         Keyword Arguments:
             round: boolean -- if True, the hazard rasters will be rounded to the nearest integer (default: True)
+            threshold: float -- flood and tsunami depth cells below this value are left out of the polygons (default: 1)
+            classes: list or str -- class breaks the hazard values are binned into before adjacent polygons
+                of one class are dissolved, i.e. [1, 2, 4, 8]; a hazardClasses name ('depth', 'pga', 'wind') or
+                'default' for the active hazard's breaks. PARAMVALUE becomes the lower break of each class.
+                Every distinct value is kept if None (default: None)
+            warp: boolean -- if True, flood and tsunami rasters are warped to EPSG:4326 before polygonizing
+                instead of reprojecting every polygon afterwards (default: False)
+            contour: str -- 'bands' returns filled contour polygons and 'lines' returns isolines of the flood and
+                tsunami rasters at interval, or at classes when given, instead of cell polygons (default: None)
+            interval: float -- the contour spacing in the raster units, i.e. feet of depth (default: 1)
 
         Returns:
             hazardGDF: geopandas GeoDataFrame -- a geodataframe containing the spatial hazard data
         """
+        classes = self.getHazardClasses(classes)
         if hasattr(self, 'hprComment'):
             try:
                 hazard = self.hazard
@@ -752,8 +1041,8 @@ class StudyRegion:
                         sql = """SELECT a.tract, PARAMVALUE, PGA_g, geometry FROM
                             (SELECT [Tract] as tract ,[PGA] as PARAMVALUE, [PGA] as PGA_g FROM {s}.[dbo].[eqTract]) a
                             inner join
-                            (SELECT Tract as tract, Shape.STAsText() AS geometry FROM {s}.dbo.hzTract) b
-                            on a.tract = b.tract""".format(s=self.name)
+                            (SELECT Tract as tract, {g} FROM {s}.dbo.hzTract) b
+                            on a.tract = b.tract""".format(s=self.name, g=geometrySelect(transport=self.geometryTransport))
                         gdf = self.query(sql)
                     hazardDict['Peak Ground Acceleration (g)'] = gdf
 
@@ -820,32 +1109,7 @@ class StudyRegion:
                         if hazardPathDicts[idx]['returnPeriod'] == self.returnPeriod.strip() or self.returnPeriod == 'Mix0':
                             try:
                                 if hazardPathDicts[idx]['path'].exists():
-                                    raster = rio.open(hazardPathDicts[idx]['path'])
-                                    affine = raster.meta.get('transform')
-                                    crs = raster.meta.get('crs')
-                                    band = raster.read(1)
-                                    band = np.where(band < 0, 0, band)
-                                    if round:
-                                        band = np.around(band, 0)
-                                    #features.shapes requires the input array dtype be one of 'int16', 'int32', 'uint8', 'uint16', 'float32'
-                                    #This is a brute force way to convert the input dtype to a supported dtype
-                                    if 'int' in str(band.dtype):
-                                        band = band.astype('int16', copy=False)
-                                    if 'float' in str(band.dtype):
-                                        band = band.astype('float32', copy=False)
-                                    geoms = []
-                                    for geometry, value in features.shapes(band, transform=affine):
-                                        try:
-                                            if value >= 1:
-                                                result = {'properties': {
-                                                    'PARAMVALUE': value}, 'geometry': geometry}
-                                                geoms.append(result)
-                                        except:
-                                            pass
-                                    gdf = gpd.GeoDataFrame.from_features(geoms)
-                                    gdf["Depth_ft"] = gdf["PARAMVALUE"]
-                                    gdf.crs = crs
-                                    gdf.geometry = gdf.geometry.to_crs(epsg=4326)
+                                    gdf = self.getDepthLayer(hazardPathDicts[idx]['path'], round=round, threshold=threshold, classes=classes, warp=warp, contour=contour, interval=interval)
                                     hazardDict[hazardPathDicts[idx]['name']] = gdf
                             except Exception as e:
                                 print('Exception hazardPathDicts:')
@@ -902,8 +1166,7 @@ class StudyRegion:
                                         sdf = StudyRegionDataFrame(self, df)
                                         sdf["Peak_Gust"] = sdf["PARAMVALUE"]
                                         sdf = sdf.addGeometry()
-                                        sdf['geometry'] = sdf['geometry'].apply(
-                                            loads)
+                                        sdf['geometry'] = decodeGeometry(sdf['geometry'])
                                         gdf = gpd.GeoDataFrame(
                                             sdf, geometry='geometry')
                                         hazardDict[key] = gdf
@@ -913,36 +1176,11 @@ class StudyRegion:
                         pass
                 #TSUNAMI
                 if hazard == 'tsunami':
-                    raster = rio.open(Path.joinpath(self.tempDir, 'maxdg_ft/w001001.adf')) #needs testing
-                    affine = raster.meta.get('transform')
-                    crs = raster.meta.get('crs')
-                    band = raster.read(1)
-                    band = np.where(band < 0, 0, band)
-                    if round:
-                        band = np.around(band, 0)
-                    #features.shapes requires the input array dtype be one of 'int16', 'int32', 'uint8', 'uint16', 'float32'
-                    #This is a brute force way to convert the input dtype to a supported dtype
-                    if 'int' in str(band.dtype):
-                        band = band.astype('int16', copy=False)
-                    if 'float' in str(band.dtype):
-                        band = band.astype('float32', copy=False)
-
-                    geoms = []
-                    for geometry, value in features.shapes(band, transform=affine):
-                        try:
-                            if value >= 1:
-                                result = {'properties': {
-                                    'PARAMVALUE': value}, 'geometry': geometry}
-                            geoms.append(result)
-                        except:
-                            pass
-                    gdf = gpd.GeoDataFrame.from_features(geoms)
-                    gdf.PARAMVALUE[gdf.PARAMVALUE > 60] = 0
-                    gdf["Depth_ft"] = gdf["PARAMVALUE"]
-                    gdf.crs = crs
-                    gdf.geometry = gdf.geometry.to_crs(epsg=4326)
+                    gdf = self.getDepthLayer(Path.joinpath(self.tempDir, 'maxdg_ft/w001001.adf'), round=round, threshold=threshold, maxDepth=60, classes=classes, warp=warp, contour=contour, interval=interval) #needs testing
                     hazardDict['Water Depth (ft)'] = gdf
 
+                if hazard in ['earthquake', 'hurricane']:
+                    self.classifyHazardLayers(hazardDict, classes)
                 keys = list(hazardDict.keys())
                 if len(hazardDict.keys()) > 1:
                     gdf = gpd.GeoDataFrame(pd.concat([hazardDict[x] for x in keys], ignore_index=True), geometry='geometry')
@@ -984,9 +1222,9 @@ class StudyRegion:
                         sql = """SELECT a.tract, PARAMVALUE, PGA_g, geometry FROM
                             (SELECT [Tract] as tract ,[PGA] as PARAMVALUE, [PGA] as PGA_g FROM {s}.[dbo].[eqTract]) a
                             inner join
-                            (SELECT Tract as tract, Shape.STAsText() AS geometry FROM {s}.dbo.hzTract) b
+                            (SELECT Tract as tract, {g} FROM {s}.dbo.hzTract) b
                             on a.tract = b.tract""".format(
-                            s=self.name
+                            s=self.name, g=geometrySelect(transport=self.geometryTransport)
                         )
                         gdf = self.query(sql)
                     hazardDict["Peak Ground Acceleration (g)"] = gdf
@@ -1045,33 +1283,7 @@ class StudyRegion:
                             or self.returnPeriod == "Mix0"
                         ):
                             try:
-                                raster = rio.open(hazardPathDicts[idx]["path"])
-                                affine = raster.meta.get("transform")
-                                crs = raster.meta.get("crs")
-                                band = raster.read(1)
-                                band = np.where(band < 0, 0, band)
-                                if round:
-                                    band = np.rint(band)
-
-                                geoms = []
-                                for geometry, value in features.shapes(
-                                    band, transform=affine
-                                ):
-                                    try:
-                                        if value >= 1:
-                                            result = {
-                                                "properties": {"PARAMVALUE": value},
-                                                "geometry": geometry,
-                                            }
-                                        geoms.append(result)
-                                    except:
-                                        print("Unexpected error:",
-                                              sys.exc_info()[0])
-                                        pass
-                                gdf = gpd.GeoDataFrame.from_features(geoms)
-                                gdf["Depth_ft"] = gdf["PARAMVALUE"]
-                                gdf.crs = crs
-                                gdf.geometry = gdf.geometry.to_crs(epsg=4326)
+                                gdf = self.getDepthLayer(hazardPathDicts[idx]["path"], round=round, threshold=threshold, classes=classes, warp=warp, contour=contour, interval=interval)
                                 hazardDict[hazardPathDicts[idx]["name"]] = gdf
                             except:
                                 pass
@@ -1151,8 +1363,7 @@ class StudyRegion:
                                         sdf = StudyRegionDataFrame(self, df)
                                         sdf["Peak_Gust"] = sdf["PARAMVALUE"]
                                         sdf = sdf.addGeometry()
-                                        sdf["geometry"] = sdf["geometry"].apply(
-                                            loads)
+                                        sdf["geometry"] = decodeGeometry(sdf["geometry"])
                                         gdf = gpd.GeoDataFrame(
                                             sdf, geometry="geometry")
                                         hazardDict[key] = gdf
@@ -1162,37 +1373,23 @@ class StudyRegion:
                         pass
 
                 if hazard == "tsunami":
-                    raster = rio.open(
+                    # TODO: Review the 60 ft clamp - BC
+                    gdf = self.getDepthLayer(
                         r"C:\HazusData\Regions\{s}\maxdg_ft\w001001.adf".format(
                             s=self.name
-                        )
+                        ),
+                        round=round,
+                        threshold=threshold,
+                        maxDepth=60,
+                        classes=classes,
+                        warp=warp,
+                        contour=contour,
+                        interval=interval,
                     )
-                    affine = raster.meta.get("transform")
-                    crs = raster.meta.get("crs")
-                    band = raster.read(1)
-                    band = np.where(band < 0, 0, band)
-                    if round:
-                        band = np.rint(band)
-
-                    geoms = []
-                    for geometry, value in features.shapes(band, transform=affine):
-                        try:
-                            if value >= 1:
-                                result = {
-                                    "properties": {"PARAMVALUE": value},
-                                    "geometry": geometry,
-                                }
-                            geoms.append(result)
-                        except:
-                            pass
-                    gdf = gpd.GeoDataFrame.from_features(geoms)
-                    # TODO: Review this - BC
-                    gdf.PARAMVALUE[gdf.PARAMVALUE > 60] = 0
-                    gdf["Depth_ft"] = gdf["PARAMVALUE"]
-                    gdf.crs = crs
-                    gdf.geometry = gdf.geometry.to_crs(epsg=4326)
                     hazardDict["Water Depth (ft)"] = gdf
 
+                if hazard in ["earthquake", "hurricane"]:
+                    self.classifyHazardLayers(hazardDict, classes)
                 keys = list(hazardDict.keys())
                 if len(hazardDict.keys()) > 1:
                     gdf = gpd.GeoDataFrame(
@@ -1314,219 +1511,275 @@ class StudyRegion:
             print("Unexpected error getReturnPeriods:", sys.exc_info()[0])
             raise
 
-    def getEssentialFacilities(self):
-        """Queries the call essential facilities for a study region in local Hazus SQL Server database
+    def getColumnCatalog(self, refresh=False):
+        """Loads the column metadata for every essential facility table in the study region with one query
+
+        Keyword Arguments:
+            refresh: boolean -- if True, the cached catalog for the study region is reloaded (default: False)
 
         Returns:
-            df: pandas dataframe -- a dataframe of the essential facilities and damages
+            catalog: dict -- table name keys with a list of (column name, data type) tuples in ordinal order
         """
         try:
-            essentialFacilities = [
-                "AirportFlty",
-                "BusFlty",
-                "CareFlty",
-                "CommunicationFlty",
-                "Dams",
-                "ElectricPowerFlty",
-                "EmergencyCtr",
-                "FerryFlty",
-                "FireStation",
-                "HighwayBridge",
-                "HighwaySegment",
-                "HighwayTunnel",
-                "Levees",
-                "LightRailBridge",
-                "LightRailFlty",
-                "LightRailSegment",
-                "LightRailTunnel",
-                "Military",
-                "NaturalGasFlty",
-                "NaturalGasPl",
-                "NuclearFlty",
-                "OilFlty",
-                "OilPl",
-                "PoliceStation",
-                "PortFlty",
-                "PotableWaterFlty",
-                "RailFlty",
-                "RailwayBridge",
-                "RailwaySegment",
-                "RailwayTunnel",
-                "Runway",
-                "School",
-                "WasteWaterFlty",
-                "WasteWaterPl",
+            with StudyRegion._catalogLock:
+                if not refresh and self.name in StudyRegion._columnCatalogCache:
+                    return StudyRegion._columnCatalogCache[self.name]
+            prefixes = ['hz'] + list(self.essentialFacilityPrefixes.values())
+            tables = [prefix + facility for prefix in prefixes for facility in self.essentialFacilityTypes]
+            tableList = ", ".join(["N'" + x + "'" for x in tables])
+            sql = """SELECT TABLE_NAME as "tableName", COLUMN_NAME as "fieldName", DATA_TYPE as "dataType"
+                    FROM {s}.INFORMATION_SCHEMA.COLUMNS
+                    WHERE TABLE_NAME IN ({t})
+                    ORDER BY TABLE_NAME, ORDINAL_POSITION""".format(
+                s=self.name, t=tableList
+            )
+            df = self.query(sql)
+            catalog = {}
+            for tableName, fieldName, dataType in zip(df["tableName"], df["fieldName"], df["dataType"]):
+                catalog.setdefault(tableName, []).append((fieldName, dataType))
+            with StudyRegion._catalogLock:
+                StudyRegion._columnCatalogCache[self.name] = catalog
+            return catalog
+        except:
+            print("Unexpected error getColumnCatalog:", sys.exc_info()[0])
+            raise
+
+    def clearCatalogCache(self):
+        """Removes the cached column catalog, essential facility plans and results columns for the study region"""
+        with StudyRegion._catalogLock:
+            StudyRegion._columnCatalogCache.pop(self.name, None)
+            for key in [x for x in StudyRegion._essentialFacilityPlanCache if x[0] == self.name]:
+                del StudyRegion._essentialFacilityPlanCache[key]
+            for key in [x for x in StudyRegion._resultsColumnCache if x[0] == self.name]:
+                del StudyRegion._resultsColumnCache[key]
+
+    def getEssentialFacilityPlans(self):
+        """Builds the per facility select statements for the active hazard from the column catalog
+
+        Facilities whose shared columns have matching data types are grouped into batches so
+        each batch can be read with a single UNION ALL statement.
+
+        Returns:
+            batches: list -- a list of batches; each batch is a dict with the ordered output columns and the facility plans
+        """
+        key = (self.name, self.hazard, self.geometryTransport)
+        with StudyRegion._catalogLock:
+            if key in StudyRegion._essentialFacilityPlanCache:
+                return StudyRegion._essentialFacilityPlanCache[key]
+        catalog = self.getColumnCatalog()
+        prefix = self.essentialFacilityPrefixes[self.hazard]
+        # build query fields for hz table
+        containFields = [
+            "Name",
+            "City",
+            "County",
+            "State",
+            "Fips",
+            "Shape",
+        ]
+        plans = []
+        for facility in self.essentialFacilityTypes:
+            srTable = catalog.get(prefix + facility, [])
+            if len(srTable) == 0:
+                continue
+            srTypes = dict(srTable)
+            srcolumns = [x for x, _ in srTable]
+            # remove confounding columns
+            if "StudyCaseId" in srcolumns:
+                srcolumns.remove("StudyCaseId")
+            if "ReturnPeriodId" in srcolumns:
+                srcolumns.remove("ReturnPeriodId")
+
+            # get Id column name
+            idColumnList = [x for x in srcolumns if facility in x]
+            if len(idColumnList) == 0:
+                idColumnList = [
+                    x for x in srcolumns if x.endswith("Id")]
+            idColumn = idColumnList[0]
+
+            # build query fields for study region table
+            tempColumns = ["[" + x + "]" for x in srcolumns]
+            tempColumns.insert(
+                0, "'" + facility + "'" + ' as "FacilityType"'
+            )
+            tempColumns.insert(
+                0, "[" + idColumn + "] as FacilityId")
+            studyRegionColumns = ", ".join(tempColumns)
+
+            # limit hz fields to containFields
+            hzTable = catalog.get("hz" + facility, [])
+            hzTypes = dict(hzTable)
+            hzcolumns = [
+                x for x, _ in hzTable if any(f in x for f in containFields)
+            ]
+            tempColumns = ["[" + x + "]" for x in hzcolumns]
+            tempColumns = [
+                x.replace(
+                    "[Shape]", geometrySelect(transport=self.geometryTransport))
+                for x in tempColumns
+            ]
+            tempColumns = [
+                x.replace("[Statea]", "[Statea] as State")
+                for x in tempColumns
             ]
+            tempColumns.insert(
+                0, "[" + idColumn + "] as FacilityId")
+            hazusColumns = ", ".join(tempColumns)
+
+            # build queryset columns as (name, expression, data type)
+            outputColumns = [("FacilityType", "sr.FacilityType", "facilitytype")]
+            for column in srcolumns:
+                expression = "sr." + column.replace(idColumn, "FacilityId")
+                # rename minor/moderate/severe/complete
+                expression = expression.replace("MINOR", "MINOR as Affected")
+                expression = expression.replace("MODERATE", "MODERATE as Minor")
+                expression = expression.replace("SEVERE", "SEVERE as Major")
+                expression = expression.replace("COMPLETE", "COMPLETE as Destroyed")
+                # change to real dollars
+                if expression == "sr.EconLoss":
+                    expression = "sr.EconLoss * 1000 as EconLoss"
+                outputColumns.append((expression, srTypes.get(column, "unknown")))
+            for column in hzcolumns:
+                expression = "hz." + column.replace("Statea", "State").replace("Shape", "geometry")
+                dataType = "geometry" if column == "Shape" else hzTypes.get(column, "unknown")
+                outputColumns.append((expression, dataType))
+            columns = []
+            for outputColumn in outputColumns:
+                if len(outputColumn) == 3:
+                    columns.append(outputColumn)
+                    continue
+                expression, dataType = outputColumn
+                if " as " in expression:
+                    expression, name = expression.rsplit(" as ", 1)
+                else:
+                    name = expression.split(".", 1)[1]
+                # keep the first column when a name repeats
+                if name not in [x[0] for x in columns]:
+                    columns.append((name, expression, dataType))
+
+            plans.append({
+                "facility": facility,
+                "table": prefix + facility,
+                "studyRegionColumns": studyRegionColumns,
+                "hazusColumns": hazusColumns,
+                "columns": columns,
+            })
+
+        # group facilities whose shared columns have the same data types
+        batches = []
+        for plan in plans:
+            planTypes = {name: dataType for name, _, dataType in plan["columns"]}
+            for batch in batches:
+                if all(batch["types"][x] == planTypes[x] for x in planTypes if x in batch["types"]):
+                    break
+            else:
+                batch = {"types": {}, "columns": [], "plans": []}
+                batches.append(batch)
+            for name, _, dataType in plan["columns"]:
+                if name not in batch["types"]:
+                    batch["types"][name] = dataType
+                    batch["columns"].append(name)
+            batch["plans"].append(plan)
 
-            # TODO should tsunami be ts or eq? tsunami doesn't appear to contain essential facilities
-            prefixDict = {
-                "earthquake": "eq",
-                "hurricane": "huResults",
-                "flood": "flFR",
-                "tsunami": "ts",
-            }
-            prefix = prefixDict[self.hazard]
-            essentialFacilityDataFrames = {}
-            for facility in essentialFacilities:
-                try:
-                    # get all column names for study region table
-                    sql = """SELECT COLUMN_NAME as "fieldName" FROM {s}.INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = N'{p}{f}'""".format(
-                        s=self.name, f=facility, p=prefix
-                    )
-                    df = self.query(sql)
-                    if len(df) > 0:
-                        srcolumns = df["fieldName"].tolist()
-                        # remove confounding columns
-                        if "StudyCaseId" in srcolumns:
-                            srcolumns.remove("StudyCaseId")
-                        if "ReturnPeriodId" in srcolumns:
-                            srcolumns.remove("ReturnPeriodId")
-
-                        # get Id column name
-                        idColumnList = [x for x in srcolumns if facility in x]
-                        if len(idColumnList) == 0:
-                            idColumnList = [
-                                x for x in srcolumns if x.endswith("Id")]
-                        idColumn = idColumnList[0]
-
-                        # build query fields for study region table
-                        tempColumns = [x.replace(x, "[" + x + "]")
-                                       for x in srcolumns]
-                        tempColumns.insert(
-                            0, "'" + facility + "'" + ' as "FacilityType"'
-                        )
-                        tempColumns.insert(
-                            0, "[" + idColumn + "] as FacilityId")
-                        studyRegionColumns = ", ".join(tempColumns)
+        with StudyRegion._catalogLock:
+            StudyRegion._essentialFacilityPlanCache[key] = batches
+        return batches
 
-                        # get all column names for hz table
-                        sql = """SELECT COLUMN_NAME as "fieldName" FROM {s}.INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = N'hz{f}'""".format(
-                            s=self.name, f=facility#, p=prefix
-                        )
-                        df = self.query(sql)
-                        hzcolumns = df["fieldName"].tolist()
-
-                        # build query fields for hz table
-                        containFields = [
-                            "Name",
-                            "City",
-                            "County",
-                            "State",
-                            "Fips",
-                            "Shape",
-                        ]
-                        # limit fields to containFields
-                        hzcolumns = [
-                            x for x in hzcolumns if any(f in x for f in containFields)
-                        ]
-                        tempColumns = [x.replace(x, "[" + x + "]")
-                                       for x in hzcolumns]
-                        tempColumns = [
-                            x.replace(
-                                "[Shape]", "Shape.STAsText() as geometry")
-                            for x in tempColumns
-                        ]
-                        tempColumns = [
-                            x.replace("[Statea]", "[Statea] as State")
-                            for x in tempColumns
-                        ]
-                        tempColumns.insert(
-                            0, "[" + idColumn + "] as FacilityId")
-                        hazusColumns = ", ".join(tempColumns)
-
-                        # build queryset columns
-                        # replace hzcolumns
-                        hzcolumns = [x.replace("Statea", "State")
-                                     for x in hzcolumns]
-                        hzcolumns = [x.replace("Shape", "geometry")
-                                     for x in hzcolumns]
-                        # replace srcolumns
-                        srcolumns = [
-                            x.replace(idColumn, "FacilityId") for x in srcolumns
-                        ]
-                        srcolumns.insert(0, "FacilityType")
-                        # rename minor/moderate/severe/complete
-                        srcolumns = [
-                            x.replace("MINOR", "MINOR as Affected") for x in srcolumns
-                        ]
-                        srcolumns = [
-                            x.replace("MODERATE", "MODERATE as Minor")
-                            for x in srcolumns
-                        ]
-                        srcolumns = [
-                            x.replace("SEVERE", "SEVERE as Major") for x in srcolumns
-                        ]
-                        srcolumns = [
-                            x.replace("COMPLETE", "COMPLETE as Destroyed")
-                            for x in srcolumns
-                        ]
-                        hzcolumnsFinal = ", ".join(
-                            ["hz." + x for x in hzcolumns])
-                        srcolumnsFinal = ", ".join(
-                            ["sr." + x for x in srcolumns])
-                        querysetColumns = (
-                            ", ".join([srcolumnsFinal, hzcolumnsFinal])).strip().rstrip(',')
-                        # change to real dollars
-                        if "sr.EconLoss" in querysetColumns:
-                            querysetColumns = querysetColumns.replace(
-                                "sr.EconLoss", "sr.EconLoss * 1000 as EconLoss"
-                            ).rstrip(', ')
-                        # build where clause
-                        whereClauseDict = {
-                            "earthquake": """where EconLoss > 0""",
-                            "flood": """where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}') and ReturnPeriodId = '{rp}'""".format(
-                                s=self.name, sc=self.scenario, rp=self.returnPeriod
-                            ),
-                            "hurricane": """where Return_Period = '{rp}' and huScenarioName = '{sc}'""".format(
-                                sc=self.scenario, rp=self.returnPeriod
-                            ),
-                            "tsunami": """where EconLoss > 0""",
-                        }
-                        whereClause = whereClauseDict[self.hazard]
-
-                        # build dynamic sql query
-                        sql = """
-                                SELECT
-                                    {qc}
-                                    FROM
-                                    (SELECT
-                                        {src}
-                                        from [{s}].[dbo].[{p}{f}]
-                                        {wc}) sr
-                                    left join
-                                    (SELECT
-                                        {hzc}
-                                        from [{s}].[dbo].[hz{f}]) hz
-                                    on hz.FacilityID = sr.FacilityID
-                                """.format(
-                            #i=idColumn,
-                            s=self.name,
-                            f=facility,
-                            p=prefix,
-                            qc=querysetColumns,
-                            src=studyRegionColumns,
-                            hzc=hazusColumns,
-                            wc=whereClause
-                        )
+    def getEssentialFacilitiesSQL(self, batch, plans=None):
+        """Renders one UNION ALL statement over the facility tables in a batch
 
-                        # get queryset from database
-                        df = self.query(sql)
-                        # check if the queryset contains data
-                        if len(df) > 1:
-                            # convert all booleans to string
-                            mask = df.applymap(type) != bool
-                            replaceDict = {True: "TRUE", False: "FALSE"}
-                            df = df.where(mask, df.replace(replaceDict))
-                            # add to dictionary
-                            essentialFacilityDataFrames[facility] = df
+        Keyword Arguments:
+            batch: dict -- a batch from getEssentialFacilityPlans
+            plans: list -- optional subset of the batch plans to render (default: all plans in the batch)
+
+        Returns:
+            sql: str -- a T-SQL query
+        """
+        # build where clause
+        whereClauseDict = {
+            "earthquake": """where EconLoss > 0""",
+            "flood": """where StudyCaseId = (select StudyCaseID from {s}.[dbo].[flStudyCase] where StudyCaseName = '{sc}') and ReturnPeriodId = '{rp}'""".format(
+                s=self.name, sc=self.scenario, rp=self.returnPeriod
+            ),
+            "hurricane": """where Return_Period = '{rp}' and huScenarioName = '{sc}'""".format(
+                sc=self.scenario, rp=self.returnPeriod
+            ),
+            "tsunami": """where EconLoss > 0""",
+        }
+        whereClause = whereClauseDict[self.hazard]
+        statements = []
+        for plan in (plans if plans is not None else batch["plans"]):
+            expressions = {name: expression for name, expression, _ in plan["columns"]}
+            querysetColumns = ", ".join(
+                [expressions.get(x, "NULL") + " as [" + x + "]" for x in batch["columns"]]
+            )
+            statements.append("""
+                    SELECT
+                        {qc}
+                        FROM
+                        (SELECT
+                            {src}
+                            from [{s}].[dbo].[{t}]
+                            {wc}) sr
+                        left join
+                        (SELECT
+                            {hzc}
+                            from [{s}].[dbo].[hz{f}]) hz
+                        on hz.FacilityID = sr.FacilityID
+                    """.format(
+                s=self.name,
+                f=plan["facility"],
+                t=plan["table"],
+                qc=querysetColumns,
+                src=plan["studyRegionColumns"],
+                hzc=plan["hazusColumns"],
+                wc=whereClause
+            ))
+        return "UNION ALL".join(statements)
+
+    @acceptsContext
+    def getEssentialFacilities(self):
+        """Queries the call essential facilities for a study region in local Hazus SQL Server database
+
+        Column metadata is loaded once per study region and cached, and facility tables are
+        read with UNION ALL statements instead of one query per facility.
+
+        Returns:
+            df: pandas dataframe -- a dataframe of the essential facilities and damages
+        """
+        try:
+            essentialFacilityDataFrames = []
+            for batch in self.getEssentialFacilityPlans():
+                try:
+                    frames = [self.query(self.getEssentialFacilitiesSQL(batch))]
                 except:
-                    print("Unexpected error:", sys.exc_info()[0])
-                    pass
+                    # fall back to one statement per facility so a single bad table does not drop the batch
+                    print("Unexpected error querying essential facility batch:", sys.exc_info()[0])
+                    frames = []
+                    for plan in batch["plans"]:
+                        try:
+                            frames.append(self.query(self.getEssentialFacilitiesSQL(batch, [plan])))
+                        except:
+                            print("Unexpected error:", sys.exc_info()[0])
+                            pass
+                for df in frames:
+                    # only keep facility types where the queryset contains data
+                    counts = df["FacilityType"].map(df["FacilityType"].value_counts())
+                    df = df[counts > 1]
+                    if len(df) > 0:
+                        # drop padding columns that do not apply to any facility left in the frame
+                        df = df[[x for x in df.columns if x in set().union(
+                            *[[c[0] for c in plan["columns"]] for plan in batch["plans"]
+                              if plan["facility"] in set(df["FacilityType"])])]]
+                        # convert all booleans to string
+                        mask = df.applymap(type) != bool
+                        replaceDict = {True: "TRUE", False: "FALSE"}
+                        df = df.where(mask, df.replace(replaceDict))
+                        essentialFacilityDataFrames.append(df)
             # if essentialFacilityDataFrames contains data, concatenate into a dataframe
             if len(essentialFacilityDataFrames) > 0:
                 essentialFacilityDf = pd.concat(
-                    [x.fillna("null")
-                     for x in essentialFacilityDataFrames.values()],
+                    essentialFacilityDataFrames,
                     sort=False,
                 ).fillna("null")
                 return StudyRegionDataFrame(self, essentialFacilityDf)
@@ -1537,6 +1790,30 @@ class StudyRegion:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
+    def getDemographicsSQL(self):
+        """Builds the demographics query for the active hazard
+
+        Returns:
+            sql: str -- a T-SQL query
+        """
+        sqlDict = {
+            "earthquake": """select Tract as tract, Population, Households FROM {s}.dbo.[hzDemographicsT]""".format(
+                s=self.name
+            ),
+            "flood": """select CensusBlock as block, Population, Households FROM {s}.dbo.[hzDemographicsB]""".format(
+                s=self.name
+            ),
+            "hurricane": """select Tract as tract, Population, Households FROM {s}.dbo.[hzDemographicsT]""".format(
+                s=self.name
+            ),
+            "tsunami": """select CensusBlock as block, Population, Households FROM {s}.dbo.[hzDemographicsB]""".format(
+                s=self.name
+            ),
+        }
+        return sqlDict[self.hazard]
+
+    @acceptsContext
     def getDemographics(self):
         """Summarizes demographics at the lowest level of geography
 
@@ -1544,34 +1821,202 @@ class StudyRegion:
             df: pandas dataframe -- a dataframe of the summarized demographics
         """
         try:
-
-            sqlDict = {
-                "earthquake": """select Tract as tract, Population, Households FROM {s}.dbo.[hzDemographicsT]""".format(
-                    s=self.name
-                ),
-                "flood": """select CensusBlock as block, Population, Households FROM {s}.dbo.[hzDemographicsB]""".format(
-                    s=self.name
-                ),
-                "hurricane": """select Tract as tract, Population, Households FROM {s}.dbo.[hzDemographicsT]""".format(
-                    s=self.name
-                ),
-                "tsunami": """select CensusBlock as block, Population, Households FROM {s}.dbo.[hzDemographicsB]""".format(
-                    s=self.name
-                ),
-            }
-
-            df = self.query(sqlDict[self.hazard])
+            sql = self.getDemographicsSQL()
+            df = self.query(sql)
             return StudyRegionDataFrame(self, df)
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
-    def getResults(self):
+    def getResultsFragments(self):
+        """Collects the per hazard queries that make up the summarized results
+
+        Returns:
+            fragments: list -- (name, sql) tuples in merge order; economic loss is first
+        """
+        fragments = [
+            ("econ", self.getEconomicLossSQL()),
+            ("dmg", self.getBuildingDamageSQL()),
+            ("fatal", self.getFatalitiesSQL()),
+            ("injury", self.getInjuriesSQL()),
+            ("shelter", self.getShelterNeedsSQL()),
+            ("displaced", self.getDisplacedHouseholdsSQL()),
+            ("debris", self.getDebrisSQL()),
+            ("demog", self.getDemographicsSQL()),
+        ]
+        # hazards without a result type have no query; their columns would be dropped as all null
+        return [x for x in fragments if x[1] != None]
+
+    def getResultsColumns(self, fragments):
+        """Describes the output columns of each results query without running it
+
+        Keyword Arguments:
+            fragments: list -- (name, sql) tuples from getResultsFragments
+
+        Returns:
+            columns: dict -- fragment name keys with a list of column names in query order
+        """
+        key = (self.name, self.hazard)
+        with StudyRegion._catalogLock:
+            if key in StudyRegion._resultsColumnCache:
+                return StudyRegion._resultsColumnCache[key]
+        sql = " UNION ALL ".join(
+            [
+                """SELECT '{n}' as fragment, column_ordinal as ordinal, name FROM sys.dm_exec_describe_first_result_set(N'{q}', NULL, 0)""".format(
+                    n=name, q=fragment.replace("'", "''")
+                )
+                for name, fragment in fragments
+            ]
+        )
+        df = self.query(sql).sort_values(["fragment", "ordinal"])
+        columns = {name: [] for name, _ in fragments}
+        for fragment, name in zip(df["fragment"], df["name"]):
+            columns[fragment].append(name)
+        with StudyRegion._catalogLock:
+            StudyRegion._resultsColumnCache[key] = columns
+        return columns
+
+    # geography key: (census geometry table, key column) joined by getResultsSQL(geometry=True)
+    resultsGeometryTables = {
+        'block': ('hzCensusBlock_TIGER', 'CensusBlock'),
+        'tract': ('hzTract', 'Tract'),
+    }
+
+    @acceptsContext
+    def getResultsSQL(self, columns=None, geometry=False):
+        """Composes the results queries into one statement joined on the census geography
+
+        Each result type becomes a common table expression that is left joined to the
+        economic loss rows, which matches the client side outer merge followed by the
+        EconLoss filter in getResults.
+
+        Keyword Arguments:
+            columns: list -- optional result columns to return; the geography key is always returned (default: all columns)
+            geometry: boolean -- if True, the block or tract geometry is joined on the server and returned
+                as a geometry column (default: False)
+
+        Returns:
+            sql: str -- a T-SQL query
+        """
+        fragments = self.getResultsFragments()
+        fragmentColumns = self.getResultsColumns(fragments)
+        econColumns = fragmentColumns["econ"]
+        geographyKey = [x for x in ["block", "tract", "county"] if x in econColumns][0]
+        selected = ["econ.[" + geographyKey + "]"]
+        seen = [geographyKey]
+        for name, _ in fragments:
+            for column in fragmentColumns[name]:
+                # keep the first column when a name repeats, the key included
+                if column in seen:
+                    continue
+                if columns is not None and column not in columns:
+                    continue
+                selected.append(name + ".[" + column + "]")
+                seen.append(column)
+        ctes = ",\n".join(["{n} AS ({q})".format(n=name, q=fragment) for name, fragment in fragments])
+        joins = "\n".join(
+            [
+                "LEFT JOIN {n} ON {n}.[{k}] = econ.[{k}]".format(n=name, k=geographyKey)
+                for name, _ in fragments[1:]
+            ]
+        )
+        if geometry and geographyKey in self.resultsGeometryTables:
+            table, keyColumn = self.resultsGeometryTables[geographyKey]
+            selected.append(geometrySelect("geo.[Shape]", transport=self.geometryTransport))
+            joins += "\nLEFT JOIN [{s}].[dbo].[{t}] geo ON geo.[{c}] = econ.[{k}]".format(
+                s=self.name, t=table, c=keyColumn, k=geographyKey
+            )
+        sql = """WITH {ctes}
+            SELECT {c}
+            FROM econ
+            {j}
+            WHERE econ.EconLoss IS NOT NULL""".format(
+            ctes=ctes, c=", ".join(selected), j=joins
+        )
+        return sql
+
+    @acceptsContext
+    def getResults(self, serverSide=True, columns=None):
         """Summarizes results at the lowest level of geography
 
+        Keyword Arguments:
+            serverSide: boolean -- if True, the results are joined in one SQL Server query; if False or
+                the server side query fails, each result type is queried and merged in pandas (default: True)
+            columns: list -- optional result columns to return; the geography key is always returned (default: all columns)
+
         Returns:
             df: pandas dataframe -- a dataframe of the summarized results
         """
+        try:
+            df = None
+            if serverSide:
+                try:
+                    df = self.query(self.getResultsSQL(columns))
+                except:
+                    print("Unable to join results on the server, merging in pandas:", sys.exc_info()[0])
+                    df = None
+            if df is None:
+                df = self.getResultsClientSide()
+                if columns is not None:
+                    df = df[[x for x in df.columns if x in ["block", "tract", "county"] or x in columns]]
+            # Find the columns where each value is null
+            empty_cols = [col for col in df.columns if df[col].isnull().all()]
+            # Drop these columns from the dataframe
+            df = df.drop(empty_cols, axis=1)
+
+            return StudyRegionDataFrame(self, df)
+        except:
+            print("Unexpected error:", sys.exc_info()[0])
+            raise
+
+    @acceptsContext
+    def getResultsChunks(self, chunkSize=50000, columns=None, geometry=True):
+        """Streams the summarized results, joined to their geometry on the server, in chunks
+
+        Keyword Arguments:
+            chunkSize: int -- the number of rows per chunk (default: 50000)
+            columns: list -- optional result columns to return; the geography key is always returned (default: all columns)
+            geometry: boolean -- if True, each row carries its block or tract geometry (default: True)
+
+        Returns:
+            chunks: generator -- StudyRegionDataFrames of at most chunkSize rows
+
+        Notes:
+            Unlike getResults, columns that are empty for every row are kept, since a chunk
+            cannot know about the rows after it.
+        """
+        # the query is composed now, so the chunks follow the current hazard, scenario and return period
+        sql = self.getResultsSQL(columns, geometry=geometry)
+        return self.queryChunks(sql, chunkSize)
+
+    @acceptsContext
+    def exportResults(self, path, chunkSize=50000, columns=None):
+        """Writes the summarized results chunk by chunk, so memory stays bounded on statewide regions
+
+        Keyword Arguments:
+            path: str -- the output path; .csv writes attributes only, .gpkg includes geometry
+            chunkSize: int -- the number of rows held in memory at a time (default: 50000)
+            columns: list -- optional result columns to return; the geography key is always returned (default: all columns)
+
+        Returns:
+            rows: int -- the number of rows written
+        """
+        try:
+            geometry = Path(path).suffix.lower() != '.csv'
+            chunks = self.getResultsChunks(chunkSize=chunkSize, columns=columns, geometry=geometry)
+            rows = writeChunks(chunks, path)
+            print(f'Wrote {rows} results rows to {path}')
+            return rows
+        except:
+            print("Unexpected error exportResults:", sys.exc_info()[0])
+            raise
+
+    def getResultsClientSide(self):
+        """Queries each result type and outer merges them in pandas
+
+        Returns:
+            df: pandas dataframe -- the merged results where EconLoss is not null
+        """
         try:
             economicLoss = self.getEconomicLoss()
             buildingDamage = self.getBuildingDamage()
@@ -1616,16 +2061,12 @@ class StudyRegion:
                 )
 
             df = dfMerged[dfMerged["EconLoss"].notnull()]
-            # Find the columns where each value is null
-            empty_cols = [col for col in df.columns if df[col].isnull().all()]
-            # Drop these columns from the dataframe
-            df.drop(empty_cols, axis=1, inplace=True)
-
-            return StudyRegionDataFrame(self, df)
+            return df
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
     def getCounties(self):
         """Creates a dataframe of the county name and geometry for all counties in the study region
 
@@ -1633,26 +2074,15 @@ class StudyRegion:
             gdf: geopandas geodataframe -- a geodataframe of the counties
         """
         try:
-            sql = """SELECT 
-                        CountyFips as "countyfips",
-                        CountyName as "name",
-                        State  as "state",
-                        NumAggrTracts as "size",
-                        Shape.STAsText() as "geometry",
-                        Shape.STSrid as "crs"
-                        FROM [{s}].[dbo].[hzCounty]
-                """.format(
-                s=self.name
-            )
-
-            df = self.query(sql)
-            df["geometry"] = df["geometry"].apply(loads)
-            gdf = gpd.GeoDataFrame(df, geometry="geometry")
+            gdf = self.geometryCache.getGeometry(self.query, self.name, "county", self.geometryTransport)
+            gdf = gdf.rename(columns={"stateid": "state"})
+            gdf = gdf[["countyfips", "name", "state", "size", "geometry", "crs"]]
             return gdf
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
     def getStates(self):
         """Creates a dataframe of the state name and geometry for all states in the study region
 
@@ -1660,22 +2090,14 @@ class StudyRegion:
             gdf: geopandas geodataframe -- a geodataframe of the states
         """
         try:
-            sql = """SELECT 
-                        Shape.STAsText() as "geometry",
-                        Shape.STSrid as "crs"
-                        FROM [{s}].[dbo].[hzState]
-                """.format(
-                s=self.name
-            )
-
-            df = self.query(sql)
-            df["geometry"] = df["geometry"].apply(loads)
-            gdf = gpd.GeoDataFrame(df, geometry="geometry")
+            gdf = self.geometryCache.getGeometry(self.query, self.name, "state", self.geometryTransport)
+            gdf = gdf[["geometry", "crs"]]
             return gdf
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
     def getTravelTimeToSafety(self):
         """Creates a geodataframe of the travel time to safety
 
@@ -1687,18 +2109,18 @@ class StudyRegion:
 
                 sql = """SELECT
                     tiger.CensusBlock,
-                    tiger.Tract, tiger.Shape.STAsText() AS geometry,
+                    tiger.Tract, {g},
                     ISNULL(travel.Trav_SafeUnder65, 0) as travelTimeUnder65yo,
                     ISNULL(travel.Trav_SafeOver65, 0) as travelTimeOver65yo
                         FROM {s}.dbo.[hzCensusBlock_TIGER] as tiger
                             FULL JOIN {s}.dbo.tsTravelTime as travel
                                 ON tiger.CensusBlock = travel.CensusBlock
                     WHERE travel.Trav_SafeOver65 > 0""".format(
-                    s=self.name
+                    s=self.name, g=geometrySelect('tiger.Shape', transport=self.geometryTransport)
                 )
 
                 df = self.query(sql)
-                df["geometry"] = df["geometry"].apply(loads)
+                df["geometry"] = decodeGeometry(df["geometry"])
                 gdf = gpd.GeoDataFrame(df, geometry="geometry")
                 return gdf
             except:
@@ -1708,11 +2130,17 @@ class StudyRegion:
             print("This method is only available for tsunami study regions")
 
 # TODO: Pass Return Period to report & fix title of report
-    def setReport(self):
+    def setReport(self, context=None):
         """Requires that Hazard, name are set
+
+        Keyword Arguments:
+            context: ScenarioContext -- optional selection the report is bound to instead of the current attributes (default: None)
         """
         try:
-            self.report = Report(self, self.name, "", self.hazard)
+            if context is None:
+                self.report = Report(self, self.name, "", self.hazard)
+            else:
+                self.report = Report(self, context.name, "", context.hazard, context=context)
         except Exception as e:
             print('\n')
             print(e)
@@ -1862,18 +2290,113 @@ class StudyRegion:
             return hazardsList
 
     #RESTORE .HPR TO HAZUS SQL SERVER
-    def unzipHPR(self, hprPath, tempDir):
+    # members the export path reads from an unzipped hpr, besides the .bk named in the zip comment
+    hprExtractFileNames = ['flanalysislog.txt', 'tsunamilog.txt', 'caseoutput.mdb']
+    hprExtractDirectories = ['depth', 'maxdg_ft', 'info']
+    hprExtractShapes = ['pga']
+
+    def getHPRMembers(self, zipFile, hprComment=None):
+        """Plans the members of an hpr that the export path needs.
+
+            Keyword Arguments:
+                zipFile: zipfile.ZipFile -- the opened hpr file
+                hprComment: list -- a python list of HPR attributes (default: the comment of zipFile)
+
+            Returns:
+                members: list -- the zipfile.ZipInfo members to extract, or None if the .bk named
+                    in the hpr comment is not in the hpr
+
+            Notes:
+                Keeps the .bk file, the flood depth grids (<scenario>/<Riverine|Coastal>/Depth/*),
+                the tsunami maxdg_ft grid, the grid info folders, flAnalysisLog.txt, TsunamiLog.txt,
+                CaseOutput.mdb and the earthquake shape/pga.* files.
+        """
+        if hprComment is None:
+            hprComment = zipFile.comment.decode('UTF-8').split('|')
+        try:
+            bkFileName = self.getHPRBKFileName(hprComment).lower()
+        except IndexError:
+            return None
+        members = []
+        hasBK = False
+        for info in zipFile.infolist():
+            if info.is_dir():
+                continue
+            parts = [part.lower() for part in info.filename.replace('\\', '/').split('/')]
+            fileName = parts[-1]
+            directories = parts[:-1]
+            if fileName == bkFileName and len(directories) == 0:
+                hasBK = True
+                members.append(info)
+            elif fileName in self.hprExtractFileNames:
+                members.append(info)
+            elif any(directory in self.hprExtractDirectories for directory in directories):
+                members.append(info)
+            elif 'shape' in directories and fileName.split('.')[0] in self.hprExtractShapes:
+                members.append(info)
+        if not hasBK:
+            return None
+        return members
+
+    def checkDiskSpace(self, path, requiredBytes):
+        """Raises an OSError if the drive holding path has less free space than requiredBytes.
+
+            Keyword Arguments:
+                path: str -- the directory that will be written to
+                requiredBytes: int -- the number of bytes that will be written
+        """
+        checkPath = Path(path)
+        while not checkPath.exists() and checkPath != checkPath.parent:
+            checkPath = checkPath.parent
+        freeBytes = shutil.disk_usage(checkPath).free
+        if freeBytes < requiredBytes:
+            raise OSError(f'Not enough disk space to unzip to {path}: {requiredBytes / 1024**3:.2f} GB needed, {freeBytes / 1024**3:.2f} GB free')
+
+    def unzipHPR(self, hprPath, tempDir, selective=True, maxWorkers=4):
         """Unzip HPR to temp folder.
 
             Keyword Arguments:
                 hprPath: str -- the path to the HPR file
                 tempDir: str -- the output path to unzip the HPR file to
+                selective: bool -- if True, only the members the export needs are extracted (default: True)
+                maxWorkers: int -- the number of threads that decompress members (default: 4)
 
+            Notes:
+                Each thread opens its own handle on the hpr, as a ZipFile can not be read from
+                several threads at once. Falls back to extracting every member when the .bk named
+                in the hpr comment can not be found.
         """
         print(f'Unzipping {hprPath} to {tempDir}...')
         try:
             with zipfile.ZipFile(hprPath, 'r') as zip_ref:
-                zip_ref.extractall(tempDir)
+                members = self.getHPRMembers(zip_ref) if selective else None
+                if members is None:
+                    if selective:
+                        print('Unable to plan hpr members, extracting all')
+                    members = [info for info in zip_ref.infolist() if not info.is_dir()]
+                skipped = len(zip_ref.infolist()) - len(members)
+            self.checkDiskSpace(tempDir, sum(info.file_size for info in members))
+
+            # largest first so the big .bk and grids start decompressing right away
+            members = sorted(members, key=lambda info: info.file_size, reverse=True)
+            handles = threading.local()
+            openHandles = []
+            handlesLock = threading.Lock()
+
+            def extractMember(info):
+                if not hasattr(handles, 'zipFile'):
+                    handles.zipFile = zipfile.ZipFile(hprPath, 'r')
+                    with handlesLock:
+                        openHandles.append(handles.zipFile)
+                handles.zipFile.extract(info, tempDir)
+
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(members)))) as executor:
+                    list(executor.map(extractMember, members))
+            finally:
+                for handle in openHandles:
+                    handle.close()
+            print(f'{len(members)} members extracted, {skipped} skipped')
         except Exception as e:
             print('Exception unzipHPR:')
             print(e)
@@ -1893,7 +2416,8 @@ class StudyRegion:
             bkFilePath = Path.joinpath(Path(fileDir), bkFileName)
             if bkFilePath.exists():
                 self.bkFilePath = bkFilePath
-                self.dbName = bkFilePath.stem
+                self.regionName = bkFilePath.stem
+                self.dbName = bkFilePath.stem + self.dbSuffix
                 self.name = 'bk_' + self.dbName
             else:
                 print(f'no bkfile in {fileDir}')
@@ -1917,14 +2441,16 @@ class StudyRegion:
             print()
             bkFilePath = Path.joinpath(fileDir, str(bkList[0]))
             self.bkFilePath = bkFilePath
-            self.dbName = bkFilePath.stem
+            self.regionName = bkFilePath.stem
+            self.dbName = bkFilePath.stem + self.dbSuffix
             self.name = 'bk_' + self.dbName
         elif len(bkList) == 1:
             print()
             bkFilePath = Path.joinpath(fileDir, str(bkList[0]))
             print(f'\nThe bk file path is:\n {bkFilePath}\n')
             self.bkFilePath = bkFilePath
-            self.dbName = bkFilePath.stem
+            self.regionName = bkFilePath.stem
+            self.dbName = bkFilePath.stem + self.dbSuffix
             self.name = 'bk_' + self.dbName
         else:
             print(f'no bkfile in {fileDir}')
@@ -2011,30 +2537,12 @@ class StudyRegion:
             Key Argument:
                 orm: string - - type of connection to return (choices: 'pyodbc', 'sqlalchemy')
             Returns:
-                conn: pyodbc connection
+                conn: pyodbc connection -- a dedicated connection outside the pool (use query for pooled reads)
         """
         try:
-            # list all Windows SQL Server drivers
-            drivers = [
-                '{ODBC Driver 17 for SQL Server}',
-                '{ODBC Driver 13.1 for SQL Server}',    
-                '{ODBC Driver 13 for SQL Server}',
-                '{ODBC Driver 11 for SQL Server} ',
-                '{SQL Server Native Client 11.0}',
-                '{SQL Server Native Client 10.0}',
-                '{SQL Native Client}',
-                '{SQL Server}'
-            ]
-            computer_name = os.environ['COMPUTERNAME']
+            # the pool resolves the working driver once per process
             if orm == 'pyodbc':
-                # create connection with the latest driver
-                for driver in drivers:
-                    try:
-                        conn = py.connect(self.getConnectionString('pyodbc').format(d=driver, cn=computer_name))
-                        break
-                    except:
-                        conn = py.connect(self.getConnectionString('pyodbc_auth').format(d=driver, cn=computer_name))
-                        break
+                conn = self.pool.createConnection()
             return conn
         except:
             print("Unexpected error:", sys.exc_info()[0])
@@ -2063,14 +2571,79 @@ class StudyRegion:
         print('...done')
         print()
 
-    def restoreHPR(self):
+    def getHPRFingerprint(self):
+        """Identifies the content of the .bk file in the hpr without reading it.
+
+            Returns:
+                fingerprint: str -- the .bk name, size and CRC-32 from the hpr central directory and the hpr comment
+
+            Notes:
+                The CRC-32 is computed over the uncompressed .bk when the hpr is written, so a
+                rebuilt hpr with different data gets a different fingerprint.
+        """
+        try:
+            bkFileName = self.getHPRBKFileName(self.hprComment)
+            with zipfile.ZipFile(self.hprFilePath, 'r') as z:
+                info = z.getinfo(bkFileName)
+                comment = z.comment.decode('UTF-8')
+            return f'{comment}|{info.file_size}|{info.CRC:08x}'
+        except:
+            print("Unexpected error getHPRFingerprint:", sys.exc_info()[0])
+            raise
+
+    def reuseRestoredHPR(self, registry):
+        """Points the Hazus Package Region at a database already restored from the same .bk.
+
+            Keyword Arguments:
+                registry: RestoreRegistry -- the registry of restored hpr files
+
+            Returns:
+                reused: bool -- True if the restored database and unzipped folder were found
+        """
+        try:
+            fingerprint = self.getHPRFingerprint()
+            entry = registry.lookup(fingerprint)
+            if entry is None:
+                return False
+            if not Path(entry['tempDir']).exists() or not databaseExists(entry['name']):
+                print(f"Restored database {entry['name']} is gone, restoring again")
+                registry.remove(fingerprint)
+                return False
+            self.name = entry['name']
+            self.dbName = entry['dbName']
+            self.regionName = entry['regionName']
+            self.tempDir = Path(entry['tempDir'])
+            self.bkFilePath = Path(entry['bkFilePath'])
+            self.LogicalNames = tuple(entry['logicalNames'])
+            self.LogicalName_data = self.LogicalNames[0]
+            self.LogicalName_log = self.LogicalNames[1]
+            self.conn = self.createConnection()
+            self.conn.autocommit = True
+            self.cursor = self.conn.cursor()
+            print(f'Reusing restored database {self.name} from {self.tempDir}')
+            print()
+            return True
+        except Exception as e:
+            print('Unexpected error reuseRestoredHPR:')
+            print(e)
+            return False
+
+    def restoreHPR(self, unzip=True, registry=None):
         """Use several base functions together to effectively attach an hpr file to sql server for access by export functions.
 
+        Keyword Arguments:
+            unzip: bool -- if False, the hpr is expected to be unzipped to tempDir already (default: True)
+            registry: RestoreRegistry -- if given, a database restored from the same .bk is reused
+                and a new restore is recorded (default: None)
+
         Notes:
 
         """
+        if registry is not None and self.reuseRestoredHPR(registry):
+            return
         #UnzipHPR...
-        self.unzipHPR(self.hprFilePath, self.tempDir)
+        if unzip:
+            self.unzipHPR(self.hprFilePath, self.tempDir)
         #Find .bk files in unzipped folder...
         self.getBKFilePathFromHPRComment(self.tempDir, self.hprComment)
         #Connect to SQL Server Hazus...
@@ -2083,12 +2656,17 @@ class StudyRegion:
         self.LogicalName_log = self.LogicalNames[1]
         #Restore the database using the FileListHeaders info...
         self.restoreSQLServerBKFile(self.dbName, self.tempDir, self.bkFilePath, self.LogicalName_data, self.LogicalName_log, self.cursor)
+        if registry is not None:
+            registry.register(self.getHPRFingerprint(), self.name, self.dbName, self.regionName, self.tempDir,
+                              self.bkFilePath, self.LogicalNames, self.hprFilePath)
 
     #CLEANUP
     def dropDB(self):
         """Using HazusPackageRegion attributes, drop the bk_* database that was restored from the bkfile in the hpr.
         """
         print(f'Dropping {self.name}...')
+        self.clearCatalogCache()
+        self.geometryCache.invalidate(self.name)
         try:
             sqlServerDatabaseVersionRaw = self.conn.getinfo(py.SQL_DBMS_VER) #obtain the database version, ie '12.00.4100'
             sqlServerDatabaseVersion = int(sqlServerDatabaseVersionRaw.split('.')[0])
@@ -2114,6 +2692,7 @@ class StudyRegion:
         except OSError as e:
             print ("Error: %s - %s." % (e.filename, e.strerror))
 
+    @acceptsContext
     def getAnalysisType(self):
         """Historical, Deterministic, Probabalistic. Deterministic includes historical and everything that is not probabilistic
 
@@ -2158,6 +2737,7 @@ class StudyRegion:
             print('Exception getAnalysisType:')
             print(e)
 
+    @acceptsContext
     def getEarthquakeShakemapUrl(self):
         """Get the ShakemapId
 
@@ -2175,6 +2755,7 @@ class StudyRegion:
             print(e)
             return None
 
+    @acceptsContext
     def getEarthquakeMagnitude(self):
         """Get the Earthquake magnitude
 
@@ -2190,6 +2771,7 @@ class StudyRegion:
             print("Unexpected error getEarthquakeMagnitude:", sys.exc_info()[0])
             print(e)
 
+    @acceptsContext
     def getEQShakeMapScenario(self):
         """Get the eqShakeMapScenario table as a dataframe to export
 
@@ -2216,6 +2798,7 @@ class StudyRegion:
             print('Unexpected error getEQShakeMapScenario:')
             print(e)
 
+    @acceptsContext
     def getFloodHazardType(self):
         """Determine the Flood Hazard Type; Riverine or Coastal.
 
@@ -2288,6 +2871,7 @@ class StudyRegion:
         print('...Done')
         print()
 
+    @acceptsContext
     def getFloodBoundaryPolyName(self, hazardType='R'):
         """Obtains the name of the HazardPoly in an unzipped HPR's scenario folder.
 
@@ -2350,48 +2934,31 @@ class StudyRegion:
     def exportFloodHazardPolyToShapefileToZipFile(self, outputShapefile):
         """
         Inputs:
-            outputShapefile: str -- name of the output shapefile and path.
+            outputShapefile: str -- name of the output shapefile and path; the zipfile is written next to it
 
         Notes:
             I.E. \nora_temp\nora_01\Riverine\CaseOutput.mdb or \nora_temp\nora_01\Coastal\CaseOutput.mdb ?
             I.E. BoundaryPolyRP101 but look for BoundaryPoly* as there should be one but the suffix may be different
+            ogr2ogr writes the shapefile to a private temporary directory that is streamed into the zipfile and removed.
         """
-
-
-        shapefileSuffixList = ['.shp', '.shx', '.dbf', '.prj', '.sbn',
-                               '.sbx', '.fbn', '.fbx', '.ain', '.aih',
-                               '.ixs', '.mxs', '.atx', '.shp.xml',
-                               '.cpg', '.qix']
+        pathObject = Path(outputShapefile)
+        pathZip = Path.joinpath(pathObject.parent, pathObject.stem + '.zip')
         try:
-            mdbPath = self.floodMdbPath #r'C:\workspace\nora_temp\nora_01\Riverine\CaseOutput.mdb'
-            boundaryPoly = self.floodBoundaryPolygonName
-            command = f'ogr2ogr -f "ESRI Shapefile" "{outputShapefile}" "{mdbPath}" {boundaryPoly}'
-            subprocess.check_call(command)
-        except Exception as e:
-            print("Unexpected error exportFloodHazardPolyToShapefileToZipFile 1:")
-            print(e)
-        try:
-            #Get filename from path (i.e. results.shp) and create a zipfile of the same name...
-            pathObject = Path(outputShapefile)
-            pathZip = Path.joinpath(pathObject.parent, pathObject.stem + '.zip')
-            #For each shapefile suffix, see if it exists for filename from path and if so, append it to the zipfile...
-            with zipfile.ZipFile(pathZip, 'a') as myzip:
-                for suffix in shapefileSuffixList:
-                    shapefileFile = Path.joinpath(pathObject.parent, pathObject.stem + suffix)
-                    if shapefileFile.exists():
-                        myzip.write(shapefileFile, shapefileFile.name)
+            with privateDirectory(pathZip) as directory:
+                try:
+                    mdbPath = self.floodMdbPath #r'C:\workspace\nora_temp\nora_01\Riverine\CaseOutput.mdb'
+                    boundaryPoly = self.floodBoundaryPolygonName
+                    command = f'ogr2ogr -f "ESRI Shapefile" "{Path.joinpath(directory, pathObject.name)}" "{mdbPath}" {boundaryPoly}'
+                    subprocess.check_call(command)
+                except Exception as e:
+                    print("Unexpected error exportFloodHazardPolyToShapefileToZipFile 1:")
+                    print(e)
+                zipShapefiles(pathZip, directory)
         except:
             print("Unexpected error exportFloodHazardPolyToShapefileToZipFile 2:", sys.exc_info()[0])
             raise
-        try:
-            #Delete the shapefile...
-            driver = ogr.GetDriverByName("ESRI Shapefile")
-            if pathObject.exists():
-                 driver.DeleteDataSource(str(outputShapefile))
-        except:
-            print("Unexpected error exportFloodHazardPolyToShapefileToZipFile 3:", sys.exc_info()[0])
-            raise
 
+    @acceptsContext
     def getFIMSelected_Rtn_Period(self):
         """Queries the HPR database for the unzipped hpr path to scenario/returnperiod depth grid
 
@@ -2420,6 +2987,7 @@ class StudyRegion:
             print(e)
             raise 
 
+    @acceptsContext
     def getStudyRegionBoundary(self):
         """Get the study region area as a polygon.
             Returns:
@@ -2428,7 +2996,7 @@ class StudyRegion:
         print('getHzBoundary')
         try:
 
-            sql = f"SELECT [OBJECTID],[Shape].STAsText() AS geometry FROM [{self.name}].[dbo].[hzboundary]"
+            sql = f"SELECT [OBJECTID],{geometrySelect('[Shape]', transport=self.geometryTransport)} FROM [{self.name}].[dbo].[hzboundary]"
 
             df = self.query(sql)
             return StudyRegionDataFrame(self, df)
@@ -2436,6 +3004,7 @@ class StudyRegion:
             print("Unexpected error getStudyRegionBoundary:", sys.exc_info()[0])
             raise
 
+    @acceptsContext
     def getHurricaneTrack(self):
         """Get the Hurricane track as a line.
             Returns:
@@ -1,13 +1,174 @@
+import fiona
 import pandas as pd
 import geopandas as gpd
+import os
+import shutil
 import sys
-from shapely.wkt import loads
+import tempfile
+from contextlib import contextmanager
 from shapely.geometry.multipolygon import MultiPolygon
 from shapely.geometry.polygon import Polygon
 import zipfile
 from pathlib import Path
-from osgeo import ogr
-from fnmatch import fnmatch
+from geopandas.io.file import infer_schema
+
+try:
+    from .geometry import decodeGeometry
+    from .geometrycache import getGeometryCache
+except:
+    from geometry import decodeGeometry
+    from geometrycache import getGeometryCache
+
+# suffixes for the layers or files a frame of mixed geometry types is split into
+geometryTypeSuffixes = {
+    'Point': '_points', 'MultiPoint': '_points',
+    'LineString': '_lines', 'MultiLineString': '_lines',
+    'Polygon': '_polygons', 'MultiPolygon': '_polygons',
+}
+
+
+def splitGeometryTypes(gdf):
+    """Splits a geodataframe into one frame per geometry type, as single layer formats need
+
+        Keyword Arguments:
+            gdf: geopandas geodataframe
+
+        Returns:
+            frames: dict -- layer name suffix keys ('' if the frame holds one geometry type) with geodataframes
+    """
+    suffixes = gdf.geometry.geom_type.map(geometryTypeSuffixes).fillna('')
+    if suffixes.nunique() <= 1:
+        return {'': gdf}
+    return {suffix: gdf[suffixes == suffix] for suffix in suffixes.unique()}
+
+
+# Shapefiles are made up of at least three files with the same name but different
+# file type, i.e. results.dbf, results.shp, results.shx
+shapefileSuffixList = ['.shp', '.shx', '.dbf', '.prj', '.sbn',
+                       '.sbx', '.fbn', '.fbx', '.ain', '.aih',
+                       '.ixs', '.mxs', '.atx', '.shp.xml',
+                       '.cpg', '.qix']
+
+
+def zipShapefiles(pathZip, directory, compression=zipfile.ZIP_DEFLATED, compresslevel=6):
+    """Streams the shapefile components in a directory into a new compressed zipfile
+
+        Keyword Arguments:
+            pathZip: str -- the zipfile to write; an existing zipfile is replaced
+            directory: str -- a directory holding only the shapefiles to zip
+            compression: int -- the zipfile compression, i.e. zipfile.ZIP_LZMA (default: zipfile.ZIP_DEFLATED)
+            compresslevel: int -- the deflate level from 1 (fastest) to 9 (smallest) (default: 6)
+
+        Notes: Each component is read once in chunks while it is compressed. The zipfile is written
+            next to pathZip and renamed into place, so readers never see a partial archive.
+    """
+    try:
+        pathZip = Path(pathZip)
+        tempZip = pathZip.with_name(pathZip.name + '.tmp')
+        files = sorted(file for file in Path(directory).iterdir()
+                       if any(file.name.endswith(suffix) for suffix in shapefileSuffixList))
+        with zipfile.ZipFile(tempZip, 'w', compression=compression, compresslevel=compresslevel) as myzip:
+            for file in files:
+                myzip.write(file, file.name)
+        os.replace(tempZip, pathZip)
+    except:
+        print("Unexpected error zipShapefiles:", sys.exc_info()[0])
+        raise
+
+
+@contextmanager
+def privateDirectory(path):
+    """Creates a temporary directory next to path that is removed on exit
+
+        Keyword Arguments:
+            path: str -- an output file; the directory is created in its folder
+
+        Notes: Exports that share an output folder each write their intermediate files
+            to their own directory, so they never zip or delete each other's files.
+    """
+    directory = tempfile.mkdtemp(prefix='.' + Path(path).stem + '-', dir=Path(path).parent)
+    try:
+        yield Path(directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def writeGeoPackage(path, layers, spatialIndex=True):
+    """Writes several StudyRegionDataFrames into one GeoPackage, replacing it atomically
+
+        Keyword Arguments:
+            path: str -- the output path (example: 'C:/directory/results.gpkg')
+            layers: dict -- layer name keys with StudyRegionDataFrames; None values are skipped
+            spatialIndex: bool -- if True, an R-tree index is built for each layer (default: True)
+    """
+    try:
+        tempPath = str(path) + '.tmp.gpkg'
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        for layer, sdf in layers.items():
+            if sdf is not None and len(sdf) > 0:
+                sdf.toGeoPackage(tempPath, layer=layer, spatialIndex=spatialIndex)
+        if os.path.exists(tempPath):
+            os.replace(tempPath, path)
+    except:
+        print("Unexpected error writeGeoPackage:", sys.exc_info()[0])
+        raise
+
+
+def writeChunks(chunks, path, layer=None, crs='epsg:4326'):
+    """Appends frames to a CSV or GeoPackage as they arrive, so only one chunk is in memory
+
+        Keyword Arguments:
+            chunks: iterable -- dataframes with the same columns, i.e. StudyRegion.getResultsChunks;
+                GeoPackage chunks need a geometry column
+            path: str -- the output path; the format follows the suffix (.csv or .gpkg)
+            layer: str -- the GeoPackage layer name (default: the file name)
+            crs: str -- the crs of geometry without one (default: 'epsg:4326')
+
+        Returns:
+            rows: int -- the number of rows written
+
+        Notes: The layer schema is inferred from the first chunk. The file is written next to path
+            and renamed into place once every chunk is written.
+    """
+    drivers = {'.csv': None, '.gpkg': 'GPKG'}
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix not in drivers:
+        raise ValueError(f"Unable to stream '{suffix}' files (choices: {', '.join(drivers)})")
+    tempPath = path.with_name(path.stem + '.tmp' + path.suffix)
+    rows = 0
+    collection = None
+    try:
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            if drivers[suffix] is None:
+                chunk.to_csv(tempPath, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+            else:
+                gdf = gpd.GeoDataFrame(pd.DataFrame(chunk), geometry=decodeGeometry(chunk['geometry']))
+                if gdf.crs is None:
+                    gdf.crs = crs
+                # later chunks may hold multipolygons, so every polygon is written as one
+                gdf['geometry'] = [MultiPolygon([x]) if type(x) == Polygon else x for x in gdf['geometry']]
+                if collection is None:
+                    collection = fiona.open(str(tempPath), 'w', driver=drivers[suffix], schema=infer_schema(gdf),
+                                            crs_wkt=gdf.crs.to_wkt(), layer=layer or path.stem)
+                collection.writerecords(gdf.iterfeatures())
+            rows += len(chunk)
+        if collection is not None:
+            collection.close()
+            collection = None
+        if rows > 0:
+            os.replace(tempPath, path)
+        return rows
+    except:
+        print("Unexpected error writeChunks:", sys.exc_info()[0])
+        raise
+    finally:
+        if collection is not None:
+            collection.close()
+
 
 class StudyRegionDataFrame(pd.DataFrame):
     """ -- StudyRegion helper class --
@@ -20,27 +181,45 @@ class StudyRegionDataFrame(pd.DataFrame):
 
     """
 
+    # kept out of pandas' column and metadata handling; frames derived from this one start without a view
+    _internal_names = pd.DataFrame._internal_names + ['_geoDataFrames', '_geoDataFramesShape']
+    _internal_names_set = set(_internal_names)
+
     def __init__(self, studyRegionClass, df):
         super().__init__(df)
+        self.clearGeoDataFrame()
         try:
             self.studyRegion = studyRegionClass.name
         except:
             self.studyRegion = studyRegionClass.studyRegion
-        self.conn = studyRegionClass.conn
+        self.conn = getattr(studyRegionClass, 'conn', None)
+        self.pool = getattr(studyRegionClass, 'pool', None)
+        self.geometryTransport = getattr(studyRegionClass, 'geometryTransport', 'wkt')
+        self.geometryCache = getattr(studyRegionClass, 'geometryCache', None) or getGeometryCache()
         self.query = studyRegionClass.query
 
+    def getCensusGeometry(self, level):
+        """ Reads the census geometry of the tracts or blocks in this frame
+
+            Keyword Arguments: \n
+                level: str -- the geography column (choices: 'tract', 'block')
+
+            Returns:
+                gdf: geopandas geodataframe -- only the rows whose id is in this frame
+        """
+        if self.pool is None:
+            return self.geometryCache.getGeometry(self.query, self.studyRegion, level, self.geometryTransport)
+        return self.geometryCache.getGeometryForKeys(self.pool, self.query, self.studyRegion, level, self[level], self.geometryTransport)
+
     def addCensusTracts(self):
-        """ Queries the census tract geometry for a study region in local Hazus SQL Server database
+        """ Adds the census tract geometry of the tracts in the frame
 
             Returns:
                 df: pandas dataframe -- a dataframe of the census geometry and fips codes
         """
         try:
-
-            sql = """SELECT Tract as tract, Shape.STAsText() AS geometry, shape.STSrid as crs FROM {s}.dbo.hzTract""".format(
-                s=self.studyRegion)
-
-            df = self.query(sql)
+            df = self.getCensusGeometry('tract')
+            df = pd.DataFrame(df[['tract', 'geometry', 'crs']])
             newDf = pd.merge(df, self, on="tract")
             return StudyRegionDataFrame(self, newDf)
         except:
@@ -48,16 +227,14 @@ class StudyRegionDataFrame(pd.DataFrame):
             raise
 
     def addCensusBlocks(self):
-        """ Queries the census block geometry for a study region in local Hazus SQL Server database
+        """ Adds the census block geometry of the blocks in the frame
 
             Returns:
                 df: pandas dataframe -- a dataframe of the census geometry and fips codes
         """
         try:
-            sql = """SELECT CensusBlock as block, Shape.STAsText() AS geometry FROM {s}.dbo.hzCensusBlock_TIGER""".format(
-                s=self.studyRegion)
-
-            df = self.query(sql)
+            df = self.getCensusGeometry('block')
+            df = pd.DataFrame(df[['block', 'geometry']])
             newDf = pd.merge(df, self, on="block")
             return StudyRegionDataFrame(self, newDf)
         except:
@@ -81,12 +258,11 @@ class StudyRegionDataFrame(pd.DataFrame):
                 update_df = self.query(sql)
                 temp_df = pd.merge(update_df, temp_df, on="tract")
 
-            sql = """select state, county, countyfips, geometry from 
-                    (SELECT State as stateid, CountyFips as countyfips, CountyName as county, Shape.STAsText() AS geometry FROM {s}.dbo.hzCounty) c
-                    inner join (select StateID as stateid, StateName as state FROM [syHazus].[dbo].[syState]) s
-                    on c.stateid = s.stateid""".format(s=self.studyRegion) 
-
-            update_df = self.query(sql)
+            counties = self.geometryCache.getGeometry(self.query, self.studyRegion, 'county', self.geometryTransport)
+            counties = pd.DataFrame(counties[['stateid', 'name', 'countyfips', 'geometry']]).rename(columns={'name': 'county'})
+            sql = """select StateID as stateid, StateName as state FROM [syHazus].[dbo].[syState]"""
+            states = self.query(sql)
+            update_df = pd.merge(counties, pd.DataFrame(states), on="stateid")[['state', 'county', 'countyfips', 'geometry']]
             temp_df = pd.merge(update_df, temp_df, on="countyfips")
             return StudyRegionDataFrame(self, temp_df)
         except:
@@ -118,6 +294,92 @@ class StudyRegionDataFrame(pd.DataFrame):
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
+    def getGeoDataFrame(self, crs='epsg:4326', sourceCrs='epsg:4326'):
+        """ Returns a GeoDataFrame view of a StudyRegionDataFrame, shared by every writer
+
+            Keyword Arguments: \n
+                crs: str -- the crs of the output (default: 'epsg:4326')
+                sourceCrs: str -- the crs assumed for geometry that has none (default: 'epsg:4326')
+
+            Returns:
+                gdf: geopandas geodataframe -- treat as read only; copy it before changing it
+
+            Notes: Census geometry is added and decoded the first time a view is requested, and the
+                view is kept for later calls, so writing several formats fetches and parses geometry
+                once. The projection is skipped when the geometry is already in crs. Assigning or
+                deleting columns, inplace methods and a new index or column set drop the view; call
+                clearGeoDataFrame after changing values in place through loc or iloc.
+        """
+        try:
+            if not self.hasGeoDataFrameShape():
+                self.clearGeoDataFrame()
+                self._geoDataFramesShape = (tuple(self.columns), self.index)
+            key = (str(crs), str(sourceCrs))
+            if key in self._geoDataFrames:
+                return self._geoDataFrames[key]
+            sourceKey = (None, str(sourceCrs))
+            gdf = self._geoDataFrames.get(sourceKey)
+            if gdf is None:
+                sdf = self
+                if 'geometry' not in sdf.columns:
+                    sdf = sdf.addGeometry()
+                gdf = gpd.GeoDataFrame(pd.DataFrame(sdf), geometry=decodeGeometry(sdf['geometry']))
+                if gdf.crs is None:
+                    gdf.crs = sourceCrs
+                self._geoDataFrames[sourceKey] = gdf
+            if crs is not None and not gdf.crs == crs:
+                gdf = gdf.to_crs(crs)
+            self._geoDataFrames[key] = gdf
+            return gdf
+        except:
+            print("Unexpected error getGeoDataFrame:", sys.exc_info()[0])
+            raise
+
+    def hasGeoDataFrameShape(self):
+        """ Checks that the columns and index are the ones the GeoDataFrame views were built from """
+        if self._geoDataFramesShape is None:
+            return False
+        columns, index = self._geoDataFramesShape
+        return index is self.index and columns == tuple(self.columns)
+
+    def clearGeoDataFrame(self):
+        """ Drops the GeoDataFrame views built by getGeoDataFrame """
+        self._geoDataFrames = {}
+        self._geoDataFramesShape = None
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.clearGeoDataFrame()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.clearGeoDataFrame()
+
+    def _update_inplace(self, result, *args, **kwargs):
+        # pandas routes every inplace=True method through here
+        super()._update_inplace(result, *args, **kwargs)
+        self.clearGeoDataFrame()
+
+    def toGeoPackage(self, path, layer=None, spatialIndex=True):
+        """ Exports a StudyRegionDataFrame to a layer of a GeoPackage
+
+            Keyword Arguments: \n
+                path: str -- the output directory path, file name, and extention (example: 'C:/directory/results.gpkg')
+                layer: str -- the layer name; other layers in the GeoPackage are kept (default: the file name)
+                spatialIndex: bool -- if True, an R-tree index is built for the layer (default: True)
+
+            Notes: GeoPackage keeps full field names and has no 2 GB limit. Mixed geometry types,
+                i.e. damaged facilities, are written to one layer per type (layer_points, layer_lines).
+        """
+        try:
+            gdf = self.getGeoDataFrame()
+            layer = layer or Path(path).stem
+            for suffix, frame in splitGeometryTypes(gdf).items():
+                frame.to_file(str(path), driver='GPKG', layer=layer + suffix, SPATIAL_INDEX='YES' if spatialIndex else 'NO')
+        except:
+            print("Unexpected error toGeoPackage:", sys.exc_info()[0])
+            raise
+
     def toCSV(self, path):
         """ Exports a StudyRegionDataFrame to a CSV
 
@@ -133,13 +395,9 @@ class StudyRegionDataFrame(pd.DataFrame):
                 path: str -- the output directory path, file name, and extention (example: 'C:/directory/filename.shp')
         """
         try:
-            if 'geometry' not in self.columns:
-                self = self.addGeometry()
-            self['geometry'] = self['geometry'].apply(lambda x: loads(str(x)))
-            crs = {'init' :'epsg:4326'}
-            gdf = gpd.GeoDataFrame(self, geometry='geometry', crs=crs)
+            gdf = self.getGeoDataFrame()
             if "PARAMVALUE" in gdf.columns:
-                gdf.drop(columns="PARAMVALUE", inplace=True)
+                gdf = gdf.drop(columns="PARAMVALUE")
             # Separate damaged_facilities by geometry type
             if path.split('/')[-1].replace('.shp', '') == 'damaged_facilities':
                 # Create points shapefile
@@ -166,103 +424,58 @@ class StudyRegionDataFrame(pd.DataFrame):
                 path: str -- the output directory path, file name, and extention (example: 'C:/directory/filename.geojson')
         """
         try:
-            if 'geometry' not in self.columns:
-                self = self.addGeometry()
-            self['geometry'] = self['geometry'].apply(lambda x: loads(str(x)))
-            self['geometry'] = [MultiPolygon([x]) if type(
-                x) == Polygon else x for x in self['geometry']]
-            gdf = gpd.GeoDataFrame(self, geometry='geometry')
+            gdf = self.getGeoDataFrame().copy()
+            gdf['geometry'] = [MultiPolygon([x]) if type(
+                x) == Polygon else x for x in gdf['geometry']]
             gdf.to_file(path, driver='GeoJSON')
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
-    def toShapefiletoZipFile(self, path, in_epsg, out_epsg):
+    def toShapefiletoZipFile(self, path, in_epsg, out_epsg, compression=zipfile.ZIP_DEFLATED):
 
         """ Exports a StudyRegionDataFrame to an Esri Shapefile and zips it up into one zipfile
 
             Keyword Arguments: \n
-                path: str -- F)
+                path: str -- the shapefile path; the zipfile is written next to it with a .zip suffix (example: 'C:/directory/results.shp')
                 in_epsg: str -- Must follow this format 'epsg:4326' or 'epsg:3857'
                 out_epsg: str -- Must follow this format 'epsg:4326' or 'epsg:3857'
+                compression: int -- the zipfile compression, i.e. zipfile.ZIP_LZMA (default: zipfile.ZIP_DEFLATED)
 
             Notes: Shapefiles are made up of at least three files with the same name but different
-                file type, i.e. results.dbf, results.shp, results.shx. They can have additional files
-                with the following file types: .prj, .sbn, sbx, .fbn, .fbx, .ain, .aih, .ixs, .mxs,
-                .atx, .shp.xml, .cpg, .qix.
+                file type, i.e. results.dbf, results.shp, results.shx. The shapefile is written to a
+                private temporary directory, streamed into the zipfile and removed; no other files in
+                the output directory are touched.
         """
-        shapefileSuffixList = ['.shp', '.shx', '.dbf', '.prj', '.sbn',
-                               '.sbx', '.fbn', '.fbx', '.ain', '.aih',
-                               '.ixs', '.mxs', '.atx', '.shp.xml',
-                               '.cpg', '.qix']
         try:
-            if 'geometry' not in self.columns:
-                self = self.addGeometry()
-            self['geometry'] = self['geometry'].apply(lambda x: loads(str(x)))
-            gdf = gpd.GeoDataFrame(self, geometry='geometry')
-            if "PARAMVALUE" in gdf.columns:
-                gdf.drop(columns=['PARAMVALUE'], inplace=True)
-            try:
-                if gdf.crs is None:
-                    gdf.set_crs(in_epsg, inplace=True)
-            except Exception as e:
-                print('unable to set crs')
-                print(e)
             try:
-                gdf.to_crs(out_epsg, inplace=True)
+                gdf = self.getGeoDataFrame(crs=out_epsg, sourceCrs=in_epsg)
             except Exception as e:
                 print('unable to project')
                 print(e)
+                gdf = self.getGeoDataFrame(crs=None, sourceCrs=in_epsg)
             if "PARAMVALUE" in gdf.columns:
-                gdf.drop(columns="PARAMVALUE", inplace=True)
-            
-            # Separate damaged_facilities by geometry type
-            clean_path =  str(path)
-            if clean_path.split('\\')[-1].replace('.shp', '') == 'damaged_facilities':
-                # Create points shapefile
-                points_gdf = gdf[gdf['geometry'].geom_type == 'Point']
-                if not points_gdf.empty:
-                    points_path = clean_path.replace('.shp', '_points.shp')
-                    points_gdf.to_file(points_path, driver='ESRI Shapefile')
-                # Create lines shapefile
-                lines_gdf = gdf[gdf['geometry'].geom_type == 'LineString']
-                if not lines_gdf.empty:
-                    lines_path = clean_path.replace('.shp', '_lines.shp')
-                    lines_gdf.to_file(lines_path, driver='ESRI Shapefile')
-            else:
-                gdf.to_file(path, driver='ESRI Shapefile')
-        except Exception as e:
-            print(e)
-            print("Unexpected error toShapefiletoZipFile 1:", sys.exc_info()[0])
-            raise
-        try:
-            #Get filename from path (i.e. results.shp) and create a zipfile of the same name...
+                gdf = gdf.drop(columns=['PARAMVALUE'])
+
             pathObject = Path(path)
             pathZip = Path.joinpath(pathObject.parent, pathObject.stem + '.zip')
-            #For each shapefile suffix, see if it exists for filename from path and if so, append it to the zipfile...
-            with zipfile.ZipFile(pathZip, 'a') as myzip:
-                if 'damaged_facilities' in clean_path.split('\\')[-1].replace('.shp', ''):
-                    for filename in Path.iterdir(pathObject.parent):
-                        if fnmatch(filename.stem, 'damaged*') and filename.suffix in shapefileSuffixList:
-                            myzip.write(filename, filename.name)
+            with privateDirectory(pathZip) as directory:
+                # Separate damaged_facilities by geometry type
+                if pathObject.stem == 'damaged_facilities':
+                    # Create points shapefile
+                    points_gdf = gdf[gdf['geometry'].geom_type == 'Point']
+                    if not points_gdf.empty:
+                        points_gdf.to_file(str(Path.joinpath(directory, pathObject.stem + '_points.shp')), driver='ESRI Shapefile')
+                    # Create lines shapefile
+                    lines_gdf = gdf[gdf['geometry'].geom_type == 'LineString']
+                    if not lines_gdf.empty:
+                        lines_gdf.to_file(str(Path.joinpath(directory, pathObject.stem + '_lines.shp')), driver='ESRI Shapefile')
                 else:
-                    for suffix in shapefileSuffixList:
-                        shapefileFile = Path.joinpath(pathObject.parent, pathObject.stem + suffix)
-                        if shapefileFile.exists():
-                            myzip.write(shapefileFile, shapefileFile.name)
-        except Exception as e:
-            print(e)
-            print("Unexpected error toShapefiletoZipFile 2:", sys.exc_info()[0])
-            raise
-        try:
-            #Delete the shapefile...
-            driver = ogr.GetDriverByName("ESRI Shapefile")
-            for filename in Path.iterdir(pathObject.parent):
-                if filename.suffix == '.shp':
-                    driver.DeleteDataSource(str(filename))
+                    gdf.to_file(str(Path.joinpath(directory, pathObject.name)), driver='ESRI Shapefile')
+                zipShapefiles(pathZip, directory, compression=compression)
         except Exception as e:
             print(e)
-            print("Unexpected error toShapefiletoZipFile 3:", sys.exc_info()[0])
+            print("Unexpected error toShapefiletoZipFile:", sys.exc_info()[0])
             raise
 
     def toHLLGeoJSON(self, path):
@@ -273,12 +486,9 @@ class StudyRegionDataFrame(pd.DataFrame):
         
         '''
         try:
-            if 'geometry' not in self.columns:
-                self = self.addGeometry()
-            self['geometry'] = self['geometry'].apply(lambda x: loads(str(x)))
-            self['geometry'] = [MultiPolygon([x]) if type(
-                x) == Polygon else x for x in self['geometry']]
-            gdf = gpd.GeoDataFrame(self, geometry='geometry')
+            gdf = self.getGeoDataFrame().copy()
+            gdf['geometry'] = [MultiPolygon([x]) if type(
+                x) == Polygon else x for x in gdf['geometry']]
             #simplify shape...
             gdf['dissolvefield'] = 1
             dissolved = gdf.dissolve(by='dissolvefield')